@@ -1,29 +1,93 @@
 #!/usr/bin/env python3
+import sys
+import time
+
+# --- STARTUP PROFILER ---
+# With --profile-startup, every import made while loading this module is timed
+# (inclusive, attributed to the top-level import statement that triggered it).
+STARTUP_PROFILE = "--profile-startup" in sys.argv
+STARTUP_T0 = time.perf_counter()
+STARTUP_IMPORTS = {}
+STARTUP_MARKS = []
+
+if STARTUP_PROFILE:
+    import builtins
+    _builtin_import = builtins.__import__
+    _import_depth = [0]
+
+    def _timed_import(name, *args, **kwargs):
+        if _import_depth[0] or name in sys.modules:
+            _import_depth[0] += 1
+            try:
+                return _builtin_import(name, *args, **kwargs)
+            finally:
+                _import_depth[0] -= 1
+        _import_depth[0] += 1
+        start = time.perf_counter()
+        try:
+            return _builtin_import(name, *args, **kwargs)
+        finally:
+            _import_depth[0] -= 1
+            STARTUP_IMPORTS[name] = STARTUP_IMPORTS.get(name, 0) + time.perf_counter() - start
+
+    builtins.__import__ = _timed_import
+
+def startup_mark(label: str):
+    STARTUP_MARKS.append((label, time.perf_counter()))
+
 import os
 import re
 import aiohttp
+from aiohttp import web
 import asyncio
 import threading
 from pathlib import Path
 from datetime import datetime, timedelta
-from pyrogram import Client, filters
-from pyrogram.types import Message, BotCommand, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto, InputMediaVideo
-from pyrogram.enums import ParseMode
-from PIL import Image
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+from pyrogram import Client, filters, raw, StopPropagation
+from pyrogram.errors import RPCError, InternalServerError, FloodWait, FilePartMissing, UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid, ChatWriteForbidden, ChannelPrivate, ChatAdminRequired, UserNotParticipant
+from pyrogram.session import Session, Auth
+from pyrogram.file_id import FileId
+from pyrogram.types import Message, BotCommand, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+from pyrogram.enums import ParseMode, ChatMemberStatus, ChatType
 import subprocess
 import traceback
 import json 
-from flask import Flask, render_template_string
-import requests
-import time
+import html
+import sqlite3
+import hmac
+from urllib.parse import unquote
+import struct
 import math
+import functools
+import copy
+import importlib
+import resource
+from collections import OrderedDict, deque
 import logging
-import yt_dlp
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+startup_mark("imports")
+
+# --- LAZY IMPORTS ---
+# yt-dlp, Pillow and hachoir are only needed on specific paths, so
+# they are imported on first use instead of at startup.
+LAZY_MODULES = {}
+
+def lazy_module(name: str):
+    module = LAZY_MODULES.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        LAZY_MODULES[name] = module
+        logger.info(f"Lazy-loaded {name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return module
+
+async def lazy_module_async(name: str):
+    # First import of yt_dlp takes long enough to stall the loop, so do it off-thread.
+    if name in LAZY_MODULES:
+        return LAZY_MODULES[name]
+    return await asyncio.to_thread(lazy_module, name)
 
 # env
 API_ID = int(os.getenv("API_ID"))
@@ -36,31 +100,238 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 TMP = Path("tmp")
 TMP.mkdir(parents=True, exist_ok=True)
 
+# --- EXPIRING STATE ---
+# Interactive state that waits on a user reply lives in ExpiringState containers:
+# dict-like, with a TTL (sliding for sessions), a size cap that evicts the oldest
+# entry, and an on_evict hook that releases whatever the entry was holding on to.
+EXPIRING_REGISTRIES = []
+
+class ExpiringState:
+    def __init__(self, name: str, ttl: float, max_items: int, on_evict=None, sliding: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.max_items = max_items
+        self.on_evict = on_evict
+        self.sliding = sliding
+        self.evicted = 0
+        self._data = OrderedDict()
+        EXPIRING_REGISTRIES.append(self)
+
+    def _evict(self, key, reason: str):
+        _, value = self._data.pop(key)
+        self.evicted += 1
+        if self.on_evict:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                logger.warning(f"{self.name} eviction hook failed for {key}: {e}")
+
+    def purge(self) -> int:
+        # Entries are kept in expiry order, so expired ones are always at the front.
+        now = time.monotonic()
+        count = 0
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            self._evict(key, "expired")
+            count += 1
+        return count
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._evict(key, "expired")
+            return None
+        if self.sliding:
+            self._data[key] = (time.monotonic() + self.ttl, entry[1])
+            self._data.move_to_end(key)
+        return entry
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self.purge()
+        while len(self._data) > self.max_items:
+            self._evict(next(iter(self._data)), "capacity")
+
+    def __getitem__(self, key):
+        entry = self._live(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[1]
+
+    def get(self, key, default=None):
+        entry = self._live(key)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        return self._live(key) is not None
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def pop(self, key, *default):
+        # Explicit removal hands the value to the caller, so the hook does not run.
+        if self._live(key) is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._data.pop(key)[1]
+
+    def __len__(self):
+        self.purge()
+        return len(self._data)
+
+    def items(self):
+        self.purge()
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def memory_report(self) -> dict:
+        self.purge()
+        return {
+            'name': self.name, 'items': len(self._data), 'max_items': self.max_items,
+            'ttl_s': self.ttl, 'evicted': self.evicted,
+            'approx_bytes': approx_size(self._data),
+        }
+
+def approx_size(obj, depth: int = 0, seen: set = None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > 6:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, depth + 1, seen) + approx_size(v, depth + 1, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v, depth + 1, seen) for v in obj)
+    elif hasattr(obj, '__slots__') and not isinstance(obj, asyncio.Task):
+        size += sum(approx_size(getattr(obj, a, None), depth + 1, seen) for a in obj.__slots__)
+    return size
+
+async def expiring_state_janitor(interval: float = 60):
+    while True:
+        await asyncio.sleep(interval)
+        for registry in EXPIRING_REGISTRIES:
+            try:
+                registry.purge()
+            except Exception as e:
+                logger.warning(f"{registry.name} purge failed: {e}")
+
+def state_memory_report() -> dict:
+    return {
+        'registries': [registry.memory_report() for registry in EXPIRING_REGISTRIES],
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+class YtFormatChoice:
+    __slots__ = ('url', 'format_id', 'title', 'msg_id', 'is_audio')
+
+    def __init__(self, url: str, format_id: str, title: str, msg_id: int, is_audio: bool = False):
+        self.url = url
+        self.format_id = format_id
+        self.title = title
+        self.msg_id = msg_id
+        self.is_audio = is_audio
+
+class PendingAudioOrder:
+    __slots__ = ('uid', 'path', 'original_name', 'tracks', 'chat_id', 'message_id', 'download_task', 'caption_slot', 'created_at')
+
+    def __init__(self, uid: int, path: Path, original_name: str, tracks: list, chat_id: int, message_id: int, download_task=None, caption_slot=None):
+        self.uid = uid
+        self.path = path
+        self.original_name = original_name
+        self.tracks = tracks
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.download_task = download_task
+        self.caption_slot = caption_slot
+        self.created_at = time.time()
+
+class BatchItem:
+    __slots__ = ('kind', 'file_id', 'file_name', 'thumb_file_id', 'duration', 'width', 'height')
+
+    def __init__(self, m: Message, file_info):
+        self.kind = "video" if m.video or (getattr(file_info, 'duration', 0) or 0) > 0 else "document"
+        self.file_id = file_info.file_id
+        self.file_name = getattr(file_info, 'file_name', None)
+        thumbs = getattr(file_info, 'thumbs', None)
+        self.thumb_file_id = thumbs[0].file_id if thumbs else None
+        self.duration = getattr(file_info, 'duration', 0) or 0
+        self.width = getattr(file_info, 'width', 0) or 0
+        self.height = getattr(file_info, 'height', 0) or 0
+
+class MediaRef:
+    __slots__ = ('kind', 'file_id')
+
+    def __init__(self, m: Message):
+        self.kind = "photo" if m.photo else "video"
+        self.file_id = m.photo.file_id if m.photo else m.video.file_id
+
+def evict_audio_order(prompt_id, order: PendingAudioOrder, reason: str):
+    logger.info(f"Pending audio order {prompt_id} dropped ({reason}), removing {order.path}")
+    cancel_background_download(order)
+    release_caption_slots(order.uid, [order.caption_slot])
+    Path(order.path).unlink(missing_ok=True)
+
+def evict_post_creation(uid, state_data: dict, reason: str):
+    CREATE_POST_MODE.discard(uid)
+    if state_data.get('image_path'):
+        Path(state_data['image_path']).unlink(missing_ok=True)
+
+def evict_batch(uid, items: list, reason: str):
+    BATCH_STATUS_MSG.pop(uid, None)
+
+# --- USER MODE FLAGS ---
+# Mode sets drop the user's cached route on every change, so dispatch never has
+# to probe them (see USER STATE ROUTER).
+USER_ROUTES = {}
+
+class ModeFlag(set):
+    def add(self, uid):
+        super().add(uid)
+        USER_ROUTES.pop(uid, None)
+
+    def discard(self, uid):
+        super().discard(uid)
+        USER_ROUTES.pop(uid, None)
+
 # --- EXISTING STATE ---
 USER_THUMBS = {}
+USER_THUMB_FILE_IDS = {}
 TASKS = {}
-SET_THUMB_REQUEST = set()
+SET_THUMB_REQUEST = ModeFlag()
 SUBSCRIBERS = set()
-SET_CAPTION_REQUEST = set()
+SET_CAPTION_REQUEST = ModeFlag()
 USER_CAPTIONS = {}
 USER_COUNTERS = {}
-EDIT_CAPTION_MODE = set()
+EDIT_CAPTION_MODE = ModeFlag()
 USER_THUMB_TIME = {}
-MKV_AUDIO_CHANGE_MODE = set()
-PENDING_AUDIO_ORDERS = {} 
-CREATE_POST_MODE = set()
-POST_CREATION_STATE = {} 
-BATCH_CAPTION_MODE = set()
-BATCH_DATA = {}
+MKV_AUDIO_CHANGE_MODE = ModeFlag()
+TRANSCODE_MODE = ModeFlag()
+PENDING_AUDIO_ORDERS = ExpiringState("pending_audio_orders", ttl=float(os.getenv("AUDIO_ORDER_TTL", "1800")), max_items=20, on_evict=evict_audio_order)
+CREATE_POST_MODE = ModeFlag()
+POST_CREATION_STATE = ExpiringState("post_creation_state", ttl=3600, max_items=100, on_evict=evict_post_creation, sliding=True)
+BATCH_CAPTION_MODE = ModeFlag()
+BATCH_DATA = ExpiringState("batch_data", ttl=6 * 3600, max_items=50, on_evict=evict_batch, sliding=True)
 BATCH_STATUS_MSG = {}
 USER_QUEUES = {}
+QUEUED_JOBS = {}  # uid -> deque of {'name', 'enqueued_at'} for items still waiting in USER_QUEUES
 USER_WORKERS = {}
 USER_UPLOAD_LOCKS = {}
-YT_DATA = {}
+YT_DATA = ExpiringState("yt_format_choices", ttl=1800, max_items=500)
 
 # --- NEW STATE FOR CHANNEL POST BOT ---
 CHANNELS_FILE = 'channels.json'
-user_data = {} # Stores session state for posting
+user_data = ExpiringState("post_sessions", ttl=2 * 3600, max_items=100, sliding=True) # Stores session state for posting
 
 # States for Post Bot
 STATE_IDLE = "IDLE"
@@ -80,11 +351,26 @@ DEFAULT_POST_DATA = {
     'season_list_raw': "1, 2" 
 }
 
-MAX_SIZE = 4 * 1024 * 1024 * 1024
+MAX_SIZE = int(os.getenv("MAX_DOWNLOAD_SIZE_GB", "16")) * 1024 * 1024 * 1024
+UPLOAD_PART_LIMIT = int(os.getenv("UPLOAD_PART_LIMIT_MB", "1990")) * 1024 * 1024
+
+# Handlers only hand messages to the per-user router, so a small pool is enough.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+
+# send_* hand local paths to save_file; a path already pushed by preupload_file is
+# answered with its InputFile instead of being uploaded a second time.
+class BotClient(Client):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preuploaded_files = {}
+
+    async def save_file(self, path, *args, **kwargs):
+        if isinstance(path, str) and path in self.preuploaded_files:
+            return self.preuploaded_files.pop(path)
+        return await super().save_file(path, *args, **kwargs)
 
-# Updated workers to 1000 as requested
-app = Client("mybot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, workers=1000)
-flask_app = Flask(__name__)
+app = BotClient("mybot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, workers=UPDATE_WORKERS)
+startup_mark("client")
 
 # ---- utilities ----
 def is_admin(uid: int) -> bool:
@@ -96,22 +382,137 @@ def is_admin_filter(_, __, message: Message):
 
 admin_filter = filters.create(is_admin_filter)
 
+def is_command_text(_, __, message: Message):
+    return (message.text or message.caption or "").startswith("/")
+
+command_text_filter = filters.create(is_command_text)
+
+# --- EMBEDDED DATABASE ---
+# One SQLite file (WAL journal) backs subscribers, broadcasts, channels and user
+# settings. Calls are serialized through BOT_DB_LOCK; async code runs them via to_thread.
+BOT_DB_FILE = os.getenv("BOT_DB_FILE", "bot_state.db")
+BOT_DB_LOCK = threading.Lock()
+BOT_DB = None
+
+def get_bot_db():
+    global BOT_DB
+    if BOT_DB is None:
+        BOT_DB = sqlite3.connect(BOT_DB_FILE, check_same_thread=False)
+        BOT_DB.execute("PRAGMA journal_mode=WAL")
+        BOT_DB.executescript("""
+            CREATE TABLE IF NOT EXISTS subscribers (
+                chat_id INTEGER PRIMARY KEY,
+                added_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS channels (
+                chat_id TEXT PRIMARY KEY,
+                title TEXT,
+                meta TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                from_chat_id INTEGER,
+                message_id INTEGER,
+                status_chat_id INTEGER,
+                status_message_id INTEGER,
+                cursor INTEGER,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                pruned INTEGER DEFAULT 0,
+                state TEXT,
+                started_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS file_ids (
+                key TEXT PRIMARY KEY,
+                file_id TEXT,
+                kind TEXT,
+                name TEXT,
+                time REAL
+            );
+        """)
+    return BOT_DB
+
+def bot_db_execute(sql: str, params=(), fetch: bool = False, many: bool = False):
+    with BOT_DB_LOCK:
+        db = get_bot_db()
+        cur = db.executemany(sql, params) if many else db.execute(sql, params)
+        result = cur.fetchall() if fetch else cur.lastrowid
+        db.commit()
+        return result
+
 # --- NEW UTILITIES FOR POST BOT ---
+# Channel registry: saved_channels keeps {chat_id: title} for the menus, CHANNEL_META
+# holds the cached title/permissions/last post id; both are written through to SQLite.
+CHANNEL_META = {}
+
 def load_channels():
-    if not os.path.exists(CHANNELS_FILE):
-        return {}
     try:
-        with open(CHANNELS_FILE, 'r') as f:
-            return json.load(f)
-    except:
+        rows = bot_db_execute("SELECT chat_id, title, meta FROM channels", fetch=True)
+        if not rows and os.path.exists(CHANNELS_FILE):
+            rows = migrate_channels_json()
+    except Exception as e:
+        logger.error(f"Channel registry load error: {e}")
         return {}
+    channels = {}
+    for chat_id, title, meta in rows:
+        channels[chat_id] = title
+        CHANNEL_META[chat_id] = json.loads(meta) if meta else {"title": title}
+    return channels
+
+def migrate_channels_json():
+    with open(CHANNELS_FILE, 'r') as f:
+        legacy = json.load(f)
+    metas = {str(cid): {"title": title} for cid, title in legacy.items()}
+    write_channel_rows(metas)
+    os.replace(CHANNELS_FILE, CHANNELS_FILE + ".migrated")
+    logger.info(f"Migrated {len(metas)} channels from {CHANNELS_FILE}")
+    return [(cid, meta["title"], json.dumps(meta)) for cid, meta in metas.items()]
+
+def write_channel_rows(metas: dict):
+    now = time.time()
+    bot_db_execute(
+        "INSERT OR REPLACE INTO channels (chat_id, title, meta, updated_at) VALUES (?, ?, ?, ?)",
+        [(cid, meta.get("title"), json.dumps(meta), now) for cid, meta in metas.items()], many=True
+    )
+
+def update_channel_rows(metas: dict):
+    # UPDATE only: a channel removed while a refresh was in flight stays removed.
+    now = time.time()
+    bot_db_execute(
+        "UPDATE channels SET title = ?, meta = ?, updated_at = ? WHERE chat_id = ?",
+        [(meta.get("title"), json.dumps(meta), now, cid) for cid, meta in metas.items()], many=True
+    )
 
-def save_channels(channels):
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels, f, indent=4)
+async def add_channel(chat_id: str, title: str):
+    meta = {**CHANNEL_META.get(chat_id, {}), "title": title}
+    CHANNEL_META[chat_id] = meta
+    saved_channels[chat_id] = title
+    await asyncio.to_thread(write_channel_rows, {chat_id: meta})
+
+async def save_channels_meta(updates: dict):
+    # updates: {chat_id: {field: value}}, merged into the cached metadata of
+    # channels that are still registered; unknown ids are ignored.
+    metas = {}
+    for cid, fields in updates.items():
+        if cid not in saved_channels:
+            continue
+        meta = {**CHANNEL_META.get(cid, {}), **fields}
+        CHANNEL_META[cid] = meta
+        if meta.get("title"):
+            saved_channels[cid] = meta["title"]
+        metas[cid] = meta
+    if metas:
+        await asyncio.to_thread(update_channel_rows, metas)
+
+async def remove_channel(chat_id: str):
+    saved_channels.pop(chat_id, None)
+    CHANNEL_META.pop(chat_id, None)
+    await asyncio.to_thread(bot_db_execute, "DELETE FROM channels WHERE chat_id = ?", (chat_id,))
 
 # Load channels on startup
 saved_channels = load_channels()
+startup_mark("channel registry")
 
 def get_edit_menu_markup():
     return InlineKeyboardMarkup([
@@ -160,6 +561,15 @@ def extract_drive_id(url: str) -> str:
             return m.group(1)
     return None
 
+def extract_drive_folder_id(url: str) -> str:
+    if not is_drive_url(url):
+        return None
+    m = re.search(r"/folders/([a-zA-Z0-9_-]+)", url) or re.search(r"folderview\?(?:.*&)?id=([a-zA-Z0-9_-]+)", url)
+    return m.group(1) if m else None
+
+def natural_sort_key(name: str) -> list:
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name or "")]
+
 def generate_new_filename(original_name: str) -> str:
     BASE_NEW_NAME = "[@TA_HD_Anime] Telegram Channel"
     file_path = Path(original_name)
@@ -172,7 +582,300 @@ def generate_new_filename(original_name: str) -> str:
         
     return BASE_NEW_NAME + file_ext
 
+# --- HEADER-ONLY CONTAINER PARSER ---
+# Reads only the MP4 moov/mvhd/tkhd boxes or the MKV Segment Info/Tracks elements
+# with small seeks, so the common case never spawns ffprobe or runs hachoir.
+MKV_EBML_ID = 0x1A45DFA3
+MKV_SEGMENT_ID = 0x18538067
+MKV_SEEKHEAD_ID = 0x114D9B74
+MKV_SEEK_ID = 0x4DBB
+MKV_SEEK_ELEMENT_ID = 0x53AB
+MKV_SEEK_POSITION_ID = 0x53AC
+MKV_INFO_ID = 0x1549A966
+MKV_TIMECODE_SCALE_ID = 0x2AD7B1
+MKV_DURATION_ID = 0x4489
+MKV_TRACKS_ID = 0x1654AE6B
+MKV_TRACK_ENTRY_ID = 0xAE
+MKV_TRACK_TYPE_ID = 0x83
+MKV_CODEC_ID = 0x86
+MKV_LANGUAGE_ID = 0x22B59C
+MKV_NAME_ID = 0x536E
+MKV_VIDEO_ID = 0xE0
+MKV_PIXEL_WIDTH_ID = 0xB0
+MKV_PIXEL_HEIGHT_ID = 0xBA
+MKV_CLUSTER_ID = 0x1F43B675
+
+def _empty_header_info() -> dict:
+    return {'duration_us': 0, 'width': 0, 'height': 0, 'codecs': [], 'audio_tracks': []}
+
+def _mp4_boxes(read_at, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        hdr = read_at(pos, 16)
+        if len(hdr) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", hdr[:8])
+        header_len = 8
+        if size == 1:
+            if len(hdr) < 16:
+                return
+            size = struct.unpack(">Q", hdr[8:16])[0]
+            header_len = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_len:
+            return
+        yield box_type.decode("latin-1"), pos + header_len, min(pos + size, end)
+        pos += size
+
+def _mp4_child(read_at, start: int, end: int, name: str):
+    for box_type, body_start, body_end in _mp4_boxes(read_at, start, end):
+        if box_type == name:
+            return body_start, body_end
+    return None
+
+def _mp4_language(packed: int) -> str:
+    if not packed:
+        return 'und'
+    return "".join(chr(((packed >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+
+def _parse_mp4_trak(read_at, start: int, end: int) -> dict:
+    track = {'type': None, 'codec': None, 'width': 0, 'height': 0, 'language': 'und'}
+    tkhd = _mp4_child(read_at, start, end, "tkhd")
+    if tkhd:
+        body = read_at(tkhd[0], 96)
+        offset = 88 if body[:1] == b"\x01" else 76
+        if len(body) >= offset + 8:
+            width, height = struct.unpack(">II", body[offset:offset + 8])
+            track['width'], track['height'] = width >> 16, height >> 16
+
+    mdia = _mp4_child(read_at, start, end, "mdia")
+    if not mdia:
+        return track
+    for box_type, body_start, body_end in _mp4_boxes(read_at, *mdia):
+        if box_type == "mdhd":
+            body = read_at(body_start, 34)
+            offset = 32 if body[:1] == b"\x01" else 20
+            if len(body) >= offset + 2:
+                track['language'] = _mp4_language(struct.unpack(">H", body[offset:offset + 2])[0])
+        elif box_type == "hdlr":
+            body = read_at(body_start, 12)
+            if len(body) >= 12:
+                track['type'] = body[8:12].decode("latin-1")
+        elif box_type == "minf":
+            stbl = _mp4_child(read_at, body_start, body_end, "stbl")
+            stsd = _mp4_child(read_at, *stbl, "stsd") if stbl else None
+            if stsd:
+                body = read_at(stsd[0], 44)
+                if len(body) >= 16:
+                    track['codec'] = body[12:16].decode("latin-1").strip()
+                if len(body) >= 44 and not (track['width'] and track['height']):
+                    track['width'], track['height'] = struct.unpack(">HH", body[40:44])
+    return track
+
+def _parse_mp4_header(read_at, total_size: int) -> dict:
+    moov = _mp4_child(read_at, 0, total_size, "moov")
+    if not moov:
+        return None
+    info = _empty_header_info()
+    stream_index = 0
+    for box_type, body_start, body_end in _mp4_boxes(read_at, *moov):
+        if box_type == "mvhd":
+            body = read_at(body_start, 32)
+            if body[:1] == b"\x01" and len(body) >= 32:
+                timescale, duration = struct.unpack(">IQ", body[20:32])
+            elif len(body) >= 20:
+                timescale, duration = struct.unpack(">II", body[12:20])
+            else:
+                continue
+            if timescale:
+                info['duration_us'] = duration * 1_000_000 // timescale
+        elif box_type == "trak":
+            track = _parse_mp4_trak(read_at, body_start, body_end)
+            if track['codec']:
+                info['codecs'].append(track['codec'])
+            if track['type'] == "vide" and not info['width']:
+                info['width'], info['height'] = track['width'], track['height']
+            elif track['type'] == "soun":
+                info['audio_tracks'].append({
+                    'stream_index': stream_index,
+                    'title': 'N/A',
+                    'language': track['language'],
+                    'codec': track['codec'],
+                })
+            stream_index += 1
+    return info
+
+def _ebml_vint(data: bytes, pos: int, keep_marker: bool = False):
+    if pos >= len(data):
+        raise ValueError("EBML data truncated")
+    first = data[pos]
+    length, mask = 1, 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError("Invalid EBML variable-length integer")
+    value = first if keep_marker else first & (mask - 1)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return (None if unknown else value), length
+
+def _ebml_elements(read_at, start: int, end: int):
+    pos = start
+    while pos < end:
+        hdr = read_at(pos, 12)
+        if len(hdr) < 2:
+            return
+        element_id, id_len = _ebml_vint(hdr, 0, keep_marker=True)
+        size, size_len = _ebml_vint(hdr, id_len)
+        body_start = pos + id_len + size_len
+        body_end = end if size is None else min(body_start + size, end)
+        yield element_id, body_start, body_end, size is None
+        if size is None:
+            return
+        pos = body_end
+
+def _ebml_uint(read_at, start: int, end: int) -> int:
+    return int.from_bytes(read_at(start, min(end - start, 8)), "big")
+
+def _ebml_float(read_at, start: int, end: int) -> float:
+    body = read_at(start, end - start)
+    if len(body) == 4:
+        return struct.unpack(">f", body)[0]
+    if len(body) == 8:
+        return struct.unpack(">d", body)[0]
+    return 0.0
+
+def _ebml_string(read_at, start: int, end: int) -> str:
+    return read_at(start, min(end - start, 256)).split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
+
+def _parse_mkv_info(read_at, start: int, end: int, info: dict):
+    timecode_scale, duration = 1_000_000, 0.0
+    for element_id, body_start, body_end, _ in _ebml_elements(read_at, start, end):
+        if element_id == MKV_TIMECODE_SCALE_ID:
+            timecode_scale = _ebml_uint(read_at, body_start, body_end) or 1_000_000
+        elif element_id == MKV_DURATION_ID:
+            duration = _ebml_float(read_at, body_start, body_end)
+    info['duration_us'] = int(duration * timecode_scale / 1000)
+
+def _parse_mkv_tracks(read_at, start: int, end: int, info: dict):
+    stream_index = 0
+    for element_id, body_start, body_end, _ in _ebml_elements(read_at, start, end):
+        if element_id != MKV_TRACK_ENTRY_ID:
+            continue
+        track = {'type': 0, 'codec': None, 'language': 'eng', 'title': 'N/A', 'width': 0, 'height': 0}
+        for child_id, child_start, child_end, _ in _ebml_elements(read_at, body_start, body_end):
+            if child_id == MKV_TRACK_TYPE_ID:
+                track['type'] = _ebml_uint(read_at, child_start, child_end)
+            elif child_id == MKV_CODEC_ID:
+                track['codec'] = _ebml_string(read_at, child_start, child_end)
+            elif child_id == MKV_LANGUAGE_ID:
+                track['language'] = _ebml_string(read_at, child_start, child_end) or 'und'
+            elif child_id == MKV_NAME_ID:
+                track['title'] = _ebml_string(read_at, child_start, child_end) or 'N/A'
+            elif child_id == MKV_VIDEO_ID:
+                for video_id, video_start, video_end, _ in _ebml_elements(read_at, child_start, child_end):
+                    if video_id == MKV_PIXEL_WIDTH_ID:
+                        track['width'] = _ebml_uint(read_at, video_start, video_end)
+                    elif video_id == MKV_PIXEL_HEIGHT_ID:
+                        track['height'] = _ebml_uint(read_at, video_start, video_end)
+        if track['codec']:
+            info['codecs'].append(track['codec'])
+        if track['type'] == 1 and not info['width']:
+            info['width'], info['height'] = track['width'], track['height']
+        elif track['type'] == 2:
+            info['audio_tracks'].append({
+                'stream_index': stream_index,
+                'title': track['title'],
+                'language': track['language'],
+                'codec': track['codec'],
+            })
+        stream_index += 1
+
+def _parse_mkv_header(read_at, total_size: int) -> dict:
+    segment = None
+    for element_id, body_start, body_end, _ in _ebml_elements(read_at, 0, total_size):
+        if element_id == MKV_SEGMENT_ID:
+            segment = (body_start, body_end)
+            break
+    if not segment:
+        return None
+
+    info = _empty_header_info()
+    found = set()
+    seek_positions = {}
+    for element_id, body_start, body_end, _ in _ebml_elements(read_at, *segment):
+        if element_id == MKV_SEEKHEAD_ID:
+            for seek_id, seek_start, seek_end, _ in _ebml_elements(read_at, body_start, body_end):
+                if seek_id != MKV_SEEK_ID:
+                    continue
+                target_id, target_pos = None, None
+                for child_id, child_start, child_end, _ in _ebml_elements(read_at, seek_start, seek_end):
+                    if child_id == MKV_SEEK_ELEMENT_ID:
+                        target_id = _ebml_uint(read_at, child_start, child_end)
+                    elif child_id == MKV_SEEK_POSITION_ID:
+                        target_pos = _ebml_uint(read_at, child_start, child_end)
+                if target_id is not None and target_pos is not None:
+                    seek_positions[target_id] = segment[0] + target_pos
+        elif element_id == MKV_INFO_ID:
+            _parse_mkv_info(read_at, body_start, body_end, info)
+            found.add(element_id)
+        elif element_id == MKV_TRACKS_ID:
+            _parse_mkv_tracks(read_at, body_start, body_end, info)
+            found.add(element_id)
+        elif element_id == MKV_CLUSTER_ID:
+            break
+        if {MKV_INFO_ID, MKV_TRACKS_ID} <= found:
+            return info
+
+    # Info/Tracks placed after the clusters: follow the SeekHead instead of scanning media data.
+    for element_id, parse in ((MKV_INFO_ID, _parse_mkv_info), (MKV_TRACKS_ID, _parse_mkv_tracks)):
+        if element_id in found or element_id not in seek_positions:
+            continue
+        for found_id, body_start, body_end, _ in _ebml_elements(read_at, seek_positions[element_id], segment[1]):
+            if found_id == element_id:
+                parse(read_at, body_start, body_end, info)
+                found.add(element_id)
+            break
+    return info if MKV_TRACKS_ID in found else None
+
+def parse_container_header(read_at, total_size: int) -> dict:
+    head = read_at(0, 12)
+    if len(head) < 8:
+        return None
+    if int.from_bytes(head[:4], "big") == MKV_EBML_ID:
+        return _parse_mkv_header(read_at, total_size)
+    if head[4:8] in (b"ftyp", b"moov", b"free", b"mdat", b"wide", b"skip"):
+        return _parse_mp4_header(read_at, total_size)
+    return None
+
+def probe_media_header(file_path: Path) -> dict:
+    try:
+        with open(file_path, "rb") as f:
+            total_size = os.fstat(f.fileno()).st_size
+
+            def read_at(offset, size):
+                f.seek(offset)
+                return f.read(max(0, min(size, total_size - offset)))
+
+            return parse_container_header(read_at, total_size)
+    except Exception as e:
+        logger.warning(f"Header-only probe failed for {file_path}: {e}")
+        return None
+
 def get_video_metadata(file_path: Path) -> dict:
+    header = probe_media_header(file_path)
+    if header and header['width'] and header['height'] and header['duration_us']:
+        return {
+            'duration': header['duration_us'] // 1_000_000,
+            'width': header['width'],
+            'height': header['height'],
+        }
+    return get_video_metadata_ffprobe(file_path)
+
+def get_video_metadata_ffprobe(file_path: Path) -> dict:
     data = {'duration': 0, 'width': 0, 'height': 0}
     try:
         cmd = [
@@ -214,11 +917,11 @@ def get_video_metadata(file_path: Path) -> dict:
     except Exception as e:
         logger.warning(f"FFprobe metadata extraction failed: {e}. Trying Hachoir fallback...")
         try:
-            parser = createParser(str(file_path))
+            parser = lazy_module("hachoir.parser").createParser(str(file_path))
             if not parser:
                 return data 
             with parser:
-                h_metadata = extractMetadata(parser)
+                h_metadata = lazy_module("hachoir.metadata").extractMetadata(parser)
             if not h_metadata:
                 return data 
             
@@ -256,7 +959,7 @@ def mode_check_keyboard(uid: int) -> InlineKeyboardMarkup:
     audio_status = "✅ ON" if uid in MKV_AUDIO_CHANGE_MODE else "❌ OFF"
     caption_status = "✅ ON" if uid in EDIT_CAPTION_MODE else "❌ OFF"
     
-    waiting_count = sum(1 for data in PENDING_AUDIO_ORDERS.values() if data['uid'] == uid)
+    waiting_count = sum(1 for order in PENDING_AUDIO_ORDERS.values() if order.uid == uid)
     waiting_status = f" ({waiting_count}টি অর্ডার বাকি)" if waiting_count > 0 else ""
     
     keyboard = [
@@ -294,6 +997,9 @@ def get_audio_tracks_ffprobe(file_path: Path) -> list:
         return []
 
 def has_opus_audio(file_path: Path) -> bool:
+    header = probe_media_header(file_path)
+    if header and header['audio_tracks']:
+        return any("opus" in (track['codec'] or "").lower() for track in header['audio_tracks'])
     try:
         cmd = [
             "ffprobe",
@@ -318,6 +1024,187 @@ def format_size(bytes_size):
     s = round(bytes_size / p, 2)
     return "%s %s" % (s, size_name[i])
 
+def prepare_thumb_image(path: Path):
+    img = lazy_module("PIL.Image").open(path)
+    img.thumbnail((320, 320))
+    img = img.convert("RGB")
+    img.save(path, "JPEG")
+
+def format_eta(seconds) -> str:
+    if seconds is None or seconds < 0:
+        return "N/A"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}h {m:02d}m {s:02d}s" if h else f"{m}m {s:02d}s"
+
+# --- PROGRESS REPORTER ---
+# One reporter per status message. Every stage (download, remux, upload) feeds byte
+# counts into it; the message is edited at most once per PROGRESS_EDIT_INTERVAL and
+# only when the rendered text actually changed.
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "5"))
+PROGRESS_SPEED_SMOOTHING = 0.3
+PROGRESS_REPORTERS = {}
+THROUGHPUT_MINUTES = {}
+
+def record_throughput(nbytes: int):
+    minute = int(time.time() // 60)
+    THROUGHPUT_MINUTES[minute] = THROUGHPUT_MINUTES.get(minute, 0) + nbytes
+    if len(THROUGHPUT_MINUTES) > 24 * 60 + 60:
+        cutoff = minute - 24 * 60
+        for key in [k for k in THROUGHPUT_MINUTES if k < cutoff]:
+            del THROUGHPUT_MINUTES[key]
+
+def throughput_histogram(window_minutes: int, bucket_minutes: int) -> list:
+    now_minute = int(time.time() // 60)
+    buckets = [0] * (window_minutes // bucket_minutes)
+    for minute, nbytes in THROUGHPUT_MINUTES.items():
+        age = now_minute - minute
+        if 0 <= age < window_minutes:
+            buckets[len(buckets) - 1 - age // bucket_minutes] += nbytes
+    return buckets
+
+class ProgressReporter:
+    def __init__(self, message: Message, stage: str = "", total: int = 0):
+        self.message = message
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.speed = 0.0
+        self.started = time.monotonic()
+        self.last_sample = (self.started, 0)
+        self.last_text = None
+        self.next_edit_at = 0.0
+        self.edit_task = None
+        self.updated_at = self.started
+
+    def set_stage(self, stage: str, total: int = 0):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.speed = 0.0
+        self.last_sample = (time.monotonic(), 0)
+        self.next_edit_at = 0.0
+        self.update(0, total)
+
+    def update(self, done: int, total: int = None):
+        now = time.monotonic()
+        if total:
+            self.total = total
+        sample_time, sample_done = self.last_sample
+        if now - sample_time >= 1 and done >= sample_done:
+            current = (done - sample_done) / (now - sample_time)
+            self.speed = current if not self.speed else (
+                PROGRESS_SPEED_SMOOTHING * current + (1 - PROGRESS_SPEED_SMOOTHING) * self.speed
+            )
+            self.last_sample = (now, done)
+        if done > self.done:
+            record_throughput(done - self.done)
+        self.done = done
+        self.updated_at = now
+        if now >= self.next_edit_at and (self.edit_task is None or self.edit_task.done()):
+            self.next_edit_at = now + PROGRESS_EDIT_INTERVAL
+            self.edit_task = asyncio.create_task(self._edit())
+
+    async def progress(self, current, total):
+        self.update(current, total)
+
+    def render(self) -> str:
+        lines = [self.stage]
+        if self.total:
+            pct = min(100.0, self.done * 100 / self.total)
+            filled = int(pct // 10)
+            lines.append(f"[{'█' * filled}{'░' * (10 - filled)}] {pct:.1f}%")
+            lines.append(f"{format_size(self.done)} / {format_size(self.total)}")
+        elif self.done:
+            lines.append(format_size(self.done))
+        if self.speed:
+            eta = (self.total - self.done) / self.speed if self.total else None
+            lines.append(f"Speed: {format_size(self.speed)}/s | ETA: {format_eta(eta)}")
+        return "\n".join(lines)
+
+    async def _edit(self):
+        text = self.render()
+        if text == self.last_text:
+            return
+        try:
+            await self.message.edit(text, reply_markup=progress_keyboard())
+            self.last_text = text
+        except FloodWait as e:
+            self.next_edit_at = time.monotonic() + e.value
+        except Exception:
+            pass
+
+def get_progress_reporter(message: Message, stage: str = None, total: int = 0):
+    if not message:
+        return None
+    key = (message.chat.id, message.id)
+    reporter = PROGRESS_REPORTERS.get(key)
+    if reporter is None:
+        reporter = PROGRESS_REPORTERS[key] = ProgressReporter(message, stage or "", total)
+    if stage is not None:
+        reporter.set_stage(stage, total)
+    return reporter
+
+# Edits are throttled, so the last updates of a stage may not be on screen yet:
+# closing renders them once more (the trailing edge) unless flush is False.
+async def close_progress_reporter(message: Message, flush: bool = True):
+    if not message:
+        return
+    reporter = PROGRESS_REPORTERS.pop((message.chat.id, message.id), None)
+    if not reporter:
+        return
+    if reporter.edit_task and not reporter.edit_task.done():
+        reporter.edit_task.cancel()
+    if flush:
+        await reporter._edit()
+
+def prune_progress_reporters(max_idle: float = 3600):
+    now = time.monotonic()
+    for key, reporter in list(PROGRESS_REPORTERS.items()):
+        if now - reporter.updated_at > max_idle:
+            PROGRESS_REPORTERS.pop(key, None)
+
+# --- RATE LIMITER ---
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        # Amounts above the burst size (byte budgets) are taken as debt and slept off by later callers.
+        needed = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+async def call_with_flood_wait(limiter: RateLimiter, func, *args, retries: int = 3, **kwargs):
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWait as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"FloodWait {e.value}s in {getattr(func, '__name__', func)}")
+            limiter.pause(e.value)
+
 def generate_post_caption(data: dict) -> str:
     image_name = data.get('image_name', DEFAULT_POST_DATA['image_name'])
     genres = data.get('genres', DEFAULT_POST_DATA['genres'])
@@ -380,29 +1267,42 @@ def generate_post_caption(data: dict) -> str:
     return final_caption
 
 
-async def download_stream(resp, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None):
-    total = 0
+async def download_stream(resp, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None, bandwidth: RateLimiter = None, progress=None, offset: int = 0):
+    # offset > 0 appends to a partial file (the response must be a 206 for bytes offset-).
+    total = offset
     try:
         size = int(resp.headers.get("Content-Length", 0))
     except:
         size = 0
+    if size and offset:
+        size += offset
     chunk_size = 1024 * 1024
+    reporter = get_progress_reporter(message, "ডাউনলোড হচ্ছে...", size)
     try:
-        with out_path.open("wb") as f:
+        with out_path.open("ab" if offset else "wb") as f:
             async for chunk in resp.content.iter_chunked(chunk_size):
                 if cancel_event and cancel_event.is_set():
                     return False, "অপারেশন ব্যবহারকারী দ্বারা বাতিল করা হয়েছে।"
                 if not chunk:
                     break
                 if total > MAX_SIZE:
-                    return False, "ফাইলের সাইজ 4GB এর বেশি হতে পারে না।"
+                    return False, f"ফাইলের সাইজ {format_size(MAX_SIZE)} এর বেশি হতে পারে না।"
+                if bandwidth:
+                    await bandwidth.acquire(len(chunk))
                 total += len(chunk)
                 f.write(chunk)
+                if reporter:
+                    reporter.update(total)
+                if progress:
+                    await progress(total, size)
     except Exception as e:
         return False, str(e)
+    finally:
+        await close_progress_reporter(message)
     return True, None
 
-async def download_url_generic(url: str, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None):
+# With meta, the server's Content-Disposition filename (if any) is stored in meta['filename'].
+async def download_url_generic(url: str, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None, bandwidth: RateLimiter = None, progress=None, meta: dict = None):
     timeout = aiohttp.ClientTimeout(total=7200)
     headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
     connector = aiohttp.TCPConnector(limit=0, force_close=True)
@@ -411,45 +1311,66 @@ async def download_url_generic(url: str, out_path: Path, message: Message = None
             async with sess.get(url, allow_redirects=True) as resp:
                 if resp.status != 200:
                     return False, f"HTTP {resp.status}"
-                return await download_stream(resp, out_path, message, cancel_event=cancel_event)
+                if meta is not None:
+                    meta['filename'] = getattr(resp.content_disposition, 'filename', None)
+                return await download_stream(resp, out_path, message, cancel_event=cancel_event, bandwidth=bandwidth, progress=progress)
         except Exception as e:
             return False, str(e)
 
-async def download_drive_file(file_id: str, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None):
-    base = f"https://drive.google.com/uc?export=download&id={file_id}"
-    timeout = aiohttp.ClientTimeout(total=7200)
-    headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
-    connector = aiohttp.TCPConnector(limit=0, force_close=True)
-    async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as sess:
-        try:
-            async with sess.get(base, allow_redirects=True) as resp:
-                if resp.status == 200 and "content-disposition" in (k.lower() for k in resp.headers.keys()):
-                    return await download_stream(resp, out_path, message, cancel_event=cancel_event)
-                text = await resp.text(errors="ignore")
-                m = re.search(r"confirm=([0-9A-Za-z-_]+)", text)
-                if m:
-                    token = m.group(1)
-                    download_url = f"https://drive.google.com/uc?export=download&confirm={token}&id={file_id}"
-                    async with sess.get(download_url, allow_redirects=True) as resp2:
-                        if resp2.status != 200:
-                            return False, f"HTTP {resp2.status}"
-                        return await download_stream(resp2, out_path, message, cancel_event=cancel_event)
-                for k, v in resp.cookies.items():
-                    if k.startswith("download_warning"):
-                        token = v.value
-                        download_url = f"https://drive.google.com/uc?export=download&confirm={token}&id={file_id}"
-                        async with sess.get(download_url, allow_redirects=True) as resp2:
-                            if resp2.status != 200:
-                                return False, f"HTTP {resp2.status}"
-                            return await download_stream(resp2, out_path, message, cancel_event=cancel_event)
-                return False, "ডাউনলোডের জন্য Google Drive থেকে অনুমতি প্রয়োজন বা লিংক পাবলিক নয়।"
-        except Exception as e:
-            return False, str(e)
+DRIVE_BASE_URL = os.getenv("DRIVE_BASE_URL", "https://drive.google.com").rstrip("/")
+
+async def download_drive_file(file_id: str, out_path: Path, message: Message = None, cancel_event: asyncio.Event = None, bandwidth: RateLimiter = None, progress=None, session: aiohttp.ClientSession = None, resume: bool = False, meta: dict = None):
+    if session is None:
+        timeout = aiohttp.ClientTimeout(total=7200)
+        headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+        connector = aiohttp.TCPConnector(limit=0, force_close=True)
+        async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as sess:
+            return await download_drive_file(file_id, out_path, message, cancel_event, bandwidth, progress, session=sess, resume=resume, meta=meta)
+
+    sess = session
+    offset = out_path.stat().st_size if resume and out_path.exists() else 0
+    range_headers = {"Range": f"bytes={offset}-"} if offset else None
+
+    async def stream(resp):
+        if resp.status not in (200, 206):
+            return False, f"HTTP {resp.status}"
+        if meta is not None:
+            meta['filename'] = getattr(resp.content_disposition, 'filename', None)
+        return await download_stream(resp, out_path, message, cancel_event=cancel_event, bandwidth=bandwidth, progress=progress, offset=offset if resp.status == 206 else 0)
+
+    base = f"{DRIVE_BASE_URL}/uc?export=download&id={file_id}"
+    try:
+        async with sess.get(base, allow_redirects=True, headers=range_headers) as resp:
+            if resp.status in (200, 206) and "content-disposition" in (k.lower() for k in resp.headers.keys()):
+                return await stream(resp)
+            text = await resp.text(errors="ignore")
+            m = re.search(r"confirm=([0-9A-Za-z-_]+)", text)
+            if m:
+                token = m.group(1)
+                download_url = f"{DRIVE_BASE_URL}/uc?export=download&confirm={token}&id={file_id}"
+                async with sess.get(download_url, allow_redirects=True, headers=range_headers) as resp2:
+                    return await stream(resp2)
+            # Large files get a virus-scan page whose form posts to the real download host.
+            form = re.search(r'<form[^>]*id="download-form"[^>]*action="([^"]+)"', text)
+            if form:
+                params = {k: html.unescape(v) for k, v in re.findall(r'<input type="hidden" name="([^"]+)" value="([^"]*)"', text)}
+                async with sess.get(html.unescape(form.group(1)), params=params, allow_redirects=True, headers=range_headers) as resp2:
+                    return await stream(resp2)
+            for k, v in resp.cookies.items():
+                if k.startswith("download_warning"):
+                    token = v.value
+                    download_url = f"{DRIVE_BASE_URL}/uc?export=download&confirm={token}&id={file_id}"
+                    async with sess.get(download_url, allow_redirects=True, headers=range_headers) as resp2:
+                        return await stream(resp2)
+            return False, "ডাউনলোডের জন্য Google Drive থেকে অনুমতি প্রয়োজন বা লিংক পাবলিক নয়।"
+    except Exception as e:
+        return False, str(e)
 
 async def set_bot_commands():
     cmds = [
         BotCommand("start", "বট চালু/হেল্প"),
         BotCommand("upload_url", "URL থেকে ফাইল ডাউনলোড ও আপলোড (admin only)"),
+        BotCommand("playlist", "পুরো প্লেলিস্ট একই কোয়ালিটিতে আপলোড (admin only)"),
         BotCommand("setthumb", "কাস্টম থাম্বনেইল সেট করুন (admin only)"),
         BotCommand("view_thumb", "আপনার থাম্বনেইল দেখুন (admin only)"),
         BotCommand("del_thumb", "আপনার থাম্বনেইল মুছে ফেলুন (admin only)"),
@@ -458,10 +1379,12 @@ async def set_bot_commands():
         BotCommand("edit_caption_mode", "শুধু ক্যাপশন এডিট করুন (admin only)"),
         BotCommand("rename", "reply করা ভিডিও রিনেম করুন (admin only)"),
         BotCommand("mkv_video_audio_change", "MKV ভিডিওর অডিও ট্র্যাক পরিবর্তন (admin only)"),
+        BotCommand("transcode_mode", "একবার ডিকোড করে একাধিক কোয়ালিটি তৈরি (admin only)"),
         BotCommand("create_post", "নতুন পোস্ট তৈরি করুন (admin only)"), 
         BotCommand("post", "Manage Channels & Posts (admin only)"),
         BotCommand("mode_check", "বর্তমান মোড স্ট্যাটাস চেক করুন (admin only)"), 
         BotCommand("broadcast", "ব্রডকাস্ট (কেবল অ্যাডমিন)"),
+        BotCommand("stats", "চলমান ও অপেক্ষমাণ কাজ এবং থ্রুপুট (admin only)"),
         BotCommand("help", "সহায়িকা")
     ]
     try:
@@ -469,25 +1392,256 @@ async def set_bot_commands():
     except Exception as e:
         logger.warning("Set commands error: %s", e)
 
-async def sequential_upload_task(uid, client, message, tmp_path, renamed_file, status_msg_id, cancel_event):
+async def sequential_upload_task(uid, client, message, tmp_path, renamed_file, status_msg_id, cancel_event, skip_remux=False, caption_slot=None, source_key=None, disk_mode=None):
     if uid not in USER_UPLOAD_LOCKS:
         USER_UPLOAD_LOCKS[uid] = asyncio.Lock()
     
     async with USER_UPLOAD_LOCKS[uid]:
         if cancel_event.is_set():
             if tmp_path.exists(): tmp_path.unlink()
+            release_caption_slots(uid, [caption_slot])
+            return
+        await process_file_and_upload(client, message, tmp_path, original_name=renamed_file, messages_to_delete=[status_msg_id], cancel_event_passed=cancel_event, skip_remux=skip_remux, caption_slot=caption_slot, source_key=source_key, disk_mode=disk_mode)
+
+# --- STREAMING REMUX ---
+# MKV inputs are piped from stream_media straight into ffmpeg's stdin, so only the
+# remuxed output touches the disk instead of download + proc_* copy.
+STREAM_REMUX_ENABLED = os.getenv("STREAM_REMUX", "1") == "1"
+STREAM_REMUX_EXTS = {".mkv"}
+# Only Telegram-source jobs are counted, keyed by the path they took: "stream"
+# (piped remux) or "file" (download, then remux). URL, bulk and Drive jobs are not.
+DISK_WRITE_STATS = {}
+
+def record_disk_bytes_written(mode: str, in_path: Path, upload_path: Path):
+    try:
+        written = in_path.stat().st_size if in_path.exists() else 0
+        if upload_path != in_path and upload_path.exists():
+            written += upload_path.stat().st_size
+    except Exception:
+        return
+    stats = DISK_WRITE_STATS.setdefault(mode, {'jobs': 0, 'bytes': 0})
+    stats['jobs'] += 1
+    stats['bytes'] += written
+    logger.info(f"Disk bytes written ({mode}): {format_size(written)} this job, "
+                f"avg {format_size(stats['bytes'] // stats['jobs'])} over {stats['jobs']} jobs")
+
+def can_stream_remux(original_name: str) -> bool:
+    return STREAM_REMUX_ENABLED and Path(original_name).suffix.lower() in STREAM_REMUX_EXTS
+
+async def stream_remux_to_file(c: Client, m: Message, out_path: Path, cancel_event: asyncio.Event = None, progress=None):
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-i", "pipe:0",
+        "-map", "0",
+        "-c", "copy",
+        "-metadata:s:a", "title=[@TA_HD_Anime] Telegram Channel",
+        "-metadata", "handler_name=",
+        "-f", "matroska",
+        str(out_path)
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    file_info = m.video or m.document
+    total = getattr(file_info, 'file_size', 0) or 0
+    fed = 0
+    try:
+        async for chunk in c.stream_media(m):
+            if cancel_event and cancel_event.is_set():
+                raise Exception("Cancelled")
+            proc.stdin.write(chunk)
+            await proc.stdin.drain()
+            fed += len(chunk)
+            if progress:
+                await progress(fed, total)
+        proc.stdin.close()
+        await proc.wait()
+        stderr = (await stderr_task).decode(errors="ignore")
+        if proc.returncode != 0:
+            out_path.unlink(missing_ok=True)
+            return False, stderr[-500:]
+        if not out_path.exists() or out_path.stat().st_size == 0:
+            return False, "Output file is empty"
+        return True, None
+    except Exception as e:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        stderr_task.cancel()
+        out_path.unlink(missing_ok=True)
+        return False, str(e)
+
+# --- MULTI-RENDITION TRANSCODE ---
+# One ffmpeg decode feeds a split/scale filter graph that writes every rendition;
+# jobs share a CPU-bounded pool and upload in caption-rotation order.
+TRANSCODE_DEFAULT_RENDITIONS = os.getenv("TRANSCODE_RENDITIONS", "480p, 720p, 1080p")
+TRANSCODE_WORKERS = max(1, int(os.getenv("TRANSCODE_WORKERS", "1")))
+TRANSCODE_THREADS = max(1, (os.cpu_count() or 1) // TRANSCODE_WORKERS)
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")
+TRANSCODE_CRF = os.getenv("TRANSCODE_CRF", "23")
+TRANSCODE_SEMAPHORE = asyncio.Semaphore(TRANSCODE_WORKERS)
+TRANSCODE_UPLOAD_CHAIN = {}
+
+def parse_renditions(options_str: str) -> list:
+    renditions = []
+    for opt in options_str.split(','):
+        m = re.search(r"(\d{3,4})p", opt.strip(), re.IGNORECASE)
+        if m:
+            renditions.append((opt.strip(), int(m.group(1))))
+    return renditions
+
+def get_transcode_renditions(uid: int) -> list:
+    quality_match = re.search(r"\[re\s*\((.*?)\)\]", USER_CAPTIONS.get(uid) or "")
+    if quality_match:
+        renditions = parse_renditions(quality_match.group(1))
+        if renditions:
+            return renditions
+    return parse_renditions(TRANSCODE_DEFAULT_RENDITIONS)
+
+# Drops renditions taller than the source instead of upscaling them. When the source
+# is below every rendition, the smallest one is kept and encoded at the source height.
+def select_renditions(renditions: list, source_height: int) -> list:
+    if not source_height or not renditions:
+        return renditions
+    fitting = [(label, height) for label, height in renditions if height <= source_height]
+    if fitting:
+        return fitting
+    label, _ = min(renditions, key=lambda r: r[1])
+    return [(label, source_height - source_height % 2)]
+
+async def run_transcode(cmd: list, cancel_event: asyncio.Event, timeout: float):
+    # Returns (returncode, stderr); ffmpeg is killed on cancel, timeout or task cancellation.
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    wait_task = asyncio.create_task(proc.wait())
+    cancel_task = asyncio.create_task(cancel_event.wait())
+    try:
+        await asyncio.wait({wait_task, cancel_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        cancel_task.cancel()
+        if proc.returncode is None:
+            proc.kill()
+        await wait_task
+    return proc.returncode, (await stderr_task).decode(errors="ignore")
+
+def build_multi_rendition_cmd(in_path: Path, outputs: list) -> list:
+    split_labels = "".join(f"[v{i}]" for i in range(len(outputs)))
+    graph = [f"[0:v:0]split={len(outputs)}{split_labels}"]
+    for i, (height, _) in enumerate(outputs):
+        graph.append(f"[v{i}]scale=-2:{height}[o{i}]")
+
+    cmd = ["ffmpeg", "-y", "-i", str(in_path), "-filter_complex", ";".join(graph), "-threads", str(TRANSCODE_THREADS)]
+    for i, (_, out_path) in enumerate(outputs):
+        cmd += [
+            "-map", f"[o{i}]", "-map", "0:a?", "-map", "0:s?",
+            "-c:v", "libx264", "-preset", TRANSCODE_PRESET, "-crf", TRANSCODE_CRF,
+            "-c:a", "copy", "-c:s", "copy",
+            "-metadata:s:a", "title=[@TA_HD_Anime] Telegram Channel",
+            "-metadata", "handler_name=",
+            str(out_path)
+        ]
+    return cmd
+
+async def transcode_and_upload_task(uid, client, message, tmp_path, renamed_file, status_msg_id, cancel_event, caption_slots=None):
+    previous_job = TRANSCODE_UPLOAD_CHAIN.get(uid)
+    this_job = asyncio.get_running_loop().create_future()
+    TRANSCODE_UPLOAD_CHAIN[uid] = this_job
+
+    renditions = get_transcode_renditions(uid)
+    timestamp = int(datetime.now().timestamp())
+    outputs = []
+    caption_slots = list(caption_slots or [])
+    uploaded = 0
+    out_name = Path(renamed_file).stem + ".mkv"
+    source_key = telegram_source_key(message)
+    try:
+        source_height = (await asyncio.to_thread(get_video_metadata, tmp_path)).get('height', 0)
+        renditions = select_renditions(renditions, source_height)
+        outputs = [(height, TMP / f"tc_{uid}_{timestamp}_{height}p.mkv") for _, height in renditions]
+        caption_slots += [None] * (len(outputs) - len(caption_slots))
+        # Each rendition is captioned with its own label, whatever number its slot got.
+        caption_slots = [
+            {**slot, 'quality': label} if slot else None
+            for slot, (label, _) in zip(caption_slots, renditions)
+        ] + caption_slots[len(renditions):]
+        async with TRANSCODE_SEMAPHORE:
+            if cancel_event.is_set():
+                return
+            try:
+                await client.edit_message_text(message.chat.id, status_msg_id, f"ট্রান্সকোড হচ্ছে ({', '.join(label for label, _ in renditions)})...", reply_markup=progress_keyboard())
+            except Exception:
+                pass
+            returncode, stderr = await run_transcode(build_multi_rendition_cmd(tmp_path, outputs), cancel_event, 6 * 3600)
+        if cancel_event.is_set():
+            return
+        if returncode != 0:
+            logger.error(f"Multi-rendition transcode failed: {stderr[-1000:]}")
+            await message.reply_text(f"ট্রান্সকোড ব্যর্থ হয়েছে: {stderr[-300:]}")
             return
-        await process_file_and_upload(client, message, tmp_path, original_name=renamed_file, messages_to_delete=[status_msg_id], cancel_event_passed=cancel_event)
+
+        # Keep episode order across jobs even when a later transcode finishes first.
+        if previous_job:
+            await previous_job
+
+        if uid not in USER_UPLOAD_LOCKS:
+            USER_UPLOAD_LOCKS[uid] = asyncio.Lock()
+        async with USER_UPLOAD_LOCKS[uid]:
+            for i, (_, out_path) in enumerate(outputs):
+                if cancel_event.is_set():
+                    break
+                if not out_path.exists() or out_path.stat().st_size == 0:
+                    continue
+                if cancel_event not in TASKS.setdefault(uid, []):
+                    TASKS[uid].append(cancel_event)
+                rendition_key = f"{source_key}:{outputs[i][0]}p" if source_key else None
+                cached = await lookup_cached_upload(uid, rendition_key)
+                if cached and await send_cached_file(client, message, uid, cached, caption_slots[i]):
+                    if i == len(outputs) - 1:
+                        try:
+                            await client.delete_messages(message.chat.id, status_msg_id)
+                        except Exception:
+                            pass
+                else:
+                    await process_file_and_upload(
+                        client, message, out_path, original_name=out_name,
+                        messages_to_delete=[status_msg_id] if i == len(outputs) - 1 else None,
+                        cancel_event_passed=cancel_event, skip_remux=True, caption_slot=caption_slots[i],
+                        source_key=rendition_key
+                    )
+                uploaded = i + 1
+    except Exception as e:
+        logger.error(f"Transcode job error: {e}")
+        try:
+            await message.reply_text(f"ট্রান্সকোডে ত্রুটি: {e}")
+        except Exception:
+            pass
+    finally:
+        release_caption_slots(uid, caption_slots[uploaded:])
+        tmp_path.unlink(missing_ok=True)
+        for _, out_path in outputs:
+            out_path.unlink(missing_ok=True)
+        try:
+            TASKS[uid].remove(cancel_event)
+        except Exception:
+            pass
+        this_job.set_result(None)
+        if TRANSCODE_UPLOAD_CHAIN.get(uid) is this_job:
+            TRANSCODE_UPLOAD_CHAIN.pop(uid, None)
 
 # --- QUEUE WORKER ---
 async def process_queue_handler(uid, client):
     queue = USER_QUEUES[uid]
     while not queue.empty():
         task_data = await queue.get()
+        if QUEUED_JOBS.get(uid):
+            QUEUED_JOBS[uid].popleft()
         try:
             m = task_data.get('message')
             original_name = task_data.get('original_name')
             status_msg = task_data.get('status_msg') 
+            caption_slots = task_data.get('caption_slots') or [None]
             
             file_info = m.video or m.document
             
@@ -502,11 +1656,38 @@ async def process_queue_handler(uid, client):
                         await status_msg.edit("ডাউনলোড হচ্ছে...", reply_markup=progress_keyboard())
                     except: pass
                 
-                await m.download(file_name=str(tmp_path))
+                renamed_file = generate_new_filename(original_name)
+                if uid not in TRANSCODE_MODE and await reuse_cached_upload(client, m, uid, telegram_source_key(m), caption_slots[0]):
+                    TASKS[uid].remove(cancel_event)
+                    if status_msg:
+                        try:
+                            await status_msg.delete()
+                        except Exception:
+                            pass
+                    continue
+                reporter = get_progress_reporter(status_msg, "ডাউনলোড হচ্ছে...", getattr(file_info, 'file_size', 0) or 0)
+                progress = reporter.progress if reporter else None
+                streamed = False
+                if can_stream_remux(original_name) and uid not in TRANSCODE_MODE:
+                    stream_path = TMP / f"proc_{uid}_{int(datetime.now().timestamp())}_{Path(renamed_file).stem}.mkv"
+                    if reporter:
+                        reporter.set_stage("ডাউনলোড ও রিমাক্স হচ্ছে (Streaming)...", getattr(file_info, 'file_size', 0) or 0)
+                    streamed, err = await stream_remux_to_file(client, m, stream_path, cancel_event, progress=progress)
+                    if streamed:
+                        tmp_path = stream_path
+                    elif not cancel_event.is_set():
+                        logger.warning(f"Streaming remux failed, falling back to download: {err}")
+
+                if not streamed and not cancel_event.is_set():
+                    if reporter:
+                        reporter.set_stage("ডাউনলোড হচ্ছে...", getattr(file_info, 'file_size', 0) or 0)
+                    await download_telegram_file(client, m, tmp_path, cancel_event, progress=progress)
+                await close_progress_reporter(status_msg)
                 
                 if cancel_event.is_set():
                      if tmp_path.exists(): tmp_path.unlink()
                      TASKS[uid].remove(cancel_event)
+                     release_caption_slots(uid, caption_slots)
                      continue
 
                 try:
@@ -514,15 +1695,20 @@ async def process_queue_handler(uid, client):
                         await status_msg.edit("ডাউনলোড সম্পন্ন, Telegram-এ আপলোড হচ্ছে...", reply_markup=None)
                 except Exception:
                     pass
-
-                renamed_file = generate_new_filename(original_name)
                 
+                if uid in TRANSCODE_MODE:
+                    asyncio.create_task(
+                        transcode_and_upload_task(uid, client, m, tmp_path, renamed_file, status_msg.id if status_msg else None, cancel_event, caption_slots=caption_slots)
+                    )
+                    continue
+
                 asyncio.create_task(
-                    sequential_upload_task(uid, client, m, tmp_path, renamed_file, status_msg.id if status_msg else None, cancel_event)
+                    sequential_upload_task(uid, client, m, tmp_path, renamed_file, status_msg.id if status_msg else None, cancel_event, skip_remux=streamed, caption_slot=caption_slots[0], source_key=telegram_source_key(m), disk_mode="stream" if streamed else "file")
                 )
             
             except Exception as e:
                 logger.error(f"Queue Item Failed: {e}")
+                release_caption_slots(uid, caption_slots)
                 if status_msg:
                     await status_msg.edit(f"Queue Error: {e}")
                 else:
@@ -539,17 +1725,21 @@ async def process_queue_handler(uid, client):
     
     del USER_WORKERS[uid]
     del USER_QUEUES[uid]
+    QUEUED_JOBS.pop(uid, None)
 
 # ---- handlers ----
 @app.on_message(filters.command("start") & filters.private)
 async def start_handler(c, m: Message):
     await set_bot_commands()
-    SUBSCRIBERS.add(m.chat.id)
+    await add_subscriber(m.chat.id)
     text = (
         "Hi! আমি URL uploader bot.\n\n"
         "নোট: বটের অনেক কমান্ড শুধু অ্যাডমিন (owner) চালাতে পারবে।\n\n"
         "Commands:\n"
         "/upload_url <url> - URL থেকে ফাইল ডাউনলোড ও Telegram-এ আপলোড (admin only)\n"
+        "একাধিক লিংক (প্রতি লাইনে একটি) বা .txt ফাইল দিলে সবগুলো ক্রমানুসারে আপলোড হবে\n"
+        "/playlist <url> - প্লেলিস্টের সব এন্ট্রি একই কোয়ালিটিতে ক্রমানুসারে আপলোড (admin only)\n"
+        "Google Drive ফোল্ডার লিংক দিলে ফোল্ডারের সব ফাইল নামের ক্রমে আপলোড হবে\n"
         "/setthumb - একটি ছবি পাঠান, সেট হবে আপনার থাম্বনেইল (admin only)\n"
         "/view_thumb - আপনার থাম্বনেইল দেখুন (admin only)\n"
         "/del_thumb - আপনার থাম্বনেইল মুছে ফেলুন (admin only)\n"
@@ -558,10 +1748,12 @@ async def start_handler(c, m: Message):
         "/edit_caption_mode - শুধু ক্যাপশন এডিট করার মোড টগল করুন (admin only)\n"
         "/rename <newname.ext> - reply করা ভিডিও রিনেম করুন (admin only)\n"
         "/mkv_video_audio_change - MKV ভিডিওর অডিও ট্র্যাক পরিবর্তন মোড টগল করুন (admin only)\n"
+        "/transcode_mode - ফরওয়ার্ড করা ভিডিও থেকে 480p/720p/1080p তৈরি মোড টগল করুন (admin only)\n"
         "/create_post - নতুন পোস্ট তৈরি করুন (admin only)\n" 
         "/post - Manage Channels and Create Button Posts (admin only)\n"
         "/mode_check - বর্তমান মোড স্ট্যাটাস চেক করুন এবং পরিবর্তন করুন (admin only)\n" 
         "/broadcast <text> - ব্রডকাস্ট (শুধুমাত্র অ্যাডমিন)\n"
+        "/stats - চলমান ও অপেক্ষমাণ কাজ এবং থ্রুপুট দেখুন (admin only)\n"
         "/help - সাহায্য"
     )
     await m.reply_text(text)
@@ -577,10 +1769,159 @@ async def post_command(client, message):
     markup = InlineKeyboardMarkup([
         [InlineKeyboardButton("Save Channel", callback_data="mode_save_channel"),
          InlineKeyboardButton("Edit Post", callback_data="mode_edit_post")],
-        [InlineKeyboardButton("Create New Post", callback_data="mode_create_post")]
+        [InlineKeyboardButton("Create New Post", callback_data="mode_create_post")],
+        [InlineKeyboardButton("Channel Status", callback_data="mode_channel_status")]
     ])
     await message.reply("Select an option:", reply_markup=markup)
 
+# --- CHANNEL FAN-OUT ---
+# "Send to All" posts to every saved channel concurrently; FloodWait is retried per
+# channel so one throttled chat does not hold up the rest.
+CHANNEL_POST_CONCURRENCY = int(os.getenv("CHANNEL_POST_CONCURRENCY", "8"))
+CHANNEL_POST_RETRIES = int(os.getenv("CHANNEL_POST_RETRIES", "3"))
+CHANNEL_POST_LIMITER = RateLimiter(rate=float(os.getenv("CHANNEL_POST_RATE", "20")), burst=CHANNEL_POST_CONCURRENCY)
+CHANNEL_REFRESH_CONCURRENCY = int(os.getenv("CHANNEL_REFRESH_CONCURRENCY", "10"))
+CHANNEL_REFRESH_INTERVAL = float(os.getenv("CHANNEL_REFRESH_INTERVAL", "21600"))
+CHANNEL_REFRESH_LIMITER = RateLimiter(rate=10, burst=CHANNEL_REFRESH_CONCURRENCY)
+
+async def send_post_to_channel(client, chat_id, media, caption, buttons):
+    for attempt in range(CHANNEL_POST_RETRIES + 1):
+        await CHANNEL_POST_LIMITER.acquire()
+        try:
+            if media:
+                if media.kind == "photo":
+                    return await client.send_photo(int(chat_id), media.file_id, caption=caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
+                return await client.send_video(int(chat_id), media.file_id, caption=caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
+            return await client.send_message(int(chat_id), caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
+        except FloodWait as e:
+            if attempt == CHANNEL_POST_RETRIES:
+                raise
+            logger.warning(f"FloodWait {e.value}s posting to {chat_id}")
+            await asyncio.sleep(e.value)
+
+def format_fanout_report(results: dict, total: int, finished: bool = False, skipped: list = None) -> str:
+    ok = [cid for cid, err in results.items() if err is None]
+    failed = {cid: err for cid, err in results.items() if err is not None}
+    lines = [f"{'Post Sent!' if finished else 'Sending...'} ({len(results)}/{total}) ✅ {len(ok)} ❌ {len(failed)}"]
+    if finished:
+        for cid in ok:
+            lines.append(f"✅ {saved_channels.get(cid, cid)}")
+        for cid, err in failed.items():
+            lines.append(f"❌ {saved_channels.get(cid, cid)}: {err}")
+        for cid in skipped or []:
+            lines.append(f"⏭ {saved_channels.get(cid, cid)}: no post permission")
+    return "\n".join(lines)[:4000]
+
+async def fan_out_post(client, status_message: Message, target_channels: list, media, caption, buttons) -> dict:
+    results = {}
+    posted = {}
+    semaphore = asyncio.Semaphore(CHANNEL_POST_CONCURRENCY)
+    last_edit = 0.0
+
+    async def worker(chat_id):
+        nonlocal last_edit
+        async with semaphore:
+            try:
+                sent = await send_post_to_channel(client, chat_id, media, caption, buttons)
+                results[chat_id] = None
+                posted[chat_id] = getattr(sent, "id", None)
+            except Exception as e:
+                logger.error(f"Failed to send to {chat_id}: {e}")
+                results[chat_id] = str(e)[:100]
+        now = time.monotonic()
+        if now - last_edit >= PROGRESS_EDIT_INTERVAL and len(results) < len(target_channels):
+            last_edit = now
+            try:
+                await status_message.edit_text(format_fanout_report(results, len(target_channels)))
+            except Exception:
+                pass
+
+    await asyncio.gather(*(worker(cid) for cid in target_channels))
+    now = time.time()
+    try:
+        await save_channels_meta({
+            cid: {"last_post_id": posted[cid], "last_post_at": now, "error": None} if err is None else {"error": err}
+            for cid, err in results.items()
+        })
+    except Exception as e:
+        logger.warning(f"Channel registry update failed: {e}")
+    return {cid: results[cid] for cid in target_channels}
+
+# Errors that mean the bot really lost access; anything else (timeouts, flood
+# limits, server errors) keeps the previous permissions and only records the error.
+CHANNEL_PERMISSION_ERRORS = (ChatWriteForbidden, ChannelPrivate, ChatAdminRequired, PeerIdInvalid, UserNotParticipant)
+
+async def fetch_channel_meta(client, chat_id: str) -> dict:
+    meta = {"checked_at": time.time()}
+    try:
+        chat = await call_with_flood_wait(CHANNEL_REFRESH_LIMITER, client.get_chat, int(chat_id))
+        member = await call_with_flood_wait(CHANNEL_REFRESH_LIMITER, client.get_chat_member, int(chat_id), "me")
+    except CHANNEL_PERMISSION_ERRORS as e:
+        meta.update(can_post=False, can_edit=False, error=str(e)[:100])
+        return meta
+    except Exception as e:
+        meta.update(error=str(e)[:100])
+        return meta
+
+    privileges = getattr(member, "privileges", None)
+    is_owner = member.status == ChatMemberStatus.OWNER
+    is_admin_member = member.status == ChatMemberStatus.ADMINISTRATOR
+    if chat.type == ChatType.CHANNEL:
+        can_post = is_owner or (is_admin_member and bool(privileges and privileges.can_post_messages))
+        can_edit = is_owner or (is_admin_member and bool(privileges and privileges.can_edit_messages))
+    else:
+        can_post = member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED, ChatMemberStatus.RESTRICTED)
+        can_edit = can_post
+    meta.update(title=chat.title, type=chat.type.value, can_post=can_post, can_edit=can_edit, error=None)
+    return meta
+
+async def refresh_channel_registry(client, chat_ids: list = None) -> dict:
+    chat_ids = list(chat_ids or saved_channels.keys())
+    semaphore = asyncio.Semaphore(CHANNEL_REFRESH_CONCURRENCY)
+
+    async def refresh_one(cid):
+        async with semaphore:
+            return cid, await fetch_channel_meta(client, cid)
+
+    updates = dict(await asyncio.gather(*(refresh_one(cid) for cid in chat_ids)))
+    await save_channels_meta(updates)
+    return updates
+
+async def channel_refresh_loop():
+    while not app.is_initialized:
+        await asyncio.sleep(1)
+    while True:
+        try:
+            if saved_channels:
+                await refresh_channel_registry(app)
+        except Exception as e:
+            logger.warning(f"Channel registry refresh failed: {e}")
+        await asyncio.sleep(CHANNEL_REFRESH_INTERVAL)
+
+# Only a confirmed can_post=False counts; a channel not checked yet is kept.
+def unusable_channels() -> list:
+    return [c for c in saved_channels if CHANNEL_META.get(c, {}).get("can_post") is False]
+
+def format_channel_status() -> str:
+    if not saved_channels:
+        return "কোনো চ্যানেল সেভ করা নেই।"
+    lines = ["Channel Status:"]
+    for cid, title in saved_channels.items():
+        meta = CHANNEL_META.get(cid, {})
+        if meta.get("can_post"):
+            flag = "✅" if meta.get("can_edit") else "✅ (no edit)"
+        elif "can_post" in meta:
+            flag = "❌"
+        else:
+            flag = "❔"
+        line = f"{flag} {title}"
+        if meta.get("last_post_id"):
+            line += f" — last post #{meta['last_post_id']}"
+        if meta.get("error"):
+            line += f" — {meta['error']}"
+        lines.append(line)
+    return "\n".join(lines)[:4000]
+
 # --- NEW: Callbacks for Post Bot ---
 @app.on_callback_query(filters.regex(r"^(mode_|edit_|cancel$|cancel_to_|skip_|send_to_)"))
 async def post_callback_handler(client, callback: CallbackQuery):
@@ -605,6 +1946,20 @@ async def post_callback_handler(client, callback: CallbackQuery):
         user_data[uid]["state"] = STATE_AWAIT_FORWARD_EDIT
         await callback.message.edit_text("Forward the message from the channel you want to edit.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="cancel")]]))
 
+    elif data == "mode_channel_status":
+        await callback.message.edit_text(f"Checking {len(saved_channels)} channel(s)...")
+        await refresh_channel_registry(client)
+        dead = unusable_channels()
+        rows = [[InlineKeyboardButton(f"Remove Unusable ({len(dead)})", callback_data="mode_remove_dead_channels")]] if dead else []
+        rows.append([InlineKeyboardButton("Cancel", callback_data="cancel")])
+        await callback.message.edit_text(format_channel_status(), reply_markup=InlineKeyboardMarkup(rows))
+
+    elif data == "mode_remove_dead_channels":
+        dead = unusable_channels()
+        for chat_id in dead:
+            await remove_channel(chat_id)
+        await callback.message.edit_text(f"Removed {len(dead)} channel(s).\n\n{format_channel_status()}")
+
     elif data == "mode_create_post":
         user_data[uid] = {"state": STATE_AWAIT_MEDIA}
         await callback.message.edit_text("Send or Forward an Image or Video.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="cancel")]]))
@@ -616,25 +1971,35 @@ async def post_callback_handler(client, callback: CallbackQuery):
 
     elif data.startswith("send_to_"):
         cid = data.split("send_to_")[1]
-        target_channels = list(saved_channels.keys()) if cid == "all" else [cid]
         dt = user_data[uid]
+        if cid == "retry":
+            target_channels = dt.get("failed_channels") or []
+        else:
+            target_channels = list(saved_channels.keys()) if cid == "all" else [cid]
+        # Channels the last registry refresh found unusable are skipped, not retried.
+        skipped = [c for c in target_channels if CHANNEL_META.get(c, {}).get("can_post") is False] if cid == "all" else []
+        target_channels = [c for c in target_channels if c not in skipped]
         media, caption, buttons = dt.get("media"), dt.get("caption"), parse_buttons(dt.get("buttons_text"))
+        if not target_channels or (not media and not caption):
+            await callback.message.edit_text("Nothing to send.")
+            user_data[uid] = {"state": STATE_IDLE}
+            return
         
-        await callback.message.edit_text("Sending...")
-        for chat_id in target_channels:
-            try:
-                if media:
-                    if hasattr(media, 'photo') and media.photo:
-                        await client.send_photo(int(chat_id), media.photo.file_id, caption=caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
-                    elif hasattr(media, 'video') and media.video:
-                        await client.send_video(int(chat_id), media.video.file_id, caption=caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
-                else:
-                    await client.send_message(int(chat_id), caption, reply_markup=buttons, parse_mode=ParseMode.HTML)
-            except Exception as e: 
-                logger.error(f"Failed to send to {chat_id}: {e}")
-        await callback.message.edit_text("Post Sent!")
-        # Reset state
-        user_data[uid] = {"state": STATE_IDLE}
+        await callback.message.edit_text(f"Sending to {len(target_channels)} channel(s)...")
+        results = await fan_out_post(client, callback.message, target_channels, media, caption, buttons)
+        failed = [chat_id for chat_id, err in results.items() if err is not None]
+        markup = None
+        if failed:
+            # Keep the post so the failed channels can be retried.
+            dt["failed_channels"] = failed
+            markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(f"Retry Failed ({len(failed)})", callback_data="send_to_retry")],
+                [InlineKeyboardButton("Cancel", callback_data="cancel")]
+            ])
+        else:
+            # Reset state
+            user_data[uid] = {"state": STATE_IDLE}
+        await callback.message.edit_text(format_fanout_report(results, len(target_channels), finished=True, skipped=skipped), reply_markup=markup)
 
     elif data == "edit_change_media":
         user_data[uid]["state"] = STATE_EDIT_NEW_MEDIA
@@ -655,7 +2020,7 @@ async def post_callback_handler(client, callback: CallbackQuery):
             btns = parse_buttons(dt["new_buttons_text"]) if "new_buttons_text" in dt else dt.get("orig_markup")
             media = dt.get("new_media")
             if media:
-                input_media = InputMediaPhoto(media.photo.file_id, caption=cap, parse_mode=ParseMode.HTML) if media.photo else InputMediaVideo(media.video.file_id, caption=cap, parse_mode=ParseMode.HTML)
+                input_media = InputMediaPhoto(media.file_id, caption=cap, parse_mode=ParseMode.HTML) if media.kind == "photo" else InputMediaVideo(media.file_id, caption=cap, parse_mode=ParseMode.HTML)
                 await client.edit_message_media(int(dt["target_channel_id"]), int(dt["target_msg_id"]), media=input_media, reply_markup=btns)
             else:
                 await client.edit_message_caption(int(dt["target_channel_id"]), int(dt["target_msg_id"]), caption=cap, reply_markup=btns, parse_mode=ParseMode.HTML)
@@ -664,8 +2029,7 @@ async def post_callback_handler(client, callback: CallbackQuery):
         except Exception as e: await callback.message.edit_text(f"Error: {e}")
 
 # --- NEW: State Machine Handler for Post Bot ---
-# This handler runs before the general text_handler to capture input when in a specific state
-@app.on_message(admin_filter, group=-1)
+# Called by the user state router before mode routing, while a post session is active
 async def post_state_handler(client, message: Message):
     uid = message.from_user.id
     if uid not in user_data: return
@@ -677,8 +2041,9 @@ async def post_state_handler(client, message: Message):
     # Process states
     if state == STATE_AWAIT_FORWARD_SAVE:
         if message.forward_from_chat:
-            saved_channels[str(message.forward_from_chat.id)] = message.forward_from_chat.title
-            save_channels(saved_channels)
+            chat_id = str(message.forward_from_chat.id)
+            await add_channel(chat_id, message.forward_from_chat.title)
+            asyncio.create_task(refresh_channel_registry(client, [chat_id]))
             await message.reply(f"Saved: {message.forward_from_chat.title}")
             user_data[uid]["state"] = STATE_IDLE
             message.stop_propagation()
@@ -686,7 +2051,7 @@ async def post_state_handler(client, message: Message):
 
     elif state == STATE_AWAIT_MEDIA:
         if message.photo or message.video:
-            user_data[uid]["media"] = message
+            user_data[uid]["media"] = MediaRef(message)
             if message.forward_date or not message.caption:
                 user_data[uid]["caption"] = ""
                 await message.reply("Media Saved. Please send a Caption.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("No Caption", callback_data="skip_caption")]]))
@@ -726,7 +2091,7 @@ async def post_state_handler(client, message: Message):
 
     elif state == STATE_EDIT_NEW_MEDIA:
         if message.photo or message.video:
-            user_data[uid]["new_media"] = message
+            user_data[uid]["new_media"] = MediaRef(message)
             await message.reply("Media Updated. What next?", reply_markup=get_edit_menu_markup())
             user_data[uid]["state"] = STATE_EDIT_MENU
             message.stop_propagation()
@@ -794,6 +2159,7 @@ async def del_thumb_cmd(c, m: Message):
         except Exception:
             pass
         USER_THUMBS.pop(uid, None)
+    USER_THUMB_FILE_IDS.pop(uid, None)
     
     if uid in USER_THUMB_TIME:
         USER_THUMB_TIME.pop(uid)
@@ -804,73 +2170,66 @@ async def del_thumb_cmd(c, m: Message):
         await m.reply_text("আপনার থাম্বনেইল/থাম্বনেইল তৈরির সময় মুছে ফেলা হয়েছে।")
 
 
-@app.on_message(filters.photo & filters.private)
-async def photo_handler(c, m: Message):
-    if not is_admin(m.from_user.id):
-        return
-    uid = m.from_user.id
+async def route_post_image(c, m: Message, uid: int) -> bool:
+    state_data = POST_CREATION_STATE.get(uid)
+    if not state_data or state_data['state'] != 'awaiting_image':
+        return False
+
+    state_data['message_ids'].append(m.id) 
     
-    if uid in CREATE_POST_MODE and uid in POST_CREATION_STATE and POST_CREATION_STATE[uid]['state'] == 'awaiting_image':
+    out = TMP / f"post_img_{uid}.jpg"
+    try:
+        download_msg = await m.reply_text("ছবি ডাউনলোড হচ্ছে...")
+        state_data['message_ids'].append(download_msg.id)
         
-        state_data = POST_CREATION_STATE[uid]
-        state_data['message_ids'].append(m.id) 
+        await m.download(file_name=str(out))
+        img = lazy_module("PIL.Image").open(out)
+        img.thumbnail((1080, 1080)) 
+        img = img.convert("RGB")
+        img.save(out, "JPEG")
         
-        out = TMP / f"post_img_{uid}.jpg"
-        try:
-            download_msg = await m.reply_text("ছবি ডাউনলোড হচ্ছে...")
-            state_data['message_ids'].append(download_msg.id)
-            
-            await m.download(file_name=str(out))
-            img = Image.open(out)
-            img.thumbnail((1080, 1080)) 
-            img = img.convert("RGB")
-            img.save(out, "JPEG")
-            
-            state_data['image_path'] = str(out)
-            state_data['state'] = 'awaiting_name_change'
-            
-            initial_caption = generate_post_caption(state_data['post_data'])
-            
-            post_msg = await c.send_photo(
-                chat_id=m.chat.id, 
-                photo=str(out), 
-                caption=initial_caption, 
-                parse_mode=ParseMode.MARKDOWN
-            )
-            state_data['post_message_id'] = post_msg.id 
-            state_data['message_ids'].append(post_msg.id) 
-            
-            prompt_msg = await m.reply_text(
-                f"✅ পোস্টের ছবি সেট হয়েছে।\n\n**এখন ছবির নামটি পরিবর্তন করুন।**\n"
-                f"বর্তমান নাম: `{state_data['post_data']['image_name']}`\n"
-                f"অনুগ্রহ করে শুধু **নামটি** পাঠান। উদাহরণ: `One Piece`"
-            )
-            state_data['message_ids'].append(prompt_msg.id)
+        state_data['image_path'] = str(out)
+        state_data['state'] = 'awaiting_name_change'
+        
+        initial_caption = generate_post_caption(state_data['post_data'])
+        
+        post_msg = await c.send_photo(
+            chat_id=m.chat.id, 
+            photo=str(out), 
+            caption=initial_caption, 
+            parse_mode=ParseMode.MARKDOWN
+        )
+        state_data['post_message_id'] = post_msg.id 
+        state_data['message_ids'].append(post_msg.id) 
+        
+        prompt_msg = await m.reply_text(
+            f"✅ পোস্টের ছবি সেট হয়েছে।\n\n**এখন ছবির নামটি পরিবর্তন করুন।**\n"
+            f"বর্তমান নাম: `{state_data['post_data']['image_name']}`\n"
+            f"অনুগ্রহ করে শুধু **নামটি** পাঠান। উদাহরণ: `One Piece`"
+        )
+        state_data['message_ids'].append(prompt_msg.id)
 
-        except Exception as e:
-            logger.error(f"Post creation image error: {e}")
-            await m.reply_text(f"ছবি সেভ করতে সমস্যা: {e}")
-            CREATE_POST_MODE.discard(uid)
-            POST_CREATION_STATE.pop(uid, None)
-            if out.exists(): out.unlink(missing_ok=True)
-        return
-    
-    if uid in SET_THUMB_REQUEST:
-        SET_THUMB_REQUEST.discard(uid)
-        out = TMP / f"thumb_{uid}.jpg"
-        try:
-            await m.download(file_name=str(out))
-            img = Image.open(out)
-            img.thumbnail((320, 320))
-            img = img.convert("RGB")
-            img.save(out, "JPEG")
-            USER_THUMBS[uid] = str(out)
-            USER_THUMB_TIME.pop(uid, None)
-            await m.reply_text("আপনার থাম্বনেইল সেভ হয়েছে।")
-        except Exception as e:
-            await m.reply_text(f"থাম্বনেইল সেভ করতে সমস্যা: {e}")
-    else:
-        pass
+    except Exception as e:
+        logger.error(f"Post creation image error: {e}")
+        await m.reply_text(f"ছবি সেভ করতে সমস্যা: {e}")
+        CREATE_POST_MODE.discard(uid)
+        POST_CREATION_STATE.pop(uid, None)
+        if out.exists(): out.unlink(missing_ok=True)
+    return True
+
+async def route_thumb_photo(c, m: Message, uid: int) -> bool:
+    SET_THUMB_REQUEST.discard(uid)
+    out = TMP / f"thumb_{uid}.jpg"
+    try:
+        await m.download(file_name=str(out))
+        prepare_thumb_image(out)
+        USER_THUMBS[uid] = str(out)
+        USER_THUMB_FILE_IDS[uid] = m.photo.file_id
+        USER_THUMB_TIME.pop(uid, None)
+        await m.reply_text("আপনার থাম্বনেইল সেভ হয়েছে।")
+    except Exception as e:
+        await m.reply_text(f"থাম্বনেইল সেভ করতে সমস্যা: {e}")
+    return True
 
 @app.on_message(filters.command("set_caption") & filters.private)
 async def set_caption_prompt(c, m: Message):
@@ -944,6 +2303,21 @@ async def toggle_audio_change_mode(c, m: Message):
         MKV_AUDIO_CHANGE_MODE.add(uid)
         await m.reply_text("MKV অডিও পরিবর্তন মোড **অন** করা হয়েছে। এখন আপনি একটি **MKV ফাইল** অথবা অন্য কোনো **ভিডিও ফাইল** পাঠান।\n(এই মোড ম্যানুয়ালি অফ না করা পর্যন্ত চালু থাকবে।)")
 
+@app.on_message(filters.command("transcode_mode") & filters.private)
+async def toggle_transcode_mode(c, m: Message):
+    uid = m.from_user.id
+    if not is_admin(uid):
+        await m.reply_text("আপনার অনুমতি নেই এই কমান্ড চালানোর।")
+        return
+
+    if uid in TRANSCODE_MODE:
+        TRANSCODE_MODE.discard(uid)
+        await m.reply_text("Transcode Mode **অফ** করা হয়েছে।")
+    else:
+        TRANSCODE_MODE.add(uid)
+        labels = ", ".join(label for label, _ in get_transcode_renditions(uid))
+        await m.reply_text(f"Transcode Mode **অন** করা হয়েছে।\nফরওয়ার্ড করা প্রতিটি ভিডিও থেকে একবার ডিকোড করে তৈরি হবে: {labels}\n(ক্যাপশনের `[re (...)]` অর্ডার অনুযায়ী আপলোড হবে।)")
+
 @app.on_message(filters.command("create_post") & filters.private)
 async def toggle_create_post_mode(c, m: Message):
     uid = m.from_user.id
@@ -989,7 +2363,7 @@ async def mode_check_cmd(c, m: Message):
     audio_status = "✅ ON" if uid in MKV_AUDIO_CHANGE_MODE else "❌ OFF"
     caption_status = "✅ ON" if uid in EDIT_CAPTION_MODE else "❌ OFF"
     
-    waiting_count = sum(1 for data in PENDING_AUDIO_ORDERS.values() if data['uid'] == uid)
+    waiting_count = sum(1 for order in PENDING_AUDIO_ORDERS.values() if order.uid == uid)
     waiting_status_text = f"{waiting_count}টি ফাইল ট্র্যাক অর্ডারের জন্য অপেক্ষা করছে।" if waiting_count > 0 else "কোনো ফাইল অপেক্ষা করছে না।"
     
     status_text = (
@@ -1033,7 +2407,7 @@ async def mode_toggle_callback(c: Client, cb: CallbackQuery):
         audio_status = "✅ ON" if uid in MKV_AUDIO_CHANGE_MODE else "❌ OFF"
         caption_status = "✅ ON" if uid in EDIT_CAPTION_MODE else "❌ OFF"
         
-        waiting_count = sum(1 for data in PENDING_AUDIO_ORDERS.values() if data['uid'] == uid)
+        waiting_count = sum(1 for order in PENDING_AUDIO_ORDERS.values() if order.uid == uid)
         waiting_status_text = f"{waiting_count}টি ফাইল ট্র্যাক অর্ডারের জন্য অপেক্ষা করছে।" if waiting_count > 0 else "কোনো ফাইল অপেক্ষা করছে না।"
 
         status_text = (
@@ -1053,226 +2427,282 @@ async def mode_toggle_callback(c: Client, cb: CallbackQuery):
         await cb.answer(message, show_alert=True)
 
 
-@app.on_message(filters.text & filters.private)
-async def text_handler(c, m: Message):
-    uid = m.from_user.id
-    if not is_admin(uid):
+@app.on_message(filters.command("bench_download") & filters.private & filters.reply)
+async def bench_download_cmd(c: Client, m: Message):
+    if not is_admin(m.from_user.id):
+        await m.reply_text("আপনার অনুমতি নেই এই কমান্ড চালানোর।")
         return
-    text = m.text.strip()
-    
-    if uid in EDIT_CAPTION_MODE:
-        if text.lower() == "on":
-            BATCH_CAPTION_MODE.add(uid)
-            BATCH_DATA[uid] = []
-            await m.reply_text("Batch Caption Mode ON. এখন ভিডিও ফরওয়ার্ড করলে ফাইল আইডি সেভ হবে।")
-            return
-        elif text.lower() == "off":
-            BATCH_CAPTION_MODE.discard(uid)
-            BATCH_DATA.pop(uid, None)
-            BATCH_STATUS_MSG.pop(uid, None)
-            await m.reply_text("Batch Caption Mode OFF. এখন ভিডিও ফরওয়ার্ড করলে সরাসরি ক্যাপশন পরিবর্তন হবে।")
-            return
-        elif text.lower() == "ok":
-            if uid in BATCH_CAPTION_MODE and uid in BATCH_DATA and BATCH_DATA[uid]:
-                items = BATCH_DATA[uid]
-                await m.reply_text(f"Processing started for {len(items)} items...")
-                
-                for item in items:
-                    msg_obj = item['message']
-                    file_info_obj = item['file_info']
-                    await handle_caption_only_upload_with_file(c, msg_obj, file_info_obj)
-                    await asyncio.sleep(0.5)
-                
-                BATCH_DATA[uid] = []
-                if uid in BATCH_STATUS_MSG:
-                    try:
-                        await c.delete_messages(m.chat.id, BATCH_STATUS_MSG[uid])
-                    except: pass
-                    BATCH_STATUS_MSG.pop(uid, None)
-                
-                complete_msg = await m.reply_text("Batch processing complete.")
-                
-                async def auto_delete():
-                    await asyncio.sleep(5) 
-                    try:
-                        await complete_msg.delete()
-                    except:
-                        pass
-                
-                asyncio.ensure_future(auto_delete())
-                
+    target = m.reply_to_message
+    file_info = target.video or target.document or target.audio
+    if not file_info:
+        await m.reply_text("একটি ভিডিও/ডকুমেন্ট ফাইলে রিপ্লাই করে এই কমান্ড দিন।")
+        return
+
+    status_msg = await m.reply_text("ডাউনলোড বেঞ্চমার্ক চলছে...")
+    timestamp = int(datetime.now().timestamp())
+    results = []
+    for label, path in (("m.download", TMP / f"bench_a_{timestamp}"), ("parallel", TMP / f"bench_b_{timestamp}")):
+        start = time.perf_counter()
+        try:
+            if label == "parallel":
+                await parallel_download_media(c, target, path)
             else:
-                await m.reply_text("Batch list is empty or mode is not ON.")
-            return
+                await target.download(file_name=str(path))
+            elapsed = time.perf_counter() - start
+            results.append(f"{label}: {elapsed:.1f}s ({format_size(file_info.file_size / elapsed)}/s)")
+        except Exception as e:
+            results.append(f"{label}: failed ({e})")
+        finally:
+            path.unlink(missing_ok=True)
+    await status_msg.edit(f"ফাইল: {format_size(file_info.file_size)}\n" + "\n".join(results))
 
-    if uid in SET_CAPTION_REQUEST:
-        SET_CAPTION_REQUEST.discard(uid)
-        USER_CAPTIONS[uid] = text
-        USER_COUNTERS.pop(uid, None) 
-        await m.reply_text("আপনার ক্যাপশন সেভ হয়েছে। এখন থেকে আপলোড করা ভিডিওতে এই ক্যাপশন ব্যবহার হবে।")
+@app.on_message(filters.command("stats") & filters.private)
+async def stats_cmd(c: Client, m: Message):
+    if not is_admin(m.from_user.id):
+        await m.reply_text("আপনার অনুমতি নেই এই কমান্ড চালানোর।")
         return
+    await m.reply_text(render_stats_text(collect_jobs()))
+
+async def route_batch_keywords(c, m: Message, uid: int) -> bool:
+    text = m.text.strip().lower()
+    if text == "on":
+        BATCH_CAPTION_MODE.add(uid)
+        BATCH_DATA[uid] = []
+        await m.reply_text("Batch Caption Mode ON. এখন ভিডিও ফরওয়ার্ড করলে ফাইল আইডি সেভ হবে।")
+        return True
+    elif text == "off":
+        BATCH_CAPTION_MODE.discard(uid)
+        BATCH_DATA.pop(uid, None)
+        BATCH_STATUS_MSG.pop(uid, None)
+        await m.reply_text("Batch Caption Mode OFF. এখন ভিডিও ফরওয়ার্ড করলে সরাসরি ক্যাপশন পরিবর্তন হবে।")
+        return True
+    elif text == "ok":
+        if uid in BATCH_CAPTION_MODE and uid in BATCH_DATA and BATCH_DATA[uid]:
+            items = BATCH_DATA[uid]
+            BATCH_DATA[uid] = []
+            if uid in BATCH_STATUS_MSG:
+                try:
+                    await c.delete_messages(m.chat.id, BATCH_STATUS_MSG[uid])
+                except: pass
+                BATCH_STATUS_MSG.pop(uid, None)
+
+            await run_caption_batch(c, m, items)
+            
+        else:
+            await m.reply_text("Batch list is empty or mode is not ON.")
+        return True
+    return False
+
+async def route_caption_text(c, m: Message, uid: int) -> bool:
+    text = m.text.strip()
+    SET_CAPTION_REQUEST.discard(uid)
+    USER_CAPTIONS[uid] = text
+    USER_COUNTERS.pop(uid, None) 
+    compile_caption_template(text)
+    await m.reply_text("আপনার ক্যাপশন সেভ হয়েছে। এখন থেকে আপলোড করা ভিডিওতে এই ক্যাপশন ব্যবহার হবে।")
+    return True
+
+async def route_audio_order_reply(c, m: Message, uid: int) -> bool:
+    if not (m.reply_to_message and m.reply_to_message.id in PENDING_AUDIO_ORDERS):
+        return False
 
-    if m.reply_to_message and m.reply_to_message.id in PENDING_AUDIO_ORDERS:
-        prompt_message_id = m.reply_to_message.id
-        file_data = PENDING_AUDIO_ORDERS.get(prompt_message_id)
+    text = m.text.strip()
+    prompt_message_id = m.reply_to_message.id
+    order = PENDING_AUDIO_ORDERS.get(prompt_message_id)
+    
+    if order.uid != uid:
+         await m.reply_text("আপনি এই ফাইলের জন্য অর্ডার দিতে পারবেন না।")
+         return True
+
+    tracks = order.tracks
+    try:
+        new_order_str = [x.strip() for x in text.split(',') if x.strip()]
+        num_tracks_in_file = len(tracks)
         
-        if file_data['uid'] != uid:
-             await m.reply_text("আপনি এই ফাইলের জন্য অর্ডার দিতে পারবেন না।")
-             return
+        if not new_order_str:
+             await m.reply_text("আপনাকে অন্তত একটি ট্র্যাক নম্বর দিতে হবে।")
+             return True
 
-        tracks = file_data['tracks']
-        try:
-            new_order_str = [x.strip() for x in text.split(',') if x.strip()]
-            num_tracks_in_file = len(tracks)
+        new_stream_map = []
+        valid_user_indices = list(range(1, num_tracks_in_file + 1))
+        
+        for user_track_num_str in new_order_str:
+            user_track_num = int(user_track_num_str) 
+            if user_track_num not in valid_user_indices:
+                 await m.reply_text(f"ভুল ট্র্যাক নম্বর: {user_track_num}। ট্র্যাক নম্বরগুলো হতে হবে: {', '.join(map(str, valid_user_indices))}")
+                 return True
             
-            if not new_order_str:
-                 await m.reply_text("আপনাকে অন্তত একটি ট্র্যাক নম্বর দিতে হবে।")
-                 return
+            stream_index_to_map = tracks[user_track_num - 1]['stream_index']
+            new_stream_map.append(f"0:{stream_index_to_map}") 
 
-            new_stream_map = []
-            valid_user_indices = list(range(1, num_tracks_in_file + 1))
-            
-            for user_track_num_str in new_order_str:
-                user_track_num = int(user_track_num_str) 
-                if user_track_num not in valid_user_indices:
-                     await m.reply_text(f"ভুল ট্র্যাক নম্বর: {user_track_num}। ট্র্যাক নম্বরগুলো হতে হবে: {', '.join(map(str, valid_user_indices))}")
-                     return
-                
-                stream_index_to_map = tracks[user_track_num - 1]['stream_index']
-                new_stream_map.append(f"0:{stream_index_to_map}") 
-
-            asyncio.create_task(
-                handle_audio_remux(
-                    c, m, file_data['path'], 
-                    file_data['original_name'], 
-                    new_stream_map, 
-                    messages_to_delete=[prompt_message_id, m.id]
-                )
+        # Only the IDs are kept while waiting; refetch the source if it still has to be downloaded.
+        source_message = None if order.download_task else await c.get_messages(order.chat_id, order.message_id)
+        asyncio.create_task(
+            handle_audio_remux(
+                c, m, order.path, 
+                order.original_name, 
+                new_stream_map, 
+                messages_to_delete=[prompt_message_id, m.id],
+                download_task=order.download_task,
+                source_message=source_message,
+                caption_slot=order.caption_slot
             )
+        )
 
-            PENDING_AUDIO_ORDERS.pop(prompt_message_id, None) 
-            return
-
-        except ValueError:
-            await m.reply_to_message.reply_text("ভুল ফরম্যাট। কমা-সেপারেটেড সংখ্যা দিন। উদাহরণ: `1,3`")
-            return
-        except Exception as e:
-            logger.error(f"Audio remux preparation error: {e}")
-            await m.reply_to_message.reply_text(f"অডিও পরিবর্তন প্রক্রিয়া শুরু করতে সমস্যা: {e}")
-            
-            try: Path(file_data['path']).unlink(missing_ok=True)
-            except Exception: pass
-            PENDING_AUDIO_ORDERS.pop(prompt_message_id, None)
-            return
+        PENDING_AUDIO_ORDERS.pop(prompt_message_id, None) 
+        return True
 
-    if uid in CREATE_POST_MODE and uid in POST_CREATION_STATE:
-        state_data = POST_CREATION_STATE[uid]
-        state_data['message_ids'].append(m.id) 
-        
-        current_state = state_data['state']
+    except ValueError:
+        await m.reply_to_message.reply_text("ভুল ফরম্যাট। কমা-সেপারেটেড সংখ্যা দিন। উদাহরণ: `1,3`")
+        return True
+    except Exception as e:
+        logger.error(f"Audio remux preparation error: {e}")
+        await m.reply_to_message.reply_text(f"অডিও পরিবর্তন প্রক্রিয়া শুরু করতে সমস্যা: {e}")
         
-        if current_state == 'awaiting_name_change':
-            if not text:
-                prompt_msg = await m.reply_text("নাম খালি রাখা যাবে না। সঠিক নামটি দিন।")
-                state_data['message_ids'].append(prompt_msg.id)
-                return
-            
-            state_data['post_data']['image_name'] = text
-            state_data['state'] = 'awaiting_genres_add'
-            
-            new_caption = generate_post_caption(state_data['post_data'])
-            try:
-                await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
-            except Exception as e:
-                logger.error(f"Edit caption error in name change: {e}")
-                await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
-                return
+        cancel_background_download(order)
+        release_caption_slots(uid, [order.caption_slot])
+        try: Path(order.path).unlink(missing_ok=True)
+        except Exception: pass
+        PENDING_AUDIO_ORDERS.pop(prompt_message_id, None)
+        return True
+
+async def route_post_creation_text(c, m: Message, uid: int) -> bool:
+    if uid not in POST_CREATION_STATE:
+        return False
 
-            prompt_msg = await m.reply_text(
-                f"✅ ছবির নাম সেট হয়েছে: `{text}`\n\n**এখন Genres যোগ করুন।**\n"
-                f"উদাহরণ: `Comedy, Romance, Action`"
-            )
+    text = m.text.strip()
+    state_data = POST_CREATION_STATE[uid]
+    state_data['message_ids'].append(m.id) 
+    
+    current_state = state_data['state']
+    if current_state not in ('awaiting_name_change', 'awaiting_genres_add', 'awaiting_season_list'):
+        return False
+    
+    if current_state == 'awaiting_name_change':
+        if not text:
+            prompt_msg = await m.reply_text("নাম খালি রাখা যাবে না। সঠিক নামটি দিন।")
             state_data['message_ids'].append(prompt_msg.id)
-            
-        elif current_state == 'awaiting_genres_add':
-            state_data['post_data']['genres'] = text 
-            state_data['state'] = 'awaiting_season_list'
-            
-            new_caption = generate_post_caption(state_data['post_data'])
-            try:
-                await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
-            except Exception as e:
-                logger.error(f"Edit caption error in genres add: {e}")
-                await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
-                return
+            return True
+        
+        state_data['post_data']['image_name'] = text
+        state_data['state'] = 'awaiting_genres_add'
+        
+        new_caption = generate_post_caption(state_data['post_data'])
+        try:
+            await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
+        except Exception as e:
+            logger.error(f"Edit caption error in name change: {e}")
+            await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
+            return True
 
-            prompt_msg = await m.reply_text(
-                f"✅ Genres সেট হয়েছে: `{text}`\n\n**এখন Season List পরিবর্তন করুন।**\n"
-                f"Change Season List এর মানে \"{state_data['post_data']['image_name']}\" Season 01 কয়টি add করব?\n"
-                f"ফরম্যাট: সিজন নম্বর অথবা রেঞ্জ কমা বা স্পেস-সেপারেটেড দিন।\n"
-                f"উদাহরণ:\n"
-                f"‣ `1` (Season 01)\n"
-                f"‣ `1-2` (Season 01 থেকে Season 02)\n"
-                f"‣ `1-2 4-5` বা `1-2, 4-5` (Season 01-02 এবং 04-05)"
-            )
-            state_data['message_ids'].append(prompt_msg.id)
-            
-        elif current_state == 'awaiting_season_list':
-            if not text.strip():
-                state_data['post_data']['season_list_raw'] = ""
-            else:
-                state_data['post_data']['season_list_raw'] = text
-            
-            new_caption = generate_post_caption(state_data['post_data'])
+        prompt_msg = await m.reply_text(
+            f"✅ ছবির নাম সেট হয়েছে: `{text}`\n\n**এখন Genres যোগ করুন।**\n"
+            f"উদাহরণ: `Comedy, Romance, Action`"
+        )
+        state_data['message_ids'].append(prompt_msg.id)
+        
+    elif current_state == 'awaiting_genres_add':
+        state_data['post_data']['genres'] = text 
+        state_data['state'] = 'awaiting_season_list'
+        
+        new_caption = generate_post_caption(state_data['post_data'])
+        try:
+            await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
+        except Exception as e:
+            logger.error(f"Edit caption error in genres add: {e}")
+            await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
+            return True
+
+        prompt_msg = await m.reply_text(
+            f"✅ Genres সেট হয়েছে: `{text}`\n\n**এখন Season List পরিবর্তন করুন।**\n"
+            f"Change Season List এর মানে \"{state_data['post_data']['image_name']}\" Season 01 কয়টি add করব?\n"
+            f"ফরম্যাট: সিজন নম্বর অথবা রেঞ্জ কমা বা স্পেস-সেপারেটেড দিন।\n"
+            f"উদাহরণ:\n"
+            f"‣ `1` (Season 01)\n"
+            f"‣ `1-2` (Season 01 থেকে Season 02)\n"
+            f"‣ `1-2 4-5` বা `1-2, 4-5` (Season 01-02 এবং 04-05)"
+        )
+        state_data['message_ids'].append(prompt_msg.id)
+        
+    elif current_state == 'awaiting_season_list':
+        if not text.strip():
+            state_data['post_data']['season_list_raw'] = ""
+        else:
+            state_data['post_data']['season_list_raw'] = text
+        
+        new_caption = generate_post_caption(state_data['post_data'])
+        try:
+            await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
+        except Exception as e:
+            logger.error(f"Edit caption error in season list: {e}")
+            await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
+            return True
+
+        all_messages = state_data.get('message_ids', [])
+        post_id = state_data.get('post_message_id')
+        if post_id and post_id in all_messages:
+            all_messages.remove(post_id) 
+        if all_messages:
             try:
-                await c.edit_message_caption(m.chat.id, state_data['post_message_id'], caption=new_caption, parse_mode=ParseMode.MARKDOWN)
+                await c.delete_messages(m.chat.id, all_messages)
             except Exception as e:
-                logger.error(f"Edit caption error in season list: {e}")
-                await m.reply_text("ক্যাপশন এডিট করতে সমস্যা হয়েছে। প্রক্রিয়া বাতিল করা হচ্ছে। /create_post দিয়ে মোড অফ করুন।")
-                return
-
-            all_messages = state_data.get('message_ids', [])
-            post_id = state_data.get('post_message_id')
-            if post_id and post_id in all_messages:
-                all_messages.remove(post_id) 
-            if all_messages:
-                try:
-                    await c.delete_messages(m.chat.id, all_messages)
-                except Exception as e:
-                    logger.warning(f"Error deleting post creation messages: {e}")
-            
-            image_path = state_data['image_path']
-            if image_path and Path(image_path).exists():
-                Path(image_path).unlink(missing_ok=True)
-            
-            CREATE_POST_MODE.discard(uid)
-            POST_CREATION_STATE.pop(uid, None)
-            
-            await m.reply_text("✅ পোস্ট তৈরি সফলভাবে সম্পন্ন হয়েছে এবং সমস্ত অতিরিক্ত বার্তা মুছে ফেলা হয়েছে।")
-            return
-
+                logger.warning(f"Error deleting post creation messages: {e}")
+        
+        image_path = state_data['image_path']
+        if image_path and Path(image_path).exists():
+            Path(image_path).unlink(missing_ok=True)
+        
+        CREATE_POST_MODE.discard(uid)
+        POST_CREATION_STATE.pop(uid, None)
+        
+        await m.reply_text("✅ পোস্ট তৈরি সফলভাবে সম্পন্ন হয়েছে এবং সমস্ত অতিরিক্ত বার্তা মুছে ফেলা হয়েছে।")
+    return True
 
+async def route_url_text(c, m: Message, uid: int) -> bool:
+    text = m.text.strip()
+    urls = extract_urls(text)
+    if len(urls) > 1:
+        asyncio.create_task(run_bulk_url_ingest(c, m, urls))
+        return True
     if text.startswith("http://") or text.startswith("https://"):
         asyncio.create_task(handle_url_download_and_upload(c, m, text))
-    
+        return True
+    return False
+
 @app.on_message(filters.command("upload_url") & filters.private)
 async def upload_url_cmd(c, m: Message):
     if not is_admin(m.from_user.id):
         await m.reply_text("আপনার অনুমতি নেই এই কমান্ড চালানোর।")
         return
-    if not m.command or len(m.command) < 2:
-        await m.reply_text("ব্যবহার: /upload_url <url>\nউদাহরণ: /upload_url https://example.com/file.mp4")
+    urls = extract_urls(m.text or m.caption)
+    list_message = m if m.document else m.reply_to_message
+    if list_message and list_message.document and (list_message.document.file_name or "").lower().endswith(".txt"):
+        urls = list(dict.fromkeys(urls + await read_url_list(list_message)))[:BULK_URL_MAX]
+    if not urls:
+        await m.reply_text(
+            "ব্যবহার: /upload_url <url>\nউদাহরণ: /upload_url https://example.com/file.mp4\n\n"
+            "একসাথে অনেক লিংক: প্রতি লাইনে একটি URL দিন, অথবা URL-এর .txt ফাইলে /upload_url ক্যাপশন/রিপ্লাই দিন।"
+        )
         return
-    url = m.text.split(None, 1)[1].strip()
-    asyncio.create_task(handle_url_download_and_upload(c, m, url))
+    if len(urls) == 1:
+        asyncio.create_task(handle_url_download_and_upload(c, m, urls[0]))
+    else:
+        asyncio.create_task(run_bulk_url_ingest(c, m, urls))
 
-async def handle_url_download_and_upload(c: Client, m: Message, url: str):
+async def handle_url_download_and_upload(c: Client, m: Message, url: str, playlist: bool = False):
     uid = m.from_user.id
     
+    folder_id = extract_drive_folder_id(url)
+    if folder_id:
+        await run_drive_folder_ingest(c, m, folder_id)
+        return
+
     try:
         status_msg = await m.reply_text("Searching formats...", reply_markup=progress_keyboard())
 
-        ydl_opts = {'noplaylist': True, 'quiet': True}
+        # Playlist entries stay flat, so a playlist URL costs one listing instead of one extraction per entry.
+        ydl_opts = {'noplaylist': not playlist, 'quiet': True, 'extract_flat': 'in_playlist'}
+        yt_dlp = await lazy_module_async("yt_dlp")
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             try:
                 info = await asyncio.to_thread(ydl.extract_info, url, download=False)
@@ -1284,6 +2714,10 @@ async def handle_url_download_and_upload(c: Client, m: Message, url: str):
                      await status_msg.edit(f"URL Extract Error: {e}")
                      return
 
+        if info.get('_type') == 'playlist' or info.get('entries') is not None:
+            await offer_playlist_policies(m, status_msg, info)
+            return
+
         formats = info.get('formats', [])
         valid_formats = []
         for f in formats:
@@ -1294,7 +2728,8 @@ async def handle_url_download_and_upload(c: Client, m: Message, url: str):
         
         buttons = []
         key_best = f"ytdl_{uid}_best"
-        YT_DATA[key_best] = {'url': url, 'format_id': 'bestvideo+bestaudio/best', 'info': info, 'msg_id': status_msg.id}
+        title = info.get('title', 'video')
+        YT_DATA[key_best] = YtFormatChoice(url, 'bestvideo+bestaudio/best', title, status_msg.id)
         buttons.append([InlineKeyboardButton(f"Best Quality", callback_data=key_best)])
 
         seen_res = set()
@@ -1307,13 +2742,13 @@ async def handle_url_download_and_upload(c: Client, m: Message, url: str):
             
             ext = f.get('ext', 'mp4')
             key = f"ytdl_{uid}_{f['format_id']}"
-            YT_DATA[key] = {'url': url, 'format_id': f['format_id'], 'info': info, 'msg_id': status_msg.id}
+            YT_DATA[key] = YtFormatChoice(url, f['format_id'], title, status_msg.id)
             
             btn_text = f"{res_str} | {ext}"
             buttons.append([InlineKeyboardButton(btn_text, callback_data=key)])
         
         key_mp3 = f"ytdl_{uid}_mp3"
-        YT_DATA[key_mp3] = {'url': url, 'format_id': 'bestaudio/best', 'info': info, 'msg_id': status_msg.id, 'is_audio': True}
+        YT_DATA[key_mp3] = YtFormatChoice(url, 'bestaudio/best', title, status_msg.id, is_audio=True)
         buttons.append([InlineKeyboardButton("🎵 MP3 (Audio Only)", callback_data=key_mp3)])
 
         buttons.append([InlineKeyboardButton("Cancel ❌", callback_data="cancel_task")])
@@ -1330,6 +2765,17 @@ async def handle_url_download_and_upload(c: Client, m: Message, url: str):
         except:
              await m.reply_text(f"Error: {e}")
 
+@app.on_message(filters.command("playlist") & filters.private)
+async def playlist_cmd(c, m: Message):
+    if not is_admin(m.from_user.id):
+        await m.reply_text("আপনার অনুমতি নেই এই কমান্ড চালানোর।")
+        return
+    urls = extract_urls(m.text)
+    if not urls:
+        await m.reply_text("ব্যবহার: /playlist <playlist url>\nউদাহরণ: /playlist https://www.youtube.com/playlist?list=...")
+        return
+    asyncio.create_task(handle_url_download_and_upload(c, m, urls[0], playlist=True))
+
 @app.on_callback_query(filters.regex(r"^ytdl_"))
 async def ytdl_callback(c: Client, cb: CallbackQuery):
     uid = cb.from_user.id
@@ -1342,11 +2788,10 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
         
     await cb.answer("Download started...")
     
-    url = data['url']
-    fmt = data['format_id']
-    info = data['info']
-    msg_id = data['msg_id']
-    is_audio = data.get('is_audio', False)
+    url = data.url
+    fmt = data.format_id
+    msg_id = data.msg_id
+    is_audio = data.is_audio
     
     try:
         await c.edit_message_reply_markup(cb.message.chat.id, msg_id, reply_markup=None)
@@ -1356,10 +2801,19 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
     
     cancel_event = asyncio.Event()
     TASKS.setdefault(uid, []).append(cancel_event)
+    caption_slot = reserve_caption_slot(uid)
     
     try:
-        title = info.get('title', 'video')
+        title = data.title
         timestamp = int(datetime.now().timestamp())
+        source_key = f"url:{url}|{'audio' if is_audio else fmt}"
+        if await reuse_cached_upload(c, cb.message, uid, source_key, caption_slot):
+            TASKS[uid].remove(cancel_event)
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+            return
         
         if is_audio:
             out_tmpl = str(TMP / f"dl_{uid}_{timestamp}.%(ext)s")
@@ -1388,16 +2842,23 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
                 'merge_output_format': 'mkv' 
             }
 
+        loop = asyncio.get_running_loop()
+        reporter = get_progress_reporter(status_msg, f"Downloading `{title}`...")
+
         def ytdl_progress_hook(d):
             if cancel_event.is_set():
                 raise Exception("Download cancelled by user")
+            if d.get('status') == 'downloading' and reporter:
+                loop.call_soon_threadsafe(reporter.update, d.get('downloaded_bytes') or 0, d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
 
         ydl_opts['progress_hooks'] = [ytdl_progress_hook]
         
         await status_msg.edit(f"Downloading `{title}`...", reply_markup=progress_keyboard())
         
+        yt_dlp = await lazy_module_async("yt_dlp")
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             await asyncio.to_thread(ydl.download, [url])
+        await close_progress_reporter(status_msg)
             
         expected_prefix = f"dl_{uid}_{timestamp}"
         found_file = None
@@ -1407,6 +2868,7 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
                 break
         
         if not found_file:
+            release_caption_slots(uid, [caption_slot])
             await status_msg.edit(f"Download failed (file not found).")
             return
             
@@ -1416,10 +2878,11 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
         final_filename = f"{safe_title}{found_file.suffix}"
         
         asyncio.create_task(
-            sequential_upload_task(uid, c, cb.message, found_file, final_filename, status_msg.id, cancel_event)
+            sequential_upload_task(uid, c, cb.message, found_file, final_filename, status_msg.id, cancel_event, caption_slot=caption_slot, source_key=source_key)
         )
         
     except Exception as e:
+        release_caption_slots(uid, [caption_slot])
         if "cancelled" in str(e).lower():
              await status_msg.edit("Download Cancelled.")
         else:
@@ -1427,49 +2890,685 @@ async def ytdl_callback(c: Client, cb: CallbackQuery):
     finally:
         pass
 
+# Prefers the Content-Disposition filename, then the URL path; the real extension is
+# kept and .mp4 is only appended when neither name carries one.
+def url_download_name(url: str, disposition_name: str = None) -> str:
+    url_name = unquote(url.split("?")[0].split("#")[0].split("/")[-1])
+    candidates = [Path(name.replace("\\", "/")).name for name in (disposition_name, url_name) if name]
+    fname = next((name for name in candidates if has_file_extension(name)), None)
+    if not fname:
+        fname = (candidates[0] if candidates else "") or f"download_{int(datetime.now().timestamp())}"
+        fname += ".mp4"
+    return re.sub(r"[\\/*?\"<>|:]", "_", fname)
+
+SCRIPT_URL_EXTS = {".php", ".asp", ".aspx", ".jsp", ".cgi", ".htm", ".html"}
+
+def has_file_extension(name: str) -> bool:
+    suffix = Path(name).suffix
+    return bool(re.fullmatch(r"\.[A-Za-z0-9]{1,5}", suffix)) and suffix.lower() not in SCRIPT_URL_EXTS
+
+# Moves a finished download to the name the server announced, keeping the prefix.
+def apply_disposition_name(path: Path, prefix: str, url: str, meta: dict):
+    if not meta.get('filename'):
+        return path, path.name[len(prefix):]
+    name = url_download_name(url, meta['filename'])
+    return path.rename(path.with_name(prefix + name)), name
+
 async def download_and_process_generic(c, m, url, status_msg):
     uid = m.from_user.id
     cancel_event = asyncio.Event()
     TASKS.setdefault(uid, []).append(cancel_event)
+    caption_slot = reserve_caption_slot(uid)
     
     try:
-        fname = url.split("/")[-1].split("?")[0] or f"download_{int(datetime.now().timestamp())}"
-        safe_name = re.sub(r"[\\/*?\"<>|:]", "_", fname)
-
-        video_exts = {".mp4", ".mkv", ".avi", ".mov", ".flv", ".wmv", ".webm"}
-        if not any(safe_name.lower().endswith(ext) for ext in video_exts):
-            safe_name += ".mp4"
-
-        tmp_in = TMP / f"dl_{uid}_{int(datetime.now().timestamp())}_{safe_name}"
+        safe_name = url_download_name(url)
+        prefix = f"dl_{uid}_{int(datetime.now().timestamp())}_"
+        tmp_in = TMP / f"{prefix}{safe_name}"
         ok, err = False, None
+        meta = {}
         
-        if is_drive_url(url):
-            fid = extract_drive_id(url)
-            if not fid:
-                await status_msg.edit("Google Drive ID not found.")
-                TASKS[uid].remove(cancel_event)
-                return
-            ok, err = await download_drive_file(fid, tmp_in, status_msg, cancel_event=cancel_event)
+        fid = extract_drive_id(url) if is_drive_url(url) else None
+        if is_drive_url(url) and not fid:
+            await status_msg.edit("Google Drive ID not found.")
+            TASKS[uid].remove(cancel_event)
+            release_caption_slots(uid, [caption_slot])
+            return
+        source_key = f"drive:{fid}" if fid else f"url:{url}"
+        if await reuse_cached_upload(c, m, uid, source_key, caption_slot):
+            TASKS[uid].remove(cancel_event)
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+            return
+
+        if fid:
+            ok, err = await download_drive_file(fid, tmp_in, status_msg, cancel_event=cancel_event, meta=meta)
         else:
-            ok, err = await download_url_generic(url, tmp_in, status_msg, cancel_event=cancel_event)
+            ok, err = await download_url_generic(url, tmp_in, status_msg, cancel_event=cancel_event, meta=meta)
 
         if not ok:
             await status_msg.edit(f"Download Failed: {err}")
             if tmp_in.exists(): tmp_in.unlink()
             TASKS[uid].remove(cancel_event)
+            release_caption_slots(uid, [caption_slot])
             return
 
+        tmp_in, safe_name = apply_disposition_name(tmp_in, prefix, url, meta)
         await status_msg.edit("Download complete. Uploading...", reply_markup=None)
         renamed_file = generate_new_filename(safe_name)
         
         asyncio.create_task(
-            sequential_upload_task(uid, c, m, tmp_in, renamed_file, status_msg.id, cancel_event)
+            sequential_upload_task(uid, c, m, tmp_in, renamed_file, status_msg.id, cancel_event, caption_slot=caption_slot, source_key=source_key)
         )
     except Exception as e:
+        release_caption_slots(uid, [caption_slot])
         await status_msg.edit(f"Error: {e}")
     finally:
         pass
 
+# --- BULK URL INGEST ---
+# Links are classified from the URL (and a HEAD request when the extension says
+# nothing), so direct files never pay for a yt-dlp extraction. Downloads run in a
+# sliding window of BULK_URL_CONCURRENCY entries under one shared byte budget,
+# and finished files are uploaded strictly in input order.
+BULK_URL_CONCURRENCY = int(os.getenv("BULK_URL_CONCURRENCY", "3"))
+BULK_URL_MAX = int(os.getenv("BULK_URL_MAX", "200"))
+BULK_BANDWIDTH = float(os.getenv("BULK_BANDWIDTH_MBPS", "0")) * 1024 * 1024  # bytes/s shared by all downloads of a bulk/playlist job (direct and yt-dlp), 0 = unlimited
+BULK_STATUS_INTERVAL = 5
+BULK_URL_LIST_MAX = 1024 * 1024
+DIRECT_URL_EXTS = {".mp4", ".mkv", ".avi", ".mov", ".flv", ".wmv", ".webm", ".m4v", ".ts", ".mp3", ".m4a", ".flac", ".wav", ".aac", ".zip", ".rar", ".7z"}
+DIRECT_CONTENT_TYPES = ("video/", "audio/", "application/octet-stream", "application/x-matroska", "application/zip")
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+
+def extract_urls(text: str) -> list:
+    # Sentence punctuation right after a link ("see https://x/a.mp4, then") is not part of it.
+    urls = (url.rstrip(".,;:!?)]}") for url in URL_PATTERN.findall(text or ""))
+    return list(dict.fromkeys(urls))[:BULK_URL_MAX]
+
+async def read_url_list(m: Message) -> list:
+    if (m.document.file_size or 0) > BULK_URL_LIST_MAX:
+        return []
+    data = await m.download(in_memory=True)
+    return extract_urls(bytes(data.getbuffer()).decode("utf-8", errors="ignore"))
+
+async def classify_url(sess: aiohttp.ClientSession, url: str) -> str:
+    if is_drive_url(url):
+        return "drive"
+    if Path(url.split("?")[0].split("#")[0]).suffix.lower() in DIRECT_URL_EXTS:
+        return "direct"
+    try:
+        async with sess.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=15)) as resp:
+            content_type = resp.headers.get("Content-Type", "").lower()
+            disposition = resp.headers.get("Content-Disposition", "").lower()
+            if resp.status < 400 and (content_type.startswith(DIRECT_CONTENT_TYPES) or "attachment" in disposition):
+                return "direct"
+    except Exception:
+        pass
+    return "ytdl"
+
+# Downloads one yt-dlp entry to TMP/<out_stem>.<ext> and returns (path, title).
+# Bytes are charged to the shared bandwidth bucket from the progress hook, which
+# blocks yt-dlp's download thread until the budget allows more. On failure every
+# TMP/<out_stem>.* leftover (.part fragments, unmerged streams) is removed.
+async def download_ytdl_entry(url: str, out_stem: str, fmt: str, cancel_event: asyncio.Event, progress=None, bandwidth: RateLimiter = None, audio_only: bool = False):
+    loop = asyncio.get_running_loop()
+    charged = {'file': None, 'bytes': 0}
+
+    def progress_hook(d):
+        if cancel_event.is_set():
+            raise Exception("Download cancelled by user")
+        if d.get('status') != 'downloading':
+            return
+        done = d.get('downloaded_bytes') or 0
+        if bandwidth:
+            # Video and audio streams download one after another, each counting from zero.
+            if d.get('filename') != charged['file']:
+                charged['file'], charged['bytes'] = d.get('filename'), 0
+            delta = done - charged['bytes']
+            charged['bytes'] = done
+            if delta > 0:
+                asyncio.run_coroutine_threadsafe(bandwidth.acquire(delta), loop).result()
+        if progress:
+            asyncio.run_coroutine_threadsafe(progress(done, d.get('total_bytes') or d.get('total_bytes_estimate') or 0), loop)
+
+    ydl_opts = {
+        'format': fmt,
+        'outtmpl': str(TMP / f"{out_stem}.%(ext)s"),
+        'quiet': True,
+        'noplaylist': True,
+        'merge_output_format': 'mkv',
+        'progress_hooks': [progress_hook],
+    }
+    if audio_only:
+        ydl_opts['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]
+    try:
+        yt_dlp = await lazy_module_async("yt_dlp")
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = await asyncio.to_thread(ydl.extract_info, url, download=True)
+        found = next((f for f in TMP.glob(f"{out_stem}.*") if not f.name.endswith((".part", ".ytdl"))), None)
+        if not found:
+            raise Exception("Download failed (file not found).")
+        return found, (info or {}).get('title') or found.stem
+    except BaseException:
+        for leftover in TMP.glob(f"{out_stem}.*"):
+            leftover.unlink(missing_ok=True)
+        raise
+
+class BulkEntry:
+    __slots__ = ("index", "url", "kind", "state", "done", "total", "path", "name", "error", "source_key", "cached")
+
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        self.kind = None
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.path = None
+        self.name = None
+        self.error = None
+        self.source_key = None
+        self.cached = None
+
+    async def progress(self, done: int, total: int = 0):
+        if done > self.done:
+            record_throughput(done - self.done)
+        self.done = done
+        self.total = total or self.total
+
+BULK_STATE_ICONS = {"queued": "⏳", "downloading": "⬇️", "downloaded": "📦", "uploading": "⬆️", "uploaded": "✅", "failed": "❌"}
+
+def render_bulk_status(entries: list, finished: bool = False, title: str = "Bulk URL") -> str:
+    counts = {}
+    for entry in entries:
+        counts[entry.state] = counts.get(entry.state, 0) + 1
+    head = f"{title} সম্পন্ন" if finished else f"{title} চলছে"
+    lines = [f"**{head}**: {counts.get('uploaded', 0)}/{len(entries)} আপলোড, {counts.get('failed', 0)} ব্যর্থ"]
+    shown = [e for e in entries if e.state in ("downloading", "downloaded", "uploading", "failed")]
+    for entry in shown[:15]:
+        label = entry.name or entry.url.split("?")[0].rstrip("/").split("/")[-1] or entry.url
+        detail = entry.error or ""
+        if entry.state == "downloading" and entry.total:
+            detail = f"{entry.done * 100 // entry.total}% of {format_size(entry.total)}"
+        elif entry.state == "downloading" and entry.done:
+            detail = format_size(entry.done)
+        lines.append(f"{BULK_STATE_ICONS[entry.state]} {entry.index}. `{label[:50]}` {detail[:80]}".rstrip())
+    if len(shown) > 15:
+        lines.append(f"... আরও {len(shown) - 15} টি")
+    return "\n".join(lines)
+
+async def bulk_status_loop(status_msg: Message, entries: list, title: str):
+    last_text = None
+    while True:
+        await asyncio.sleep(BULK_STATUS_INTERVAL)
+        text = render_bulk_status(entries, title=title)
+        if text == last_text:
+            continue
+        try:
+            await status_msg.edit(text, reply_markup=progress_keyboard())
+            last_text = text
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+        except Exception:
+            pass
+
+# An entry whose source was already sent skips the download; the pipeline posts the cached copy.
+async def reuse_cached_entry(entry: BulkEntry, uid: int) -> bool:
+    entry.cached = await lookup_cached_upload(uid, entry.source_key)
+    if entry.cached:
+        entry.name, entry.state = entry.cached[3], "downloaded"
+    return bool(entry.cached)
+
+async def download_bulk_entry(sess: aiohttp.ClientSession, entry: BulkEntry, uid: int, bandwidth: RateLimiter, cancel_event: asyncio.Event, fmt: str = 'bestvideo+bestaudio/best', audio_only: bool = False):
+    if entry.kind is None:
+        entry.kind = await classify_url(sess, entry.url)
+    if entry.kind == "drive":
+        # Folder listings and single Drive links share the retrying, resuming download.
+        await download_drive_folder_entry(sess, entry, uid, cancel_event, bandwidth)
+        return
+    entry.source_key = f"url:{entry.url}|{'audio' if audio_only else fmt}" if entry.kind == "ytdl" else f"url:{entry.url}"
+    if await reuse_cached_entry(entry, uid):
+        return
+    entry.state = "downloading"
+    stem = f"bulk_{uid}_{int(time.time())}_{entry.index}"
+    out = None
+    try:
+        if entry.kind == "ytdl":
+            out, title = await download_ytdl_entry(entry.url, stem, fmt, cancel_event, progress=entry.progress, bandwidth=bandwidth, audio_only=audio_only)
+            safe_title = re.sub(r"[\\/*?\"<>|:]", "_", title)
+            entry.name = f"{safe_title}{out.suffix}"
+        else:
+            safe_name = url_download_name(entry.url, entry.name)
+            out = TMP / f"{stem}_{safe_name}"
+            meta = {}
+            ok, err = await download_url_generic(entry.url, out, cancel_event=cancel_event, bandwidth=bandwidth, progress=entry.progress, meta=meta)
+            if not ok:
+                raise Exception(err)
+            out, safe_name = apply_disposition_name(out, f"{stem}_", entry.url, meta)
+            entry.name = generate_new_filename(safe_name)
+        entry.path = out
+        entry.state = "downloaded"
+    except BaseException as e:
+        entry.state = "failed"
+        entry.error = "বাতিল" if isinstance(e, asyncio.CancelledError) else str(e)
+        if out and out.exists():
+            out.unlink(missing_ok=True)
+        if isinstance(e, asyncio.CancelledError):
+            raise
+
+# Runs fetch(entry, cancel_event) over a sliding window and uploads in list order.
+# With caption_slots, entry i is captioned with caption_slots[i]; otherwise a slot
+# is reserved as each upload starts.
+async def run_ingest_pipeline(c: Client, m: Message, entries: list, fetch, concurrency: int, title: str, caption_slots: list = None):
+    uid = m.from_user.id
+    cancel_event = asyncio.Event()
+    TASKS.setdefault(uid, []).append(cancel_event)
+    status_msg = await m.reply_text(f"{title}: {len(entries)} টি ফাইল শুরু হচ্ছে...", reply_markup=progress_keyboard())
+    status_task = asyncio.create_task(bulk_status_loop(status_msg, entries, title))
+    window = {}
+    try:
+        next_start = 0
+        for i, entry in enumerate(entries):
+            # Entry i uploads while the next concurrency - 1 entries download.
+            while next_start < len(entries) and next_start < i + concurrency:
+                window[next_start] = asyncio.create_task(fetch(entries[next_start], cancel_event))
+                next_start += 1
+            await window.pop(i)
+            if cancel_event.is_set():
+                break
+            if entry.state != "downloaded":
+                continue
+
+            entry.state = "uploading"
+            # process_file_and_upload unregisters its event when done, so each upload gets its own.
+            upload_event = asyncio.Event()
+            TASKS.setdefault(uid, []).append(upload_event)
+            caption_slot = caption_slots[i] if caption_slots else reserve_caption_slot(uid)
+            if uid not in USER_UPLOAD_LOCKS:
+                USER_UPLOAD_LOCKS[uid] = asyncio.Lock()
+            async with USER_UPLOAD_LOCKS[uid]:
+                ok = False
+                if entry.cached:
+                    ok = await send_cached_file(c, m, uid, entry.cached, caption_slot)
+                    entry.cached = None
+                    if not ok:
+                        # The cached copy was refused (and forgotten), so download it after all.
+                        await fetch(entry, upload_event)
+                if not ok and entry.state != "failed":
+                    entry.state = "uploading"
+                    ok = await process_file_and_upload(c, m, entry.path, original_name=entry.name, cancel_event_passed=upload_event, caption_slot=caption_slot, source_key=entry.source_key)
+            if upload_event in TASKS.get(uid, []):
+                TASKS[uid].remove(upload_event)
+            if upload_event.is_set():
+                entry.state, entry.error = "failed", "বাতিল"
+            elif entry.state == "failed":
+                pass
+            elif not ok:
+                entry.state, entry.error = "failed", "আপলোড ব্যর্থ"
+            else:
+                entry.state = "uploaded"
+    except Exception as e:
+        logger.error(f"{title} ingest error: {e}")
+    finally:
+        status_task.cancel()
+        for task in window.values():
+            task.cancel()
+        if window:
+            await asyncio.gather(*window.values(), return_exceptions=True)
+        for entry in entries:
+            if entry.state in ("queued", "downloaded"):
+                entry.state, entry.error = "failed", "বাতিল"
+            if entry.state == "failed" and entry.path and entry.path.exists():
+                entry.path.unlink(missing_ok=True)
+        if caption_slots:
+            uploaded = [i for i, entry in enumerate(entries) if entry.state == "uploaded"]
+            release_caption_slots(uid, caption_slots[uploaded[-1] + 1 if uploaded else 0:])
+        try:
+            TASKS[uid].remove(cancel_event)
+        except (KeyError, ValueError):
+            pass
+        try:
+            await status_msg.edit(render_bulk_status(entries, finished=True, title=title), reply_markup=None)
+        except Exception:
+            pass
+
+# Drive folder links expand in place into one entry per file (natural name order);
+# a folder that cannot be listed stays as a single failed entry with the reason.
+async def expand_bulk_urls(sess: aiohttp.ClientSession, urls: list) -> list:
+    entries = []
+    for url in urls:
+        folder_id = extract_drive_folder_id(url)
+        if not folder_id:
+            entries.append(BulkEntry(len(entries) + 1, url))
+            continue
+        try:
+            folder_entries = await list_drive_folder_entries(sess, folder_id, len(entries) + 1)
+            error = "Google Drive ফোল্ডারে কোনো ফাইল পাওয়া যায়নি।"
+        except Exception as e:
+            folder_entries, error = [], f"Google Drive ফোল্ডার পড়া যায়নি: {e}"
+        if not folder_entries:
+            entry = BulkEntry(len(entries) + 1, url)
+            entry.state, entry.error = "failed", error
+            entries.append(entry)
+            continue
+        entries += folder_entries
+    return entries[:BULK_URL_MAX]
+
+async def run_bulk_url_ingest(c: Client, m: Message, urls: list):
+    uid = m.from_user.id
+    bandwidth = RateLimiter(rate=BULK_BANDWIDTH, burst=BULK_BANDWIDTH) if BULK_BANDWIDTH else None
+    timeout = aiohttp.ClientTimeout(total=7200)
+    headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as sess:
+        entries = await expand_bulk_urls(sess, urls)
+
+        async def fetch(entry, cancel_event):
+            if entry.state == "failed":
+                return
+            await download_bulk_entry(sess, entry, uid, bandwidth, cancel_event)
+        await run_ingest_pipeline(c, m, entries, fetch, BULK_URL_CONCURRENCY, "Bulk URL")
+
+# --- YT-DLP PLAYLIST MODE ---
+# A playlist is listed with one flat extraction. The chosen quality policy is
+# applied to every entry, PLAYLIST_CONCURRENCY entries download at once and each
+# finished entry is uploaded in playlist order. Caption numbers are reserved for
+# the whole playlist up front, so entry N keeps its number even if an earlier
+# entry fails.
+PLAYLIST_CONCURRENCY = int(os.getenv("PLAYLIST_CONCURRENCY", "3"))
+PLAYLIST_MAX_ENTRIES = int(os.getenv("PLAYLIST_MAX_ENTRIES", "200"))
+PLAYLIST_POLICIES = {
+    'best': ("Best Quality", 'bestvideo+bestaudio/best'),
+    '1080': ("1080p", 'bestvideo[height<=1080]+bestaudio/best[height<=1080]'),
+    '720': ("720p", 'bestvideo[height<=720]+bestaudio/best[height<=720]'),
+    '480': ("480p", 'bestvideo[height<=480]+bestaudio/best[height<=480]'),
+    'mp3': ("🎵 MP3 (Audio Only)", 'bestaudio/best'),
+}
+
+class PlaylistChoice:
+    __slots__ = ('title', 'entries', 'chat_id', 'message_id')
+
+    def __init__(self, title: str, entries: list, chat_id: int, message_id: int):
+        self.title = title
+        self.entries = entries
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+PLAYLIST_DATA = ExpiringState("playlist_choices", ttl=1800, max_items=50)
+
+def playlist_entry_url(entry: dict) -> str:
+    return entry.get('url') or entry.get('webpage_url') or entry.get('id')
+
+async def offer_playlist_policies(m: Message, status_msg: Message, info: dict):
+    uid = m.from_user.id
+    entries = [e for e in (info.get('entries') or []) if e and e.get('_type') != 'playlist' and playlist_entry_url(e)]
+    if not entries:
+        await status_msg.edit("প্লেলিস্টে ডাউনলোড করার মতো কোনো এন্ট্রি পাওয়া যায়নি।")
+        return
+    entries = entries[:PLAYLIST_MAX_ENTRIES]
+    title = info.get('title') or "Playlist"
+    key = f"{uid}_{status_msg.id}"
+    PLAYLIST_DATA[key] = PlaylistChoice(title, [(playlist_entry_url(e), e.get('title')) for e in entries], m.chat.id, m.id)
+
+    buttons = [[InlineKeyboardButton(label, callback_data=f"plist_{key}_{policy}")] for policy, (label, _) in PLAYLIST_POLICIES.items()]
+    buttons.append([InlineKeyboardButton("Cancel ❌", callback_data="cancel_task")])
+    await status_msg.edit(
+        f"**{title}**\nPlaylist: {len(entries)} টি এন্ট্রি।\nসব এন্ট্রির জন্য কোয়ালিটি বাছাই করুন:",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+@app.on_callback_query(filters.regex(r"^plist_"))
+async def playlist_callback(c: Client, cb: CallbackQuery):
+    uid = cb.from_user.id
+    _, owner, msg_id, policy = cb.data.split("_", 3)
+    key = f"{owner}_{msg_id}"
+    if owner != str(uid):
+        await cb.answer("আপনি এই প্লেলিস্ট শুরু করতে পারবেন না।", show_alert=True)
+        return
+    choice = PLAYLIST_DATA.pop(key, None)
+    if not choice or policy not in PLAYLIST_POLICIES:
+        await cb.answer("Data expired.", show_alert=True)
+        return
+
+    await cb.answer("Playlist download started...")
+    label, fmt = PLAYLIST_POLICIES[policy]
+    try:
+        await cb.message.edit(f"**{choice.title}**\n{len(choice.entries)} টি এন্ট্রি, কোয়ালিটি: {label}", reply_markup=None)
+    except Exception:
+        pass
+
+    try:
+        source = await c.get_messages(choice.chat_id, choice.message_id)
+    except Exception as e:
+        await cb.message.reply_text(f"Error: {e}")
+        return
+    entries = []
+    for i, (url, title) in enumerate(choice.entries):
+        entry = BulkEntry(i + 1, url)
+        entry.kind = "ytdl"
+        entry.name = title
+        entries.append(entry)
+
+    bandwidth = RateLimiter(rate=BULK_BANDWIDTH, burst=BULK_BANDWIDTH) if BULK_BANDWIDTH else None
+
+    async def fetch(entry, cancel_event):
+        await download_bulk_entry(None, entry, uid, bandwidth, cancel_event, fmt=fmt, audio_only=policy == 'mp3')
+    asyncio.create_task(run_ingest_pipeline(
+        c, source, entries, fetch, PLAYLIST_CONCURRENCY, f"Playlist ({label})",
+        caption_slots=reserve_caption_slots(uid, len(entries))
+    ))
+
+# --- GOOGLE DRIVE FOLDER INGEST ---
+# A shared folder is listed through the Drive v3 API when DRIVE_API_KEY is set,
+# otherwise from the public embeddedfolderview page. Its files download
+# DRIVE_FOLDER_CONCURRENCY at a time over one session. A failed transfer is
+# retried with a Range request from the bytes already on disk; Drive links in a
+# bulk URL job take the same path. Files are uploaded in natural name order (E2
+# before E10). DRIVE_BASE_URL / DRIVE_API_URL can point
+# at a local stand-in that serves the same endpoints.
+DRIVE_API_KEY = os.getenv("DRIVE_API_KEY", "")
+DRIVE_API_URL = os.getenv("DRIVE_API_URL", "https://www.googleapis.com").rstrip("/")
+DRIVE_FOLDER_CONCURRENCY = int(os.getenv("DRIVE_FOLDER_CONCURRENCY", "3"))
+DRIVE_FOLDER_RETRIES = int(os.getenv("DRIVE_FOLDER_RETRIES", "3"))
+DRIVE_FOLDER_MIME = "application/vnd.google-apps.folder"
+# Only anchors on the entry id, its first link and the title class, so wrapper
+# markup (flip-entry-info, thumbnails) can change without breaking the listing.
+DRIVE_EMBED_ENTRY = re.compile(
+    r'id="entry-([a-zA-Z0-9_-]+)".*?<a href="([^"]*)".*?class="flip-entry-title">(.*?)<', re.S
+)
+
+async def list_drive_folder(sess: aiohttp.ClientSession, folder_id: str) -> list:
+    files = []
+    if DRIVE_API_KEY:
+        page_token = None
+        while True:
+            params = {
+                'q': f"'{folder_id}' in parents and trashed = false",
+                'fields': 'nextPageToken,files(id,name,mimeType)',
+                'pageSize': 1000,
+                'key': DRIVE_API_KEY,
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            async with sess.get(f"{DRIVE_API_URL}/drive/v3/files", params=params) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Drive API HTTP {resp.status}")
+                data = await resp.json()
+            files += [(f['id'], f['name']) for f in data.get('files', []) if f.get('mimeType') != DRIVE_FOLDER_MIME]
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                return files
+
+    async with sess.get(f"{DRIVE_BASE_URL}/embeddedfolderview", params={'id': folder_id}) as resp:
+        if resp.status != 200:
+            raise Exception(f"HTTP {resp.status}")
+        text = await resp.text(errors="ignore")
+    for file_id, href, name in DRIVE_EMBED_ENTRY.findall(text):
+        if "/folders/" not in href:
+            files.append((file_id, html.unescape(name).strip()))
+    return files
+
+# Entries from a listing carry the file's real name; a single link takes the
+# server's Content-Disposition name once downloaded.
+async def list_drive_folder_entries(sess: aiohttp.ClientSession, folder_id: str, first_index: int = 1) -> list:
+    entries = []
+    for file_id, name in sorted(await list_drive_folder(sess, folder_id), key=lambda f: natural_sort_key(f[1])):
+        entry = BulkEntry(first_index + len(entries), f"{DRIVE_BASE_URL}/file/d/{file_id}/view")
+        entry.kind, entry.name = "drive", name
+        entries.append(entry)
+    return entries
+
+async def download_drive_folder_entry(sess: aiohttp.ClientSession, entry: BulkEntry, uid: int, cancel_event: asyncio.Event, bandwidth: RateLimiter = None):
+    file_id = extract_drive_id(entry.url)
+    entry.source_key = f"drive:{file_id}" if file_id else None
+    if await reuse_cached_entry(entry, uid):
+        return
+    entry.state = "downloading"
+    prefix = f"gdf_{uid}_{int(time.time())}_{entry.index}_"
+    out = TMP / f"{prefix}{url_download_name(entry.url, entry.name)}"
+    meta = {}
+    err = None
+    try:
+        if not file_id:
+            raise Exception("Google Drive ID not found.")
+        for attempt in range(DRIVE_FOLDER_RETRIES + 1):
+            ok, err = await download_drive_file(file_id, out, cancel_event=cancel_event, bandwidth=bandwidth, progress=entry.progress, session=sess, resume=attempt > 0, meta=meta)
+            if ok or cancel_event.is_set():
+                break
+            logger.warning(f"Drive file {file_id} attempt {attempt + 1} failed: {err}")
+            await asyncio.sleep(min(30, 2 ** attempt))
+        if not ok:
+            raise Exception(err)
+        if not entry.name:
+            out, entry.name = apply_disposition_name(out, prefix, entry.url, meta)
+        entry.path = out
+        entry.name = generate_new_filename(entry.name)
+        entry.state = "downloaded"
+    except BaseException as e:
+        entry.state = "failed"
+        entry.error = "বাতিল" if isinstance(e, asyncio.CancelledError) else str(e)
+        out.unlink(missing_ok=True)
+        if isinstance(e, asyncio.CancelledError):
+            raise
+
+async def run_drive_folder_ingest(c: Client, m: Message, folder_id: str):
+    uid = m.from_user.id
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+    headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+    connector = aiohttp.TCPConnector(limit=DRIVE_FOLDER_CONCURRENCY * 2)
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as sess:
+        try:
+            entries = await list_drive_folder_entries(sess, folder_id)
+        except Exception as e:
+            await m.reply_text(f"Google Drive ফোল্ডার পড়া যায়নি: {e}")
+            return
+        if not entries:
+            await m.reply_text("Google Drive ফোল্ডারে কোনো ফাইল পাওয়া যায়নি (ফোল্ডারটি পাবলিক কিনা দেখুন)।")
+            return
+
+        async def fetch(entry, cancel_event):
+            await download_drive_folder_entry(sess, entry, uid, cancel_event)
+        await run_ingest_pipeline(c, m, entries[:BULK_URL_MAX], fetch, DRIVE_FOLDER_CONCURRENCY, "Drive Folder")
+
+# --- BATCH CAPTION ENGINE ---
+# Captions for the whole batch are rendered up front, then items go out as ordered
+# media-group albums (up to 10 per call) under a shared rate limiter. Albums are
+# sent one after another because concurrent sends could land out of episode order.
+# An album Telegram rejects is re-sent item by item, so only the items that really
+# fail are missing; they are listed in the summary, and trailing failures hand
+# their caption numbers back.
+BATCH_ALBUM_SIZE = 10
+BATCH_SEND_LIMITER = RateLimiter(rate=float(os.getenv("BATCH_SEND_RATE", "1")), burst=3)
+
+def build_batch_input_media(item: BatchItem, caption: str):
+    if item.kind == "video":
+        return InputMediaVideo(
+            item.file_id,
+            caption=caption,
+            parse_mode=ParseMode.MARKDOWN,
+            duration=item.duration,
+            width=item.width,
+            height=item.height,
+            thumb=item.thumb_file_id,
+            supports_streaming=True
+        )
+    return InputMediaDocument(item.file_id, thumb=item.thumb_file_id, caption=caption, parse_mode=ParseMode.MARKDOWN)
+
+def group_batch_albums(entries: list) -> list:
+    albums = []
+    for entry in entries:
+        if albums and albums[-1][0]['kind'] == entry['kind'] and len(albums[-1]) < BATCH_ALBUM_SIZE:
+            albums[-1].append(entry)
+        else:
+            albums.append([entry])
+    return albums
+
+async def send_batch_single(c: Client, chat_id: int, entry: dict):
+    item = entry['item']
+    if entry['kind'] == "video":
+        return await call_with_flood_wait(
+            BATCH_SEND_LIMITER, c.send_video, chat_id=chat_id, video=item.file_id,
+            caption=entry['caption'], thumb=item.thumb_file_id, duration=item.duration,
+            width=item.width, height=item.height, supports_streaming=True,
+            parse_mode=ParseMode.MARKDOWN
+        )
+    return await call_with_flood_wait(
+        BATCH_SEND_LIMITER, c.send_document, chat_id=chat_id, document=item.file_id,
+        file_name=item.file_name, caption=entry['caption'], thumb=item.thumb_file_id,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def run_caption_batch(c: Client, m: Message, items: list):
+    uid = m.from_user.id
+    caption_template = USER_CAPTIONS.get(uid)
+    if not caption_template:
+        await m.reply_text("ক্যাপশন এডিট মোড চালু আছে কিন্তু কোনো সেভ করা ক্যাপশন নেই। /set_caption দিয়ে ক্যাপশন সেট করুন।")
+        return
+
+    # Indices are the item's 1-based position in the batch, as reported back to the user.
+    valid_items = [(index, item) for index, item in enumerate(items, 1) if item.file_id]
+    failed = [index for index, item in enumerate(items, 1) if not item.file_id]
+    slots = reserve_caption_slots(uid, len(valid_items))
+    captions = render_caption_range(caption_template, slots[0]['number'], slots[-1]['number']) if slots else []
+    entries = [
+        {'index': index, 'item': item, 'kind': item.kind, 'caption': caption, 'slot': slot}
+        for (index, item), caption, slot in zip(valid_items, captions, slots)
+    ]
+
+    albums = group_batch_albums(entries)
+    summary = await m.reply_text(f"Processing started for {len(entries)} items ({len(albums)} albums)...")
+    sent = 0
+    for album in albums:
+        if len(album) > 1:
+            try:
+                media = [build_batch_input_media(e['item'], e['caption']) for e in album]
+                await call_with_flood_wait(BATCH_SEND_LIMITER, c.send_media_group, m.chat.id, media)
+                sent += len(album)
+                continue
+            except Exception as e:
+                logger.warning(f"Batch album send failed, sending its items one by one: {e}")
+        for entry in album:
+            try:
+                await send_batch_single(c, m.chat.id, entry)
+                sent += 1
+            except Exception as e:
+                failed.append(entry['index'])
+                logger.error(f"Batch item {entry['index']} send failed: {e}")
+
+    failed_entries = [e for e in entries if e['index'] in failed]
+    trailing = len(entries)
+    while trailing and entries[trailing - 1] in failed_entries:
+        trailing -= 1
+    release_caption_slots(uid, [e['slot'] for e in entries[trailing:]])
+
+    text = f"Batch processing complete. পাঠানো: {sent}, ব্যর্থ: {len(failed)}"
+    if failed:
+        text += f"\nব্যর্থ আইটেম: {', '.join(str(i) for i in sorted(failed))}"
+    try:
+        await summary.edit(text)
+    except Exception:
+        pass
+
 async def handle_caption_only_upload(c: Client, m: Message):
     file_info = m.video or m.document
     await handle_caption_only_upload_with_file(c, m, file_info)
@@ -1553,94 +3652,360 @@ async def handle_caption_only_upload_with_file(c: Client, m: Message, file_info)
         except Exception:
             pass
 
-@app.on_message(filters.private & (filters.video | filters.document))
-async def forwarded_file_or_direct_file(c: Client, m: Message):
+async def expire_batch_status(msg: Message, uid: int, delay: float = 15):
+    await asyncio.sleep(delay)
+    try:
+        await msg.delete()
+    except Exception:
+        pass
+    if BATCH_STATUS_MSG.get(uid) == msg.id:
+        BATCH_STATUS_MSG.pop(uid, None)
+
+async def route_audio_change_file(c: Client, m: Message, uid: int) -> bool:
+    await handle_audio_change_file(c, m)
+    return True
+
+async def route_edit_caption_file(c: Client, m: Message, uid: int) -> bool:
+    if not m.forward_date:
+        return False
+
+    if uid in BATCH_CAPTION_MODE:
+        file_info = m.video or m.document
+        if not file_info: 
+            return True
+        
+        if uid not in BATCH_DATA: 
+            BATCH_DATA[uid] = []
+        
+        BATCH_DATA[uid].append(BatchItem(m, file_info))
+        
+        count = len(BATCH_DATA[uid])
+        status_text = f"{count} টি ভিডিও এর file id save করা হয়েছে।"
+        
+        if uid in BATCH_STATUS_MSG:
+            try:
+                await c.edit_message_text(m.chat.id, BATCH_STATUS_MSG[uid], status_text)
+                return True
+            except Exception:
+                pass
+        # The status message is removed in the background so the next forward is not held up.
+        msg = await m.reply_text(status_text)
+        BATCH_STATUS_MSG[uid] = msg.id
+        asyncio.create_task(expire_batch_status(msg, uid))
+        return True
+
+    await handle_caption_only_upload(c, m)
+    return True
+
+async def route_enqueue_file(c: Client, m: Message, uid: int) -> bool:
+    if not m.forward_date:
+        return False
+
+    file_info = m.video or m.document
+    
+    if file_info and file_info.file_name:
+        original_name = file_info.file_name
+    elif m.video:
+        original_name = f"video_{file_info.file_unique_id}.mp4"
+    else:
+        original_name = f"file_{file_info.file_unique_id}"
+
+    if uid not in USER_QUEUES:
+        USER_QUEUES[uid] = asyncio.Queue()
+    
+    try:
+        status_msg = await m.reply_text(f"Queue: Processing started for `{original_name}`...", reply_markup=progress_keyboard())
+    except:
+        status_msg = None
+
+    enqueued_at = time.time()
+    QUEUED_JOBS.setdefault(uid, deque()).append({'name': original_name, 'enqueued_at': enqueued_at})
+    await USER_QUEUES[uid].put({
+        'message': m,
+        'original_name': original_name,
+        'status_msg': status_msg,
+        'enqueued_at': enqueued_at,
+        'caption_slots': reserve_caption_slots(uid, len(get_transcode_renditions(uid)) if uid in TRANSCODE_MODE else 1)
+    })
+    
+    if uid not in USER_WORKERS or USER_WORKERS[uid].done():
+         USER_WORKERS[uid] = asyncio.create_task(process_queue_handler(uid, c))
+    return True
+
+# --- USER STATE ROUTER ---
+# Every non-command admin message goes into the sender's mailbox. One drain task
+# per user handles them in arrival order; ROUTER_SLOTS bounds how many users are
+# being handled at once. Handlers are picked from USER_ROUTES, a per-user table
+# rebuilt only when one of the ModeFlag sets changes.
+ROUTER_CONCURRENCY = int(os.getenv("ROUTER_CONCURRENCY", "8"))
+ROUTER_SLOTS = asyncio.Semaphore(ROUTER_CONCURRENCY)
+USER_MAILBOXES = {}
+USER_MAILBOX_TASKS = {}
+
+# Per message kind, (flag, handler) in priority order. A handler returns True when
+# it consumed the message; None means the handler applies in every mode.
+ROUTE_TABLE = {
+    'text': (
+        (EDIT_CAPTION_MODE, route_batch_keywords),
+        (SET_CAPTION_REQUEST, route_caption_text),
+        (None, route_audio_order_reply),
+        (CREATE_POST_MODE, route_post_creation_text),
+        (None, route_url_text),
+    ),
+    'photo': (
+        (CREATE_POST_MODE, route_post_image),
+        (SET_THUMB_REQUEST, route_thumb_photo),
+    ),
+    'file': (
+        (MKV_AUDIO_CHANGE_MODE, route_audio_change_file),
+        (EDIT_CAPTION_MODE, route_edit_caption_file),
+        (None, route_enqueue_file),
+    ),
+}
+
+def build_user_routes(uid: int) -> dict:
+    return {
+        kind: tuple(handler for flag, handler in table if flag is None or uid in flag)
+        for kind, table in ROUTE_TABLE.items()
+    }
+
+def message_kind(m: Message):
+    if m.text:
+        return 'text'
+    if m.photo:
+        return 'photo'
+    if m.video or m.document:
+        return 'file'
+    return None
+
+async def dispatch_user_message(c: Client, m: Message):
     uid = m.from_user.id
-    if not is_admin(uid):
-        return
+    session = user_data.get(uid)
+    if session and session.get("state", STATE_IDLE) != STATE_IDLE:
+        try:
+            await post_state_handler(c, m)
+        except StopPropagation:
+            return
 
-    if uid in MKV_AUDIO_CHANGE_MODE:
-        await handle_audio_change_file(c, m)
+    kind = message_kind(m)
+    if kind is None:
         return
+    routes = USER_ROUTES.get(uid)
+    if routes is None:
+        routes = USER_ROUTES[uid] = build_user_routes(uid)
+    for handler in routes[kind]:
+        if await handler(c, m, uid):
+            return
 
-    if uid in EDIT_CAPTION_MODE and m.forward_date: 
-        
-        if uid in BATCH_CAPTION_MODE:
-            file_info = m.video or m.document
-            if not file_info: 
-                return
-            
-            if uid not in BATCH_DATA: 
-                BATCH_DATA[uid] = []
-            
-            BATCH_DATA[uid].append({
-                'message': m,
-                'file_info': file_info
-            })
-            
-            count = len(BATCH_DATA[uid])
-            status_text = f"{count} টি ভিডিও এর file id save করা হয়েছে।"
-            
-            if uid in BATCH_STATUS_MSG:
+async def drain_user_mailbox(c: Client, uid: int):
+    mailbox = USER_MAILBOXES[uid]
+    try:
+        while mailbox:
+            m = mailbox.popleft()
+            async with ROUTER_SLOTS:
                 try:
-                    await c.edit_message_text(m.chat.id, BATCH_STATUS_MSG[uid], status_text)
-                except Exception:
-                    msg = await m.reply_text(status_text)
-                    BATCH_STATUS_MSG[uid] = msg.id
-                    
-                    await asyncio.sleep(15)
-                    try:
-                        await msg.delete()
-                    except:
-                        pass
+                    await dispatch_user_message(c, m)
+                except Exception as e:
+                    logger.error(f"Routing message {m.id} for {uid} failed: {e}")
+    finally:
+        USER_MAILBOX_TASKS.pop(uid, None)
+        if not mailbox:
+            USER_MAILBOXES.pop(uid, None)
+
+@app.on_message(filters.private & admin_filter & ~command_text_filter, group=-1)
+async def route_user_message(c: Client, m: Message):
+    uid = m.from_user.id
+    USER_MAILBOXES.setdefault(uid, deque()).append(m)
+    if uid not in USER_MAILBOX_TASKS:
+        USER_MAILBOX_TASKS[uid] = asyncio.create_task(drain_user_mailbox(c, uid))
+    m.stop_propagation()
+
+# --- PARALLEL CHUNKED DOWNLOAD ---
+# Concurrent offset-based upload.getFile requests over a per-DC pool of media
+# sessions, written in place into a preallocated file.
+PARALLEL_DOWNLOAD_ENABLED = os.getenv("PARALLEL_DOWNLOAD", "1") == "1"
+PARALLEL_DOWNLOAD_SESSIONS = max(1, int(os.getenv("PARALLEL_DOWNLOAD_SESSIONS", "4")))
+PARALLEL_DOWNLOAD_INFLIGHT = max(1, int(os.getenv("PARALLEL_DOWNLOAD_INFLIGHT", "2")))
+PARALLEL_DOWNLOAD_MIN_SIZE = 20 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SESSION_POOLS = {}
+DOWNLOAD_SESSION_POOL_LOCK = asyncio.Lock()
+
+async def get_download_sessions(c: Client, dc_id: int) -> list:
+    async with DOWNLOAD_SESSION_POOL_LOCK:
+        pool = DOWNLOAD_SESSION_POOLS.setdefault(dc_id, [])
+        test_mode = await c.storage.test_mode()
+        while len(pool) < PARALLEL_DOWNLOAD_SESSIONS:
+            if dc_id == await c.storage.dc_id():
+                session = Session(c, dc_id, await c.storage.auth_key(), test_mode, is_media=True)
+                await session.start()
             else:
-                msg = await m.reply_text(status_text)
-                BATCH_STATUS_MSG[uid] = msg.id
-                
-                await asyncio.sleep(15)
+                session = Session(c, dc_id, await Auth(c, dc_id, test_mode).create(), test_mode, is_media=True)
+                await session.start()
+                exported = await c.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+            pool.append(session)
+        return list(pool)
+
+def media_file_location(file_info):
+    file_id = FileId.decode(file_info.file_id)
+    location = raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=""
+    )
+    return file_id.dc_id, location
+
+async def parallel_download_media(c: Client, m: Message, out_path: Path, progress=None, cancel_event: asyncio.Event = None):
+    file_info = m.video or m.document or m.audio
+    file_size = file_info.file_size
+    dc_id, location = media_file_location(file_info)
+    sessions = await get_download_sessions(c, dc_id)
+
+    pending = asyncio.Queue()
+    for offset in range(0, file_size, DOWNLOAD_CHUNK_SIZE):
+        pending.put_nowait(offset)
+    downloaded = 0
+
+    with out_path.open("wb") as f:
+        f.truncate(file_size)
+        fd = f.fileno()
+
+        async def worker(session):
+            nonlocal downloaded
+            while True:
                 try:
-                    await msg.delete()
-                    if uid in BATCH_STATUS_MSG:
-                        del BATCH_STATUS_MSG[uid]
-                except:
-                    pass
-            return
+                    offset = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if cancel_event and cancel_event.is_set():
+                    raise Exception("Cancelled")
+                result = await invoke_with_retry(session, raw.functions.upload.GetFile(
+                    location=location, offset=offset, limit=DOWNLOAD_CHUNK_SIZE, precise=False
+                ))
+                if not isinstance(result, raw.types.upload.File):
+                    raise Exception(f"Unsupported getFile response: {type(result).__name__}")
+                os.pwrite(fd, result.bytes, offset)
+                downloaded += len(result.bytes)
+                if progress:
+                    await progress(downloaded, file_size)
+
+        workers = [asyncio.create_task(worker(s)) for s in sessions for _ in range(PARALLEL_DOWNLOAD_INFLIGHT)]
+        try:
+            await asyncio.gather(*workers)
+        except Exception:
+            for w in workers:
+                w.cancel()
+            raise
+    return out_path
+
+async def download_telegram_file(c: Client, m: Message, out_path: Path, cancel_event: asyncio.Event = None, progress=None):
+    file_info = m.video or m.document or m.audio
+    if PARALLEL_DOWNLOAD_ENABLED and file_info and (file_info.file_size or 0) > PARALLEL_DOWNLOAD_MIN_SIZE:
+        try:
+            return await parallel_download_media(c, m, out_path, progress=progress, cancel_event=cancel_event)
+        except Exception as e:
+            out_path.unlink(missing_ok=True)
+            if "Cancelled" in str(e):
+                raise
+            logger.warning(f"Parallel download failed, falling back to m.download: {e}")
+
+    async def check_cancel(current, total):
+        if cancel_event and cancel_event.is_set():
+            c.stop_transmission()
+        if progress:
+            await progress(current, total)
+
+    await m.download(file_name=str(out_path), progress=check_cancel)
+    return out_path
+
+# --- TELEGRAM HEADER PROBE ---
+# Streams only the first/last few chunks of a Telegram file through stream_media and
+# parses the track table from them, so the full download can wait for the admin.
+TG_STREAM_CHUNK = 1024 * 1024
+TG_PROBE_HEAD_CHUNKS = int(os.getenv("TG_PROBE_HEAD_CHUNKS", "4"))
+TG_PROBE_TAIL_CHUNKS = int(os.getenv("TG_PROBE_TAIL_CHUNKS", "4"))
+AUDIO_PREFETCH_DOWNLOAD = os.getenv("AUDIO_PREFETCH_DOWNLOAD", "1") == "1"
+
+# Reads are clamped to the file size like the on-disk reader. A read that runs past
+# the fetched bytes raises instead of returning short data the parser would trust.
+def sparse_reader(segments: list, total_size: int = None):
+    def read_at(offset, size):
+        if total_size is not None:
+            size = max(0, min(size, total_size - offset))
+        buf = bytearray()
+        pos = offset
+        while len(buf) < size:
+            for start, data in segments:
+                if start <= pos < start + len(data):
+                    piece = data[pos - start:pos - start + size - len(buf)]
+                    break
+            else:
+                raise ValueError(f"Only {len(buf)} of {size} bytes at offset {offset} were fetched")
+            buf += piece
+            pos += len(piece)
+        return bytes(buf)
+    return read_at
 
-        await handle_caption_only_upload(c, m)
-        return
+def parse_sparse_header(segments: list, total_size: int) -> dict:
+    try:
+        return parse_container_header(sparse_reader(segments, total_size), total_size)
+    except ValueError:
+        return None
 
-    if m.forward_date:
-        
-        file_info = m.video or m.document
-        
-        if file_info and file_info.file_name:
-            original_name = file_info.file_name
-        elif m.video:
-            original_name = f"video_{file_info.file_unique_id}.mp4"
-        else:
-            original_name = f"file_{file_info.file_unique_id}"
+async def stream_telegram_chunks(c: Client, m: Message, offset: int, limit: int) -> bytes:
+    buf = bytearray()
+    async for chunk in c.stream_media(m, offset=offset, limit=limit):
+        buf.extend(chunk)
+    return bytes(buf)
 
-        if uid not in USER_QUEUES:
-            USER_QUEUES[uid] = asyncio.Queue()
-        
+async def probe_telegram_media_header(c: Client, m: Message) -> dict:
+    file_info = m.video or m.document
+    total_size = getattr(file_info, 'file_size', 0) or 0
+    if not total_size:
+        return None
+    try:
+        head = await stream_telegram_chunks(c, m, 0, TG_PROBE_HEAD_CHUNKS)
+        segments = [(0, head)]
+        info = parse_sparse_header(segments, total_size)
+        if info and info['audio_tracks']:
+            return info
+
+        total_chunks = math.ceil(total_size / TG_STREAM_CHUNK)
+        tail_start = max(TG_PROBE_HEAD_CHUNKS, total_chunks - TG_PROBE_TAIL_CHUNKS)
+        if tail_start >= total_chunks:
+            return info
+        # moov-at-end MP4s keep the track table in the last chunks of the file.
+        tail = await stream_telegram_chunks(c, m, tail_start, total_chunks - tail_start)
+        segments.append((tail_start * TG_STREAM_CHUNK, tail))
+        return parse_sparse_header(segments, total_size)
+    except Exception as e:
+        logger.warning(f"Telegram header probe failed: {e}")
+        return None
+
+def start_background_download(c: Client, m: Message, tmp_path: Path) -> asyncio.Task:
+    return asyncio.create_task(download_telegram_file(c, m, tmp_path))
+
+async def wait_background_download(download_task: asyncio.Task, tmp_path: Path, cancel_event: asyncio.Event = None):
+    if download_task and cancel_event:
+        cancel_wait = asyncio.create_task(cancel_event.wait())
         try:
-            status_msg = await m.reply_text(f"Queue: Processing started for `{original_name}`...", reply_markup=progress_keyboard())
-        except:
-            status_msg = None
+            await asyncio.wait({download_task, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancel_wait.cancel()
+        if cancel_event.is_set():
+            download_task.cancel()
+            raise Exception("Cancelled")
+    if download_task:
+        await download_task
+    if not tmp_path.exists() or tmp_path.stat().st_size == 0:
+        raise Exception("ফাইল ডাউনলোড সম্পন্ন হয়নি।")
 
-        await USER_QUEUES[uid].put({
-            'message': m,
-            'original_name': original_name,
-            'status_msg': status_msg 
-        })
-        
-        if uid not in USER_WORKERS or USER_WORKERS[uid].done():
-             USER_WORKERS[uid] = asyncio.create_task(process_queue_handler(uid, c))
-        else:
-             pass
-        
-    else:
-        pass
+def cancel_background_download(order: PendingAudioOrder):
+    task = order.download_task
+    if task and not task.done():
+        task.cancel()
 
 async def handle_audio_change_file(c: Client, m: Message):
     uid = m.from_user.id
@@ -1655,6 +4020,7 @@ async def handle_audio_change_file(c: Client, m: Message):
     
     tmp_path = None
     status_msg = None
+    download_task = None
     try:
         original_name = file_info.file_name or f"video_{file_info.file_unique_id}.mkv"
         if not '.' in original_name:
@@ -1662,16 +4028,25 @@ async def handle_audio_change_file(c: Client, m: Message):
             
         tmp_path = TMP / f"audio_change_{uid}_{int(datetime.now().timestamp())}_{original_name}"
         
-        status_msg = await m.reply_text("অডিও ট্র্যাক বিশ্লেষণের জন্য ফাইল ডাউনলোড করা হচ্ছে...", reply_markup=progress_keyboard())
-        await m.download(file_name=str(tmp_path))
-        
-        audio_tracks = await asyncio.to_thread(get_audio_tracks_ffprobe, tmp_path)
+        download_task = None
+        status_msg = await m.reply_text("অডিও ট্র্যাক বিশ্লেষণ করা হচ্ছে (শুধু হেডার)...", reply_markup=progress_keyboard())
+        header = await probe_telegram_media_header(c, m)
+        if header and header['audio_tracks']:
+            audio_tracks = header['audio_tracks']
+            if AUDIO_PREFETCH_DOWNLOAD or len(audio_tracks) == 1:
+                download_task = start_background_download(c, m, tmp_path)
+        else:
+            await status_msg.edit("অডিও ট্র্যাক বিশ্লেষণের জন্য ফাইল ডাউনলোড করা হচ্ছে...", reply_markup=progress_keyboard())
+            await download_telegram_file(c, m, tmp_path, cancel_event)
+            audio_tracks = await asyncio.to_thread(get_audio_tracks_ffprobe, tmp_path)
         
         if not audio_tracks:
             await status_msg.edit("এই ভিডিওতে কোনো অডিও ট্র্যাক পাওয়া যায়নি বা FFprobe চলতে পারেনি।")
             tmp_path.unlink(missing_ok=True)
             return
 
+        caption_slot = reserve_caption_slot(uid)
+
         if len(audio_tracks) == 1:
             await status_msg.edit("ফাইলটিতে ১টি অডিও ট্র্যাক রয়েছে। স্বয়ংক্রিয়ভাবে রিমাক্স করা হচ্ছে...", reply_markup=progress_keyboard())
             
@@ -1683,7 +4058,9 @@ async def handle_audio_change_file(c: Client, m: Message):
                     c, m, tmp_path, 
                     original_name, 
                     new_stream_map, 
-                    messages_to_delete=[status_msg.id]
+                    messages_to_delete=[status_msg.id],
+                    download_task=download_task,
+                    caption_slot=caption_slot
                 )
             )
             
@@ -1704,12 +4081,10 @@ async def handle_audio_change_file(c: Client, m: Message):
         
         await status_msg.edit(track_list_text, reply_markup=progress_keyboard()) 
         
-        PENDING_AUDIO_ORDERS[status_msg.id] = {
-            'uid': uid,
-            'path': tmp_path, 
-            'original_name': original_name,
-            'tracks': audio_tracks
-        }
+        PENDING_AUDIO_ORDERS[status_msg.id] = PendingAudioOrder(
+            uid, tmp_path, original_name, audio_tracks, m.chat.id, m.id,
+            download_task=download_task, caption_slot=caption_slot
+        )
         
     except Exception as e:
         logger.error(f"Audio track analysis error: {e}")
@@ -1717,6 +4092,8 @@ async def handle_audio_change_file(c: Client, m: Message):
             await status_msg.edit(f"অডিও ট্র্যাক বিশ্লেষণে সমস্যা: {e}")
         else:
             await m.reply_text(f"অডিও ট্র্যাক বিশ্লেষণে সমস্যা: {e}")
+        if download_task and not download_task.done():
+            download_task.cancel()
         if tmp_path and tmp_path.exists():
             tmp_path.unlink(missing_ok=True)
     finally:
@@ -1725,7 +4102,7 @@ async def handle_audio_change_file(c: Client, m: Message):
         except Exception:
             pass
 
-async def handle_audio_remux(c: Client, m: Message, in_path: Path, original_name: str, new_stream_map: list, messages_to_delete: list = None):
+async def handle_audio_remux(c: Client, m: Message, in_path: Path, original_name: str, new_stream_map: list, messages_to_delete: list = None, download_task: asyncio.Task = None, source_message: Message = None, caption_slot: dict = None):
     uid = m.from_user.id
     cancel_event = asyncio.Event()
     TASKS.setdefault(uid, []).append(cancel_event)
@@ -1735,16 +4112,48 @@ async def handle_audio_remux(c: Client, m: Message, in_path: Path, original_name
         out_name = Path(out_name).stem + ".mkv"
     
     asyncio.create_task(
-        sequential_remux_upload_task(uid, c, m, in_path, out_name, new_stream_map, messages_to_delete, cancel_event)
+        sequential_remux_upload_task(uid, c, m, in_path, out_name, new_stream_map, messages_to_delete, cancel_event, download_task, source_message, caption_slot)
     )
 
-async def sequential_remux_upload_task(uid, c, m, in_path, out_name, new_stream_map, messages_to_delete, cancel_event):
+async def sequential_remux_upload_task(uid, c, m, in_path, out_name, new_stream_map, messages_to_delete, cancel_event, download_task=None, source_message=None, caption_slot=None):
+    if not in_path.exists() or download_task:
+        wait_msg = None
+        try:
+            if download_task is None and source_message is not None:
+                download_task = start_background_download(c, source_message, in_path)
+            if download_task and not download_task.done():
+                wait_msg = await m.reply_text("ফাইল ডাউনলোড শেষ হওয়ার অপেক্ষা করা হচ্ছে...", reply_markup=progress_keyboard())
+            await wait_background_download(download_task, in_path, cancel_event)
+        except Exception as e:
+            if not cancel_event.is_set():
+                logger.error(f"Audio change download error: {e}")
+            if download_task and not download_task.done():
+                download_task.cancel()
+            in_path.unlink(missing_ok=True)
+            release_caption_slots(uid, [caption_slot])
+            try:
+                TASKS[uid].remove(cancel_event)
+            except Exception:
+                pass
+            try:
+                await m.reply_text("অপারেশন বাতিল করা হয়েছে।" if cancel_event.is_set() else f"ফাইল ডাউনলোডে সমস্যা: {e}")
+            except Exception:
+                pass
+            return
+        finally:
+            if wait_msg:
+                try:
+                    await wait_msg.delete()
+                except Exception:
+                    pass
+
     if uid not in USER_UPLOAD_LOCKS:
         USER_UPLOAD_LOCKS[uid] = asyncio.Lock()
     
     async with USER_UPLOAD_LOCKS[uid]:
         if cancel_event.is_set():
              if in_path.exists(): in_path.unlink()
+             release_caption_slots(uid, [caption_slot])
              return
 
         out_path = TMP / f"remux_{uid}_{int(datetime.now().timestamp())}_{out_name}"
@@ -1794,10 +4203,11 @@ async def sequential_remux_upload_task(uid, c, m, in_path, out_name, new_stream_
             all_messages_to_delete = messages_to_delete if messages_to_delete else []
             all_messages_to_delete.append(status_msg.id)
 
-            await process_file_and_upload(c, m, out_path, original_name=out_name, messages_to_delete=all_messages_to_delete, cancel_event_passed=cancel_event) 
+            await process_file_and_upload(c, m, out_path, original_name=out_name, messages_to_delete=all_messages_to_delete, cancel_event_passed=cancel_event, caption_slot=caption_slot) 
 
         except Exception as e:
             logger.error(f"Audio remux process error: {e}")
+            release_caption_slots(uid, [caption_slot])
             try:
                 if status_msg:
                     await status_msg.edit(f"অডিও পরিবর্তন প্রক্রিয়া ব্যর্থ: {e}")
@@ -1838,17 +4248,28 @@ async def rename_cmd(c, m: Message):
     except Exception:
         status_msg = await m.reply_text("রিনেমের জন্য ফাইল ডাউনলোড করা হচ্ছে...", reply_markup=progress_keyboard())
     tmp_out = TMP / f"rename_{uid}_{int(datetime.now().timestamp())}_{new_name}"
+    caption_slot = reserve_caption_slot(uid)
+    source_key = telegram_source_key(m.reply_to_message)
+    source_key = f"{source_key}|rename:{new_name}" if source_key else None
     try:
-        await m.reply_to_message.download(file_name=str(tmp_out))
+        if await reuse_cached_upload(c, m, uid, source_key, caption_slot):
+            TASKS[uid].remove(cancel_event)
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+            return
+        await download_telegram_file(c, m.reply_to_message, tmp_out, cancel_event)
         try:
             await status_msg.edit("ডাউনলোড সম্পন্ন, এখন নতুন নাম দিয়ে আপলোড হচ্ছে...", reply_markup=None)
         except Exception:
             await m.reply_text("ডাউনলোড সম্পন্ন, এখন নতুন নাম দিয়ে আপলোড হচ্ছে...", reply_markup=None)
         
         asyncio.create_task(
-            sequential_upload_task(uid, c, m, tmp_out, new_name, status_msg.id, cancel_event)
+            sequential_upload_task(uid, c, m, tmp_out, new_name, status_msg.id, cancel_event, caption_slot=caption_slot, source_key=source_key, disk_mode="file")
         )
     except Exception as e:
+        release_caption_slots(uid, [caption_slot])
         await m.reply_text(f"রিনেম ত্রুটি: {e}")
     finally:
         pass
@@ -1859,10 +4280,12 @@ async def cancel_task_cb(c, cb):
     prompt_message_id = cb.message.id
 
     if prompt_message_id in PENDING_AUDIO_ORDERS:
-        file_data = PENDING_AUDIO_ORDERS.pop(prompt_message_id)
-        if file_data['uid'] == uid:
+        order = PENDING_AUDIO_ORDERS.pop(prompt_message_id)
+        if order.uid == uid:
+            cancel_background_download(order)
+            release_caption_slots(uid, [order.caption_slot])
             try:
-                Path(file_data['path']).unlink(missing_ok=True)
+                Path(order.path).unlink(missing_ok=True)
             except Exception:
                 pass
             
@@ -1912,42 +4335,39 @@ async def generate_video_thumbnail(video_path: Path, thumb_path: Path, timestamp
         return False
 
 
-def process_dynamic_caption(uid, caption_template):
-    if uid not in USER_COUNTERS:
-        USER_COUNTERS[uid] = {'uploads': 0, 'episode_numbers': {}, 'dynamic_counters': {}, 're_options_count': 0}
-
-    USER_COUNTERS[uid]['uploads'] += 1
+def legacy_render_caption(state, caption_template, quality=None):
+    state['uploads'] += 1
 
     quality_match = re.search(r"\[re\s*\((.*?)\)\]", caption_template)
     if quality_match:
         options_str = quality_match.group(1)
         options = [opt.strip() for opt in options_str.split(',')]
         
-        if not USER_COUNTERS[uid]['re_options_count']:
-            USER_COUNTERS[uid]['re_options_count'] = len(options)
+        if not state['re_options_count']:
+            state['re_options_count'] = len(options)
         
-        current_index = (USER_COUNTERS[uid]['uploads'] - 1) % len(options)
-        current_quality = options[current_index]
+        current_index = (state['uploads'] - 1) % len(options)
+        current_quality = options[current_index] if quality is None else quality
         
         caption_template = caption_template.replace(quality_match.group(0), current_quality)
 
-        if (USER_COUNTERS[uid]['uploads'] - 1) % USER_COUNTERS[uid]['re_options_count'] == 0 and USER_COUNTERS[uid]['uploads'] > 1:
-            for key in USER_COUNTERS[uid]['dynamic_counters']:
-                USER_COUNTERS[uid]['dynamic_counters'][key]['value'] += 1
-    elif USER_COUNTERS[uid]['uploads'] > 1: 
-        for key in USER_COUNTERS[uid].get('dynamic_counters', {}):
-             USER_COUNTERS[uid]['dynamic_counters'][key]['value'] += 1
+        if (state['uploads'] - 1) % state['re_options_count'] == 0 and state['uploads'] > 1:
+            for key in state['dynamic_counters']:
+                state['dynamic_counters'][key]['value'] += 1
+    elif state['uploads'] > 1: 
+        for key in state.get('dynamic_counters', {}):
+             state['dynamic_counters'][key]['value'] += 1
 
 
     counter_matches = re.findall(r"\[\s*(\(?\d+\)?)\s*\]", caption_template)
     
-    if USER_COUNTERS[uid]['uploads'] == 1:
+    if state['uploads'] == 1:
         for match in counter_matches:
             has_paren = match.startswith('(') and match.endswith(')')
             clean_match = re.sub(r'[()]', '', match)
-            USER_COUNTERS[uid]['dynamic_counters'][match] = {'value': int(clean_match), 'has_paren': has_paren}
+            state['dynamic_counters'][match] = {'value': int(clean_match), 'has_paren': has_paren}
     
-    for match, data in USER_COUNTERS[uid]['dynamic_counters'].items():
+    for match, data in state['dynamic_counters'].items():
         value = data['value']
         has_paren = data['has_paren']
         
@@ -1960,8 +4380,8 @@ def process_dynamic_caption(uid, caption_template):
 
 
     current_episode_num = 0
-    if USER_COUNTERS[uid].get('dynamic_counters'):
-        current_episode_num = min(data['value'] for data in USER_COUNTERS[uid]['dynamic_counters'].values())
+    if state.get('dynamic_counters'):
+        current_episode_num = min(data['value'] for data in state['dynamic_counters'].values())
 
     conditional_matches = re.findall(r"\[([a-zA-Z0-9\s]+)\s*\((.*?)\)\]", caption_template)
 
@@ -1984,8 +4404,529 @@ def process_dynamic_caption(uid, caption_template):
 
     return "**" + "\n".join(caption_template.splitlines()) + "**"
 
+# --- COMPILED CAPTION TEMPLATES ---
+# A caption template is tokenized once into literals, the [re (...)] quality slot,
+# [(01)] counters and [text (N)] conditionals. Rendering upload number n is a pure
+# function of n, so ranges of captions can be rendered in one call.
+CAPTION_QUALITY_RE = re.compile(r"\[re\s*\((.*?)\)\]")
+CAPTION_COUNTER_SCAN_RE = re.compile(r"\[\s*(\(?\d+\)?)\s*\]")
+CAPTION_COUNTER_RE = r"\[(\(?\d+\)?)\]"
+CAPTION_CONDITIONAL_RE = r"\[([a-zA-Z0-9](?:[a-zA-Z0-9\s]*[a-zA-Z0-9])?) \(((?:\S(?:.*?\S)?)?)\)\]"
+CAPTION_SELF_CHECK_CYCLES = 3
+
+class CompiledCaption:
+    __slots__ = ('template', 'tokens', 'options', 'counter_base', 'has_counters', 'legacy_only', 'legacy_state')
+
+    def __init__(self, template: str):
+        self.template = template
+        self.tokens = []
+        self.options = None
+        self.counter_base = 0
+        self.has_counters = False
+        self.legacy_only = False
+        self.legacy_state = None
+        self._tokenize()
+        if not self.legacy_only and not self._matches_legacy():
+            self.legacy_only = True
+
+    def _tokenize(self):
+        template = self.template
+        patterns = []
+        quality_match = CAPTION_QUALITY_RE.search(template)
+        if quality_match:
+            self.options = [opt.strip() for opt in quality_match.group(1).split(',')]
+            patterns.append(f"(?P<quality>{re.escape(quality_match.group(0))})")
+        patterns.append(f"(?P<counter>{CAPTION_COUNTER_RE})")
+        patterns.append(f"(?P<cond>{CAPTION_CONDITIONAL_RE})")
+
+        scan_text = template.replace(quality_match.group(0), "") if quality_match else template
+        counter_values = [int(re.sub(r'[()]', '', c)) for c in CAPTION_COUNTER_SCAN_RE.findall(scan_text)]
+        self.has_counters = bool(counter_values)
+        self.counter_base = min(counter_values) if counter_values else 0
+        if self.options and any('[' in opt for opt in self.options):
+            self.legacy_only = True
+            return
+
+        pos = 0
+        for m in re.finditer("|".join(patterns), template):
+            if m.start() > pos:
+                self.tokens.append(('text', template[pos:m.start()]))
+            if m.lastgroup == 'quality':
+                self.tokens.append(('quality', None))
+            elif m.lastgroup == 'counter':
+                key = m.group('counter')[1:-1]
+                digits = re.sub(r'[()]', '', key)
+                has_paren = key.startswith('(') and key.endswith(')')
+                self.tokens.append(('counter', (int(digits), len(digits), has_paren)))
+            else:
+                text, arg = m.group('cond')[1:-1].split(" (", 1)
+                arg = arg[:-1]
+                if '[' in arg:
+                    self.legacy_only = True
+                    return
+                target = re.sub(r'[^0-9]', '', arg)
+                self.tokens.append(('cond', (text, int(target) if target else None)))
+            pos = m.end()
+        if pos < len(template):
+            self.tokens.append(('text', template[pos:]))
+
+    def _matches_legacy(self) -> bool:
+        cycle = len(self.options) if self.options else 1
+        state = {'uploads': 0, 'episode_numbers': {}, 'dynamic_counters': {}, 're_options_count': 0}
+        for n in range(1, cycle * CAPTION_SELF_CHECK_CYCLES + 2):
+            if legacy_render_caption(state, self.template) != self._render_tokens(n):
+                logger.warning("Caption template uses an ambiguous construct, using the legacy renderer.")
+                return False
+        return True
+
+    def _render_tokens(self, n: int, quality: str = None) -> str:
+        if self.options:
+            increment = (n - 1) // len(self.options)
+            quality = self.options[(n - 1) % len(self.options)] if quality is None else quality
+        else:
+            increment = n - 1
+            quality = ""
+        episode = self.counter_base + increment if self.has_counters else 0
+
+        parts = []
+        for kind, value in self.tokens:
+            if kind == 'text':
+                parts.append(value)
+            elif kind == 'quality':
+                parts.append(quality)
+            elif kind == 'counter':
+                initial, width, has_paren = value
+                formatted = f"{initial + increment:0{width}d}"
+                parts.append(f"({formatted})" if has_paren else formatted)
+            else:
+                text, target = value
+                if target is not None and target == episode:
+                    parts.append(text)
+        return "**" + "\n".join("".join(parts).splitlines()) + "**"
+
+    # quality overrides the label the [re (...)] slot would rotate to for upload n.
+    def render(self, n: int, quality: str = None) -> str:
+        if not self.legacy_only:
+            return self._render_tokens(n, quality)
+        # The legacy renderer only steps forward, so its state is kept between calls
+        # and the next number costs one step instead of n.
+        if self.legacy_state is None or self.legacy_state['uploads'] >= n:
+            self.legacy_state = {'uploads': 0, 'episode_numbers': {}, 'dynamic_counters': {}, 're_options_count': 0}
+        while self.legacy_state['uploads'] < n - 1:
+            legacy_render_caption(self.legacy_state, self.template)
+        if quality is None:
+            return legacy_render_caption(self.legacy_state, self.template)
+        # An overridden label is rendered on a copy so it cannot leak into later numbers.
+        return legacy_render_caption(copy.deepcopy(self.legacy_state), self.template, quality)
+
+    def render_range(self, start: int, end: int) -> list:
+        return [self.render(n) for n in range(start, end + 1)]
+
+@functools.lru_cache(maxsize=256)
+def compile_caption_template(caption_template: str) -> CompiledCaption:
+    return CompiledCaption(caption_template)
+
+def render_caption(caption_template: str, upload_number: int, quality: str = None) -> str:
+    return compile_caption_template(caption_template).render(upload_number, quality)
+
+def render_caption_range(caption_template: str, start: int, end: int) -> list:
+    return compile_caption_template(caption_template).render_range(start, end)
+
+def process_dynamic_caption(uid, caption_template):
+    if uid not in USER_COUNTERS:
+        USER_COUNTERS[uid] = {'uploads': 0}
+    USER_COUNTERS[uid]['uploads'] += 1
+    return render_caption(caption_template, USER_COUNTERS[uid]['uploads'])
+
+# --- CAPTION SEQUENCE RESERVATION ---
+# Upload numbers are handed out when a job is enqueued, so the episode/quality a
+# job gets no longer depends on which upload happens to finish first.
+def reserve_caption_slots(uid, count: int = 1) -> list:
+    caption_template = USER_CAPTIONS.get(uid)
+    if not caption_template or count <= 0:
+        return [None] * max(count, 0)
+    counters = USER_COUNTERS.setdefault(uid, {'uploads': 0})
+    first = counters['uploads'] + 1
+    counters['uploads'] += count
+    return [{'template': caption_template, 'number': first + i} for i in range(count)]
+
+def reserve_caption_slot(uid):
+    return reserve_caption_slots(uid, 1)[0]
+
+def release_caption_slots(uid, slots: list):
+    # Only the newest reservation can be handed back without leaving a gap.
+    slots = [s for s in (slots or []) if s]
+    if not slots:
+        return
+    counters = USER_COUNTERS.get(uid)
+    numbers = sorted(s['number'] for s in slots)
+    if (counters and USER_CAPTIONS.get(uid) == slots[0]['template']
+            and counters['uploads'] == numbers[-1]
+            and numbers == list(range(numbers[0], numbers[-1] + 1))):
+        counters['uploads'] = numbers[0] - 1
+
+def resolve_job_caption(uid, target_name: str, caption_override: str = None, caption_slot: dict = None) -> str:
+    if caption_override:
+        return caption_override
+    if caption_slot:
+        return render_caption(caption_slot['template'], caption_slot['number'], caption_slot.get('quality'))
+    caption_template = USER_CAPTIONS.get(uid)
+    if caption_template:
+        return process_dynamic_caption(uid, caption_template)
+    return f"**{target_name}**"
+
+def benchmark_caption_engine(caption_template: str, uploads: int = 1000):
+    state = {'uploads': 0, 'episode_numbers': {}, 'dynamic_counters': {}, 're_options_count': 0}
+    start = time.perf_counter()
+    legacy = [legacy_render_caption(state, caption_template) for _ in range(uploads)]
+    legacy_ms = (time.perf_counter() - start) * 1000
+
+    compile_caption_template.cache_clear()
+    start = time.perf_counter()
+    compiled = render_caption_range(caption_template, 1, uploads)
+    compiled_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{uploads} captions: legacy={legacy_ms:.2f}ms compiled={compiled_ms:.2f}ms "
+          f"(incl. compile) speedup={legacy_ms / compiled_ms if compiled_ms else 0:.1f}x "
+          f"identical={legacy == compiled}")
+
+# --- SIZE-BOUNDED SPLITTING ---
+# Videos above UPLOAD_PART_LIMIT are cut at keyframes with one `-c copy` segment pass,
+# pre-uploaded concurrently, then posted in part order with per-part metadata.
+SPLIT_SAFETY_FACTOR = 0.92
+SPLIT_UPLOAD_CONCURRENCY = max(1, int(os.getenv("SPLIT_UPLOAD_CONCURRENCY", "2")))
+
+# --- PARALLEL MULTI-SESSION UPLOAD ---
+# saveBigFilePart chunks are sent concurrently over a pool of media sessions to the
+# bot's DC; the resulting InputFileBig is handed to send_video via BotClient.preuploaded_files.
+PARALLEL_UPLOAD_ENABLED = os.getenv("PARALLEL_UPLOAD", "1") == "1"
+PARALLEL_UPLOAD_SESSIONS = max(1, int(os.getenv("PARALLEL_UPLOAD_SESSIONS", "4")))
+PARALLEL_UPLOAD_INFLIGHT = max(1, int(os.getenv("PARALLEL_UPLOAD_INFLIGHT", "2")))
+PARALLEL_UPLOAD_MIN_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 512 * 1024
+UPLOAD_PART_RETRIES = 5
+UPLOAD_SESSION_POOL = []
+UPLOAD_SESSION_POOL_LOCK = asyncio.Lock()
+# Worth another attempt with the acknowledged parts kept; anything else falls back to a plain upload.
+UPLOAD_TRANSIENT_ERRORS = (OSError, FloodWait, InternalServerError, FilePartMissing)
+
+class UploadSessionError(Exception):
+    pass
+
+def is_transient_upload_error(e: Exception) -> bool:
+    if isinstance(e, UploadSessionError):
+        return False
+    return isinstance(e, UPLOAD_TRANSIENT_ERRORS) or not isinstance(e, RPCError)
+
+async def get_upload_sessions(c: Client) -> list:
+    async with UPLOAD_SESSION_POOL_LOCK:
+        while len(UPLOAD_SESSION_POOL) < PARALLEL_UPLOAD_SESSIONS:
+            try:
+                session = Session(
+                    c, await c.storage.dc_id(), await c.storage.auth_key(),
+                    await c.storage.test_mode(), is_media=True
+                )
+                await session.start()
+            except Exception as e:
+                if UPLOAD_SESSION_POOL:
+                    break
+                raise UploadSessionError(f"Upload session setup failed: {e}") from e
+            UPLOAD_SESSION_POOL.append(session)
+        return list(UPLOAD_SESSION_POOL)
+
+async def stop_upload_sessions():
+    async with UPLOAD_SESSION_POOL_LOCK:
+        sessions = list(UPLOAD_SESSION_POOL)
+        UPLOAD_SESSION_POOL.clear()
+    for session in sessions:
+        try:
+            await session.stop()
+        except Exception as e:
+            logger.warning(f"Upload session stop failed: {e}")
+
+async def invoke_with_retry(session: Session, query, retries: int = UPLOAD_PART_RETRIES):
+    for attempt in range(1, retries + 1):
+        try:
+            return await session.invoke(query)
+        except FloodWait as e:
+            logger.warning(f"FloodWait {e.value}s on upload part")
+            await asyncio.sleep(e.value)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Upload part attempt {attempt} failed: {e}")
+            await asyncio.sleep(attempt)
+    raise Exception("Upload part retries exhausted")
+
+# Acknowledged parts per local file, so a retry re-sends only what Telegram is missing.
+UPLOAD_RESUME_STATE = {}
+
+def get_upload_resume_state(c: Client, path: Path) -> dict:
+    stat = path.stat()
+    state = UPLOAD_RESUME_STATE.get(str(path))
+    if not state or state['size'] != stat.st_size or state['mtime'] != stat.st_mtime:
+        state = {
+            'file_id': c.rnd_id(),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'total_parts': math.ceil(stat.st_size / UPLOAD_CHUNK_SIZE),
+            'acked': set(),
+        }
+        UPLOAD_RESUME_STATE[str(path)] = state
+    return state
+
+def mark_upload_part_missing(path: Path, part: int):
+    state = UPLOAD_RESUME_STATE.get(str(path))
+    if state:
+        state['acked'].discard(part)
+
+async def parallel_save_file(c: Client, path: Path, progress=None, cancel_event: asyncio.Event = None):
+    state = get_upload_resume_state(c, path)
+    file_size = state['size']
+    total_parts = state['total_parts']
+    file_id = state['file_id']
+    acked = state['acked']
+    sessions = await get_upload_sessions(c)
+
+    pending = asyncio.Queue()
+    for part in range(total_parts):
+        if part not in acked:
+            pending.put_nowait(part)
+    if acked:
+        logger.info(f"Resuming upload of {path.name}: {len(acked)}/{total_parts} parts already acknowledged")
+    uploaded = min(len(acked) * UPLOAD_CHUNK_SIZE, file_size)
+
+    async def worker(session):
+        nonlocal uploaded
+        with path.open("rb") as f:
+            while True:
+                try:
+                    part = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if cancel_event and cancel_event.is_set():
+                    raise Exception("Cancelled")
+                f.seek(part * UPLOAD_CHUNK_SIZE)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                await invoke_with_retry(session, raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=chunk
+                ))
+                acked.add(part)
+                uploaded += len(chunk)
+                if progress:
+                    await progress(uploaded, file_size)
+
+    workers = [asyncio.create_task(worker(s)) for s in sessions for _ in range(PARALLEL_UPLOAD_INFLIGHT)]
+    try:
+        await asyncio.gather(*workers)
+    except Exception:
+        for w in workers:
+            w.cancel()
+        raise
+    if len(acked) != total_parts:
+        raise Exception(f"Upload incomplete: {len(acked)}/{total_parts} parts acknowledged")
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=path.name)
+
+async def preupload_file(c: Client, path: Path, cancel_event: asyncio.Event = None, progress=None):
+    async def check_cancel(current, total):
+        if cancel_event and cancel_event.is_set():
+            c.stop_transmission()
+        if progress:
+            await progress(current, total)
+
+    if PARALLEL_UPLOAD_ENABLED and path.stat().st_size > PARALLEL_UPLOAD_MIN_SIZE:
+        input_file = await parallel_save_file(c, path, progress=progress, cancel_event=cancel_event)
+    else:
+        input_file = await Client.save_file(c, str(path), progress=check_cancel)
+    if input_file:
+        c.preuploaded_files[str(path)] = input_file
+    return input_file
+
+def split_video_by_size(in_path: Path, part_limit: int) -> list:
+    duration = get_video_metadata(in_path).get('duration', 0)
+    if not duration:
+        raise Exception("ভিডিওর দৈর্ঘ্য পাওয়া যায়নি, ফাইল ভাগ করা সম্ভব নয়।")
+
+    size = in_path.stat().st_size
+    factor = SPLIT_SAFETY_FACTOR
+    pattern = TMP / f"part_{int(time.time() * 1000)}_%03d{in_path.suffix}"
+    for _ in range(3):
+        segment_time = max(10, int(duration * part_limit / size * factor))
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", str(in_path),
+            "-map", "0",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(segment_time),
+            "-reset_timestamps", "1",
+            str(pattern)
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=3600)
+        parts = sorted(TMP.glob(pattern.name.replace("%03d", "[0-9][0-9][0-9]")))
+        if result.returncode != 0:
+            for p in parts:
+                p.unlink(missing_ok=True)
+            raise Exception(f"ফাইল ভাগ করতে ব্যর্থ: {result.stderr[-300:]}")
+        largest = max((p.stat().st_size for p in parts), default=0)
+        if parts and largest <= part_limit:
+            return parts
+        # Keyframes landed far from the target: retry with shorter segments.
+        for p in parts:
+            p.unlink(missing_ok=True)
+        factor *= part_limit / largest * SPLIT_SAFETY_FACTOR if largest else 0.5
+    raise Exception("ফাইলটি নির্ধারিত সাইজের অংশে ভাগ করা যায়নি।")
+
+async def upload_split_parts(c: Client, m: Message, in_path: Path, target_name: str, caption: str, status_msg: Message, cancel_event: asyncio.Event):
+    uid = m.from_user.id
+    if status_msg:
+        try:
+            await status_msg.edit(f"ফাইল {format_size(in_path.stat().st_size)} — {format_size(UPLOAD_PART_LIMIT)} এর অংশে ভাগ করা হচ্ছে...", reply_markup=progress_keyboard())
+        except Exception:
+            pass
+
+    parts = await asyncio.to_thread(split_video_by_size, in_path, UPLOAD_PART_LIMIT)
+    total = len(parts)
+    try:
+        if status_msg:
+            try:
+                await status_msg.edit(f"{total}টি অংশ একসাথে আপলোড হচ্ছে...", reply_markup=progress_keyboard())
+            except Exception:
+                pass
+
+        semaphore = asyncio.Semaphore(SPLIT_UPLOAD_CONCURRENCY)
+
+        async def preupload(part):
+            async with semaphore:
+                if cancel_event.is_set():
+                    return
+                try:
+                    await preupload_file(c, part, cancel_event)
+                except Exception as e:
+                    logger.warning(f"Pre-upload of {part.name} failed, it will be uploaded on send: {e}")
+
+        await asyncio.gather(*(preupload(part) for part in parts))
+        if cancel_event.is_set():
+            raise Exception("Cancelled")
+
+        part_stem, part_ext = Path(target_name).stem, Path(target_name).suffix
+        for i, part in enumerate(parts, 1):
+            if cancel_event.is_set():
+                raise Exception("Cancelled")
+            # Each part gets its own cancel scope, which process_file_and_upload unregisters
+            # when the part is done; the job's own event stays registered throughout.
+            part_event = asyncio.Event()
+            TASKS.setdefault(uid, []).append(part_event)
+            ok = await process_file_and_upload(
+                c, m, part,
+                original_name=f"{part_stem} Part {i:02d}{part_ext}",
+                cancel_event_passed=part_event,
+                skip_remux=True,
+                caption_override=f"{caption}\n**Part {i:02d}/{total:02d}**"
+            )
+            if part_event.is_set():
+                cancel_event.set()
+            if not ok:
+                raise Exception("Cancelled" if cancel_event.is_set() else f"Part {i:02d} upload failed")
+    finally:
+        for part in parts:
+            c.preuploaded_files.pop(str(part), None)
+            part.unlink(missing_ok=True)
+
+# --- UPLOADED FILE ID CACHE ---
+# Maps the identity of a job's source (Telegram file_unique_id, URL, Drive id) plus
+# the user's thumbnail to the file_id Telegram returned and the name it was sent
+# under. Jobs look the source up before downloading, so a hit skips both transfers.
+# The output name follows from the source (/rename folds the new name into its key)
+# and the streamed and downloaded remuxes are identical, so neither is keyed.
+# Remuxed outputs are not byte-stable (MKV SegmentUID/DateUTC change every run), so
+# the source is keyed instead of the output. Rows live in the file_ids table.
+FILE_ID_CACHE_MAX = 5000
+FILE_ID_CACHE_PRUNE_EVERY = 100
+FILE_ID_CACHE_WRITES = 0
+
+def telegram_source_key(message: Message):
+    media = message and (message.video or message.document or message.audio)
+    unique_id = getattr(media, 'file_unique_id', None)
+    return f"tg:{unique_id}" if unique_id else None
+
+# A reused file_id keeps the thumbnail it was uploaded with, so /setthumb, /del_thumb
+# and the frame time all start a new key.
+def thumb_cache_identity(uid: int) -> str:
+    if USER_THUMBS.get(uid):
+        return f"thumb:{USER_THUMB_FILE_IDS.get(uid) or USER_THUMBS[uid]}"
+    return f"frame:{USER_THUMB_TIME.get(uid, 1)}"
+
+def file_id_cache_key(source_key: str, thumb: str) -> str:
+    return f"{source_key}|{thumb}"
+
+def get_cached_file_id(key: str):
+    rows = bot_db_execute("SELECT file_id, kind, name FROM file_ids WHERE key = ?", (key,), fetch=True)
+    return rows[0] if rows else None
+
+def store_file_id(key: str, file_id: str, kind: str, name: str, prune: bool):
+    bot_db_execute(
+        "INSERT OR REPLACE INTO file_ids (key, file_id, kind, name, time) VALUES (?, ?, ?, ?, ?)",
+        (key, file_id, kind, name, time.time())
+    )
+    if prune:
+        bot_db_execute(
+            "DELETE FROM file_ids WHERE key NOT IN (SELECT key FROM file_ids ORDER BY time DESC LIMIT ?)",
+            (FILE_ID_CACHE_MAX,)
+        )
+
+async def remember_file_id(key: str, kind: str, name: str, sent_message: Message):
+    global FILE_ID_CACHE_WRITES
+    media = getattr(sent_message, kind, None) or sent_message.document or sent_message.video or sent_message.audio
+    if not media:
+        return
+    FILE_ID_CACHE_WRITES += 1
+    try:
+        await asyncio.to_thread(store_file_id, key, media.file_id, kind, name, FILE_ID_CACHE_WRITES % FILE_ID_CACHE_PRUNE_EVERY == 0)
+    except Exception as e:
+        logger.warning(f"File ID cache save error: {e}")
+
+async def forget_file_id(key: str):
+    try:
+        await asyncio.to_thread(bot_db_execute, "DELETE FROM file_ids WHERE key = ?", (key,))
+    except Exception as e:
+        logger.warning(f"File ID cache save error: {e}")
+
+# Returns (key, file_id, kind, name) for a source already sent with the user's current thumbnail.
+async def lookup_cached_upload(uid: int, source_key: str):
+    if not source_key:
+        return None
+    key = file_id_cache_key(source_key, thumb_cache_identity(uid))
+    try:
+        row = await asyncio.to_thread(get_cached_file_id, key)
+    except Exception as e:
+        logger.warning(f"File ID cache lookup failed: {e}")
+        return None
+    return (key, *row) if row else None
+
+async def send_cached_file(c: Client, m: Message, uid: int, cached: tuple, caption_slot: dict = None) -> bool:
+    key, file_id, kind, name = cached
+    send = {"video": c.send_video, "audio": c.send_audio}.get(kind, c.send_document)
+    try:
+        await send(m.chat.id, file_id, caption=resolve_job_caption(uid, name, caption_slot=caption_slot), parse_mode=ParseMode.MARKDOWN)
+    except Exception as e:
+        logger.warning(f"Cached file_id for {name} failed, the file will be downloaded: {e}")
+        if not isinstance(e, FloodWait):
+            await forget_file_id(key)
+        return False
+    logger.info(f"Reusing cached file_id for {name}")
+    return True
+
+# Sends a cached copy in upload order before anything is downloaded. False means
+# the caller downloads and uploads as usual.
+async def reuse_cached_upload(c: Client, m: Message, uid: int, source_key: str, caption_slot: dict = None) -> bool:
+    cached = await lookup_cached_upload(uid, source_key)
+    if not cached:
+        return False
+    async with USER_UPLOAD_LOCKS.setdefault(uid, asyncio.Lock()):
+        return await send_cached_file(c, m, uid, cached, caption_slot)
 
-async def process_file_and_upload(c: Client, m: Message, in_path: Path, original_name: str = None, messages_to_delete: list = None, cancel_event_passed: asyncio.Event = None):
+async def process_file_and_upload(c: Client, m: Message, in_path: Path, original_name: str = None, messages_to_delete: list = None, cancel_event_passed: asyncio.Event = None, skip_remux: bool = False, caption_override: str = None, caption_slot: dict = None, source_key: str = None, disk_mode: str = None):
     uid = m.from_user.id
     cancel_event = cancel_event_passed
     if not cancel_event:
@@ -1994,7 +4935,6 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
     
     upload_path = in_path
     temp_thumb_path = None
-    final_caption_template = USER_CAPTIONS.get(uid)
     status_msg = None 
 
     try:
@@ -2010,7 +4950,9 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
         is_video_file = bool(m.video) or any(input_name.lower().endswith(ext) for ext in video_exts)
         is_audio_file = any(input_name.lower().endswith(ext) for ext in audio_exts)
         
-        if is_video_file:
+        if is_video_file and skip_remux:
+            target_name = Path(target_name).stem + in_path.suffix
+        elif is_video_file:
             is_mp4_container = input_name.lower().endswith(".mp4")
             is_mkv_container = input_name.lower().endswith(".mkv")
             has_opus = has_opus_audio(in_path)
@@ -2061,6 +5003,16 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                 logger.warning(f"Processing failed: {result.stderr}. Uploading original.")
                 pass
 
+        if is_video_file and upload_path.exists() and upload_path.stat().st_size > UPLOAD_PART_LIMIT:
+            caption_to_use = resolve_job_caption(uid, target_name, caption_override, caption_slot)
+            await upload_split_parts(c, m, upload_path, target_name, caption_to_use, status_msg, cancel_event)
+            if messages_to_delete:
+                try:
+                    await c.delete_messages(chat_id=m.chat.id, message_ids=messages_to_delete)
+                except Exception:
+                    pass
+            return True
+
         if is_video_file:
             thumb_path = USER_THUMBS.get(uid)
             if not thumb_path:
@@ -2093,9 +5045,14 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
         width_px = video_metadata.get('width', 0)
         height_px = video_metadata.get('height', 0)
         
-        caption_to_use = f"**{target_name}**" 
-        if final_caption_template:
-            caption_to_use = process_dynamic_caption(uid, final_caption_template)
+        caption_to_use = resolve_job_caption(uid, target_name, caption_override, caption_slot)
+
+        media_kind = "video" if is_video_file else "audio" if is_audio_file else "document"
+        # Keyed on the thumbnail the upload actually uses; callers look it up before downloading.
+        cache_key = file_id_cache_key(source_key, thumb_cache_identity(uid)) if source_key else None
+        use_parallel_upload = PARALLEL_UPLOAD_ENABLED and upload_path.stat().st_size > PARALLEL_UPLOAD_MIN_SIZE
+
+        reporter = get_progress_reporter(status_msg, "আপলোড হচ্ছে...", upload_path.stat().st_size)
 
         upload_attempts = 3
         last_exc = None
@@ -2103,12 +5060,27 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
             try:
                 if cancel_event.is_set(): raise Exception("Cancelled")
 
+                if use_parallel_upload and str(upload_path) not in c.preuploaded_files:
+                    # Resumes from the parts acknowledged by earlier attempts.
+                    try:
+                        await preupload_file(c, upload_path, cancel_event, progress=reporter.progress if reporter else None)
+                    except Exception as e:
+                        if cancel_event.is_set() or "Cancelled" in str(e) or is_transient_upload_error(e):
+                            # The next attempt re-sends only the parts still missing.
+                            raise
+                        logger.warning(f"Parallel pre-upload failed, falling back to a plain upload: {e}")
+                        use_parallel_upload = False
+                        c.preuploaded_files.pop(str(upload_path), None)
+                        UPLOAD_RESUME_STATE.pop(str(upload_path), None)
+
                 async def progress(current, total):
                     if cancel_event.is_set():
                         c.stop_transmission()
+                    if reporter:
+                        reporter.update(current, total)
 
                 if is_video_file:
-                    await c.send_video(
+                    sent = await c.send_video(
                         chat_id=m.chat.id,
                         video=str(upload_path),
                         caption=caption_to_use,
@@ -2122,7 +5094,7 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                         progress=progress
                     )
                 elif is_audio_file:
-                     await c.send_audio(
+                     sent = await c.send_audio(
                         chat_id=m.chat.id,
                         audio=str(upload_path),
                         file_name=target_name,
@@ -2131,7 +5103,7 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                         progress=progress
                     )
                 else:
-                    await c.send_document(
+                    sent = await c.send_document(
                         chat_id=m.chat.id,
                         document=str(upload_path),
                         file_name=target_name,
@@ -2140,6 +5112,9 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                         progress=progress
                     )
                 
+                if cache_key and sent:
+                    await remember_file_id(cache_key, media_kind, target_name, sent)
+
                 if messages_to_delete:
                     try:
                         await c.delete_messages(chat_id=m.chat.id, message_ids=messages_to_delete)
@@ -2152,8 +5127,11 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                 last_exc = e
                 if "Cancelled" in str(e):
                     break
+                c.preuploaded_files.pop(str(upload_path), None)
+                if isinstance(e, FilePartMissing):
+                    mark_upload_part_missing(upload_path, e.value)
                 logger.warning("Upload attempt %s failed: %s", attempt, e)
-                await asyncio.sleep(2 * attempt)
+                await asyncio.sleep(e.value if isinstance(e, FloodWait) else 2 * attempt)
         
         if last_exc:
             msg_text = "অপারেশন বাতিল করা হয়েছে।" if "Cancelled" in str(last_exc) else f"আপলোড ব্যর্থ: {last_exc}"
@@ -2161,6 +5139,7 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
                 await status_msg.edit(msg_text, reply_markup=None)
             else:
                 await m.reply_text(msg_text, reply_markup=None)
+        return last_exc is None
 
     except Exception as e:
         msg_text = "অপারেশন বাতিল করা হয়েছে।" if "Cancelled" in str(e) else f"আপলোডে ত্রুটি: {e}"
@@ -2168,7 +5147,14 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
             await status_msg.edit(msg_text)
         else:
             await m.reply_text(msg_text)
+        return False
     finally:
+        if disk_mode:
+            record_disk_bytes_written(disk_mode, in_path, upload_path)
+        c.preuploaded_files.pop(str(upload_path), None)
+        UPLOAD_RESUME_STATE.pop(str(upload_path), None)
+        # The status message is deleted on success and carries the result otherwise.
+        await close_progress_reporter(status_msg, flush=False)
         try:
             if upload_path != in_path and upload_path.exists():
                 upload_path.unlink()
@@ -2180,7 +5166,363 @@ async def process_file_and_upload(c: Client, m: Message, in_path: Path, original
         except Exception:
             pass
 
-@app.on_message(filters.command("broadcast") & filters.private)
+# --- BROADCAST ENGINE ---
+# Subscribers and broadcast checkpoints live in SQLite, so a restart neither loses
+# the audience nor starts a broadcast over. Recipients are walked in chat_id order
+# one page at a time and the cursor is committed after every page.
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_MIN_RATE = 1.0
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))
+BROADCAST_PRUNE_ERRORS = (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid, ChatWriteForbidden)
+BROADCAST_TASKS = {}
+
+def load_subscribers() -> set:
+    try:
+        return {row[0] for row in bot_db_execute("SELECT chat_id FROM subscribers", fetch=True)}
+    except Exception as e:
+        logger.warning(f"Subscriber store load error: {e}")
+        return set()
+
+SUBSCRIBERS.update(load_subscribers())
+startup_mark("subscriber store")
+
+async def add_subscriber(chat_id: int):
+    if chat_id in SUBSCRIBERS:
+        return
+    SUBSCRIBERS.add(chat_id)
+    try:
+        await asyncio.to_thread(bot_db_execute, "INSERT OR IGNORE INTO subscribers (chat_id, added_at) VALUES (?, ?)", (chat_id, time.time()))
+    except Exception as e:
+        logger.warning(f"Subscriber store write error: {e}")
+
+async def prune_subscribers(chat_ids: list):
+    if not chat_ids:
+        return
+    SUBSCRIBERS.difference_update(chat_ids)
+    await asyncio.to_thread(bot_db_execute, "DELETE FROM subscribers WHERE chat_id = ?", [(cid,) for cid in chat_ids], many=True)
+
+BROADCAST_COLUMNS = ("id", "from_chat_id", "message_id", "status_chat_id", "status_message_id", "cursor", "sent", "failed", "pruned", "state", "started_at")
+
+def create_broadcast_job(from_chat_id: int, message_id: int, status_chat_id: int, status_message_id: int) -> dict:
+    job = {
+        "from_chat_id": from_chat_id, "message_id": message_id,
+        "status_chat_id": status_chat_id, "status_message_id": status_message_id,
+        "cursor": -(2 ** 63), "sent": 0, "failed": 0, "pruned": 0,
+        "state": "running", "started_at": time.time(),
+    }
+    job["id"] = bot_db_execute(
+        "INSERT INTO broadcasts (from_chat_id, message_id, status_chat_id, status_message_id, cursor, sent, failed, pruned, state, started_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        tuple(job[k] for k in BROADCAST_COLUMNS[1:])
+    )
+    return job
+
+def save_broadcast_checkpoint(job: dict):
+    bot_db_execute(
+        "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, pruned = ?, state = ? WHERE id = ?",
+        (job["cursor"], job["sent"], job["failed"], job["pruned"], job["state"], job["id"])
+    )
+
+def load_running_broadcasts() -> list:
+    rows = bot_db_execute(f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts WHERE state = 'running' ORDER BY id", fetch=True)
+    return [dict(zip(BROADCAST_COLUMNS, row)) for row in rows]
+
+def next_broadcast_page(cursor: int) -> list:
+    rows = bot_db_execute("SELECT chat_id FROM subscribers WHERE chat_id > ? ORDER BY chat_id LIMIT ?", (cursor, BROADCAST_PAGE_SIZE), fetch=True)
+    return [row[0] for row in rows]
+
+def count_broadcast_remaining(cursor: int, exclude_chat_id: int) -> int:
+    return bot_db_execute("SELECT COUNT(*) FROM subscribers WHERE chat_id > ? AND chat_id != ?", (cursor, exclude_chat_id), fetch=True)[0][0]
+
+class AdaptiveRateLimiter(RateLimiter):
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 1.0, recover_after: int = 100):
+        super().__init__(rate, burst)
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recover_after = recover_after
+        self.streak = 0
+
+    def on_success(self):
+        self.streak += 1
+        if self.streak >= self.recover_after and self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate * 1.25)
+            self.streak = 0
+
+    def on_flood_wait(self, seconds: float):
+        self.streak = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.pause(seconds)
+
+async def broadcast_to_chat(c: Client, limiter: AdaptiveRateLimiter, chat_id: int, job: dict) -> str:
+    for attempt in range(4):
+        await limiter.acquire()
+        try:
+            await c.forward_messages(chat_id=chat_id, from_chat_id=job["from_chat_id"], message_ids=job["message_id"])
+            limiter.on_success()
+            return "sent"
+        except FloodWait as e:
+            limiter.on_flood_wait(e.value)
+            logger.warning(f"Broadcast FloodWait {e.value}s, rate now {limiter.rate:.1f}/s")
+        except BROADCAST_PRUNE_ERRORS:
+            return "pruned"
+        except Exception as e:
+            logger.warning("Broadcast to %s failed: %s", chat_id, e)
+            return "failed"
+    return "failed"
+
+def render_broadcast_status(job: dict, total: int, rate: float, done: bool = False) -> str:
+    processed = job["sent"] + job["failed"] + job["pruned"]
+    if done:
+        header = "ব্রডকাস্ট শেষ।" if job["state"] == "done" else "ব্রডকাস্ট বাতিল করা হয়েছে।"
+    else:
+        header = "ব্রডকাস্ট চলছে..."
+    eta = (total - processed) / rate if rate > 0 else None
+    lines = [
+        header,
+        f"অগ্রগতি: {processed}/{total}",
+        f"পাঠানো: {job['sent']}, ব্যর্থ: {job['failed']}, মুছে ফেলা (blocked/deleted): {job['pruned']}",
+        f"গতি: {rate:.1f} msg/s",
+    ]
+    if not done:
+        lines.append(f"ETA: {format_eta(eta)}")
+    return "\n".join(lines)
+
+async def run_broadcast(c: Client, job: dict, cancel_event: asyncio.Event):
+    limiter = AdaptiveRateLimiter(BROADCAST_RATE, burst=BROADCAST_CONCURRENCY, min_rate=BROADCAST_MIN_RATE)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    total = job["sent"] + job["failed"] + job["pruned"] + await asyncio.to_thread(count_broadcast_remaining, job["cursor"], job["status_chat_id"])
+    started = time.monotonic()
+    processed_this_run = 0
+    last_edit = 0.0
+
+    async def edit_status(text, markup=None):
+        try:
+            await c.edit_message_text(job["status_chat_id"], job["status_message_id"], text, reply_markup=markup)
+        except Exception:
+            pass
+
+    async def bounded(chat_id):
+        async with semaphore:
+            if cancel_event.is_set():
+                return None
+            return await broadcast_to_chat(c, limiter, chat_id, job)
+
+    try:
+        while not cancel_event.is_set():
+            page = await asyncio.to_thread(next_broadcast_page, job["cursor"])
+            if not page:
+                break
+            recipients = [cid for cid in page if cid != job["status_chat_id"]]
+            outcomes = await asyncio.gather(*(bounded(cid) for cid in recipients))
+            if cancel_event.is_set():
+                break
+            pruned = [cid for cid, outcome in zip(recipients, outcomes) if outcome == "pruned"]
+            for outcome in outcomes:
+                job[outcome] += 1
+            processed_this_run += len(outcomes)
+            await prune_subscribers(pruned)
+            job["cursor"] = page[-1]
+            await asyncio.to_thread(save_broadcast_checkpoint, job)
+
+            now = time.monotonic()
+            if now - last_edit >= PROGRESS_EDIT_INTERVAL:
+                last_edit = now
+                await edit_status(render_broadcast_status(job, total, processed_this_run / max(now - started, 1e-6)), progress_keyboard())
+
+        job["state"] = "cancelled" if cancel_event.is_set() else "done"
+    except Exception as e:
+        logger.error(f"Broadcast {job['id']} error: {e}")
+        job["state"] = "failed"
+    finally:
+        try:
+            await asyncio.to_thread(save_broadcast_checkpoint, job)
+        except Exception as e:
+            logger.warning(f"Broadcast checkpoint error: {e}")
+        rate = processed_this_run / max(time.monotonic() - started, 1e-6)
+        await edit_status(render_broadcast_status(job, total, rate, done=True))
+        try:
+            TASKS[job["status_chat_id"]].remove(cancel_event)
+        except Exception:
+            pass
+        BROADCAST_TASKS.pop(job["id"], None)
+
+def start_broadcast_task(c: Client, job: dict) -> asyncio.Task:
+    cancel_event = asyncio.Event()
+    TASKS.setdefault(job["status_chat_id"], []).append(cancel_event)
+    task = asyncio.create_task(run_broadcast(c, job, cancel_event))
+    BROADCAST_TASKS[job["id"]] = {'task': task, 'job': job, 'started': time.time()}
+    return task
+
+async def resume_pending_broadcasts():
+    while not app.is_initialized:
+        await asyncio.sleep(1)
+    try:
+        jobs = await asyncio.to_thread(load_running_broadcasts)
+    except Exception as e:
+        logger.warning(f"Broadcast resume error: {e}")
+        return
+    for job in jobs:
+        if job["id"] in BROADCAST_TASKS:
+            continue
+        logger.info(f"Resuming broadcast {job['id']} after chat_id {job['cursor']}")
+        try:
+            await app.send_message(job["status_chat_id"], f"বট রিস্টার্টের পর ব্রডকাস্ট আবার শুরু হচ্ছে ({job['sent']} জনকে আগেই পাঠানো হয়েছে)...")
+        except Exception:
+            pass
+        start_broadcast_task(app, job)
+
+# --- USER SETTINGS STORE ---
+# The USER_* dicts and mode sets stay the in-memory cache. Only admins can change
+# settings, so only an admin's saved settings are loaded, on their first update. A
+# background flusher writes back the users whose snapshot changed since the last
+# flush and forgets users idle for SETTINGS_IDLE_TTL once they are written.
+SETTINGS_BACKEND = os.getenv("SETTINGS_BACKEND", "sqlite").lower()
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "bot05")
+SETTINGS_FLUSH_INTERVAL = float(os.getenv("SETTINGS_FLUSH_INTERVAL", "5"))
+SETTINGS_IDLE_TTL = float(os.getenv("SETTINGS_IDLE_TTL", "3600"))
+SETTINGS_LOADED = {}
+SETTINGS_LAST_SEEN = {}
+SETTINGS_LOAD_LOCKS = {}
+SETTINGS_STORE = None
+
+class SqliteSettingsBackend:
+    def __init__(self):
+        bot_db_execute("CREATE TABLE IF NOT EXISTS user_settings (uid INTEGER PRIMARY KEY, data TEXT, updated_at REAL)")
+
+    async def load(self, uid: int):
+        rows = await asyncio.to_thread(bot_db_execute, "SELECT data FROM user_settings WHERE uid = ?", (uid,), True)
+        return json.loads(rows[0][0]) if rows else None
+
+    async def save_many(self, docs: dict):
+        now = time.time()
+        await asyncio.to_thread(
+            bot_db_execute, "INSERT OR REPLACE INTO user_settings (uid, data, updated_at) VALUES (?, ?, ?)",
+            [(uid, data, now) for uid, data in docs.items()], False, True
+        )
+
+class MongoSettingsBackend:
+    def __init__(self, uri: str):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        self.collection = AsyncIOMotorClient(uri)[MONGO_DB_NAME]["user_settings"]
+
+    async def load(self, uid: int):
+        doc = await self.collection.find_one({"_id": uid})
+        return doc.get("data") if doc else None
+
+    async def save_many(self, docs: dict):
+        from pymongo import ReplaceOne
+        now = time.time()
+        await self.collection.bulk_write([
+            ReplaceOne({"_id": uid}, {"_id": uid, "data": json.loads(data), "updated_at": now}, upsert=True)
+            for uid, data in docs.items()
+        ], ordered=False)
+
+def get_settings_store():
+    global SETTINGS_STORE
+    if SETTINGS_STORE is None:
+        if SETTINGS_BACKEND == "mongo" and MONGO_URI:
+            try:
+                SETTINGS_STORE = MongoSettingsBackend(MONGO_URI)
+            except Exception as e:
+                logger.warning(f"Mongo settings backend unavailable ({e}), using SQLite.")
+        if SETTINGS_STORE is None:
+            SETTINGS_STORE = SqliteSettingsBackend()
+    return SETTINGS_STORE
+
+def user_settings_snapshot(uid: int) -> dict:
+    return {
+        "caption": USER_CAPTIONS.get(uid),
+        "counters": USER_COUNTERS.get(uid),
+        "thumb_file_id": USER_THUMB_FILE_IDS.get(uid),
+        "thumb_time": USER_THUMB_TIME.get(uid),
+        "edit_caption_mode": uid in EDIT_CAPTION_MODE,
+        "mkv_audio_change_mode": uid in MKV_AUDIO_CHANGE_MODE,
+        "transcode_mode": uid in TRANSCODE_MODE,
+    }
+
+async def apply_user_settings(client: Client, uid: int, doc: dict):
+    # setdefault: anything changed in memory while the load was in flight wins.
+    if doc.get("caption"):
+        USER_CAPTIONS.setdefault(uid, doc["caption"])
+    if doc.get("counters"):
+        USER_COUNTERS.setdefault(uid, doc["counters"])
+    if doc.get("thumb_time") is not None:
+        USER_THUMB_TIME.setdefault(uid, doc["thumb_time"])
+    if doc.get("edit_caption_mode"):
+        EDIT_CAPTION_MODE.add(uid)
+    if doc.get("mkv_audio_change_mode"):
+        MKV_AUDIO_CHANGE_MODE.add(uid)
+    if doc.get("transcode_mode"):
+        TRANSCODE_MODE.add(uid)
+    file_id = doc.get("thumb_file_id")
+    if file_id and uid not in USER_THUMBS:
+        USER_THUMB_FILE_IDS.setdefault(uid, file_id)
+        out = TMP / f"thumb_{uid}.jpg"
+        try:
+            if not out.exists():
+                await client.download_media(file_id, file_name=str(out))
+                await asyncio.to_thread(prepare_thumb_image, out)
+            USER_THUMBS[uid] = str(out)
+        except Exception as e:
+            logger.warning(f"Thumbnail restore failed for {uid}: {e}")
+
+async def ensure_user_settings(client: Client, uid: int):
+    SETTINGS_LAST_SEEN[uid] = time.monotonic()
+    if uid in SETTINGS_LOADED:
+        return
+    lock = SETTINGS_LOAD_LOCKS.setdefault(uid, asyncio.Lock())
+    async with lock:
+        if uid in SETTINGS_LOADED:
+            return
+        try:
+            doc = await get_settings_store().load(uid)
+        except Exception as e:
+            # Not marked as loaded, so the flusher can't overwrite the stored copy.
+            logger.warning(f"Settings load failed for {uid}: {e}")
+            return
+        if doc:
+            await apply_user_settings(client, uid, doc)
+        # Without a stored row the baseline is the defaults, so only a real change writes one.
+        SETTINGS_LOADED[uid] = json.dumps(doc or user_settings_snapshot(None), sort_keys=True)
+    SETTINGS_LOAD_LOCKS.pop(uid, None)
+
+async def flush_user_settings() -> int:
+    changed = {}
+    for uid, persisted in list(SETTINGS_LOADED.items()):
+        snapshot = json.dumps(user_settings_snapshot(uid), sort_keys=True)
+        if snapshot != persisted:
+            changed[uid] = snapshot
+    if changed:
+        await get_settings_store().save_many(changed)
+        SETTINGS_LOADED.update(changed)
+    idle_before = time.monotonic() - SETTINGS_IDLE_TTL
+    for uid in [uid for uid, seen in SETTINGS_LAST_SEEN.items() if seen < idle_before]:
+        # Everything is written, so the next update simply loads it again.
+        SETTINGS_LOADED.pop(uid, None)
+        SETTINGS_LAST_SEEN.pop(uid, None)
+    return len(changed)
+
+async def settings_flush_loop():
+    while True:
+        await asyncio.sleep(SETTINGS_FLUSH_INTERVAL)
+        try:
+            await flush_user_settings()
+        except Exception as e:
+            logger.warning(f"Settings flush failed: {e}")
+
+@app.on_message(filters.private, group=-3)
+async def load_settings_on_message(c, m: Message):
+    if m.from_user and is_admin(m.from_user.id):
+        await ensure_user_settings(c, m.from_user.id)
+
+@app.on_callback_query(group=-3)
+async def load_settings_on_callback(c, cb: CallbackQuery):
+    if is_admin(cb.from_user.id):
+        await ensure_user_settings(c, cb.from_user.id)
+
+@app.on_message(filters.command("broadcast") & filters.private & ~filters.reply)
 async def broadcast_cmd_no_reply(c, m: Message):
     uid = m.from_user.id
     if not is_admin(uid):
@@ -2202,25 +5544,11 @@ async def broadcast_cmd_reply(c, m: Message):
         await m.reply_text("ব্রডকাস্ট করতে যেকোনো মেসেজে রিপ্লাই করে এই কমান্ড দিন।")
         return
 
-    await m.reply_text(f"ব্রডকাস্ট শুরু হচ্ছে {len(SUBSCRIBERS)} সাবস্ক্রাইবারে...", quote=True)
-    failed = 0
-    sent = 0
-    for chat_id in list(SUBSCRIBERS):
-        if chat_id == m.chat.id:
-            continue
-        try:
-            await c.forward_messages(chat_id=chat_id, from_chat_id=source_message.chat.id, message_ids=source_message.id)
-            sent += 1
-            await asyncio.sleep(0.08)
-        except Exception as e:
-            failed += 1
-            logger.warning("Broadcast to %s failed: %s", chat_id, e)
-
-    await m.reply_text(f"ব্রডকাস্ট শেষ। পাঠানো: {sent}, ব্যর্থ: {failed}")
+    status_msg = await m.reply_text(f"ব্রডকাস্ট শুরু হচ্ছে {len(SUBSCRIBERS)} সাবস্ক্রাইবারে...", quote=True, reply_markup=progress_keyboard())
+    job = await asyncio.to_thread(create_broadcast_job, source_message.chat.id, source_message.id, status_msg.chat.id, status_msg.id)
+    start_broadcast_task(c, job)
 
-@flask_app.route('/')
-def home():
-    html_content = """
+STATUS_PAGE_HTML = """
     <!DOCTYPE-html>
     <html lang="en">
     <head>
@@ -2255,51 +5583,267 @@ def home():
     </body>
     </html>
     """
-    return render_template_string(html_content)
 
-def ping_service():
+# --- STATUS SERVER ---
+# aiohttp on the bot's own event loop serves the status page and /healthz; the
+# keep-alive pinger is a coroutine on the same loop.
+PING_INTERVAL = int(os.getenv("PING_INTERVAL", "600"))
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "2"))
+HEALTH_TG_TIMEOUT = 5
+HEALTH_TG_CACHE_SECONDS = 10
+LOOP_LAG = {'last': 0.0, 'max': 0.0, 'ticked_at': 0.0}
+TG_HEALTH = {'ok': False, 'rtt_ms': None, 'error': None, 'checked_at': 0.0}
+
+async def loop_lag_monitor(interval: float = 1.0):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG['last'] = lag
+        LOOP_LAG['max'] = max(LOOP_LAG['max'] * 0.99, lag)
+        LOOP_LAG['ticked_at'] = time.monotonic()
+
+async def check_telegram_health() -> dict:
+    if time.monotonic() - TG_HEALTH['checked_at'] < HEALTH_TG_CACHE_SECONDS:
+        return TG_HEALTH
+    start = time.perf_counter()
+    try:
+        if not app.is_connected:
+            raise ConnectionError("client not connected")
+        await asyncio.wait_for(app.invoke(raw.functions.Ping(ping_id=int(time.time() * 1000))), HEALTH_TG_TIMEOUT)
+        TG_HEALTH.update(ok=True, rtt_ms=round((time.perf_counter() - start) * 1000, 1), error=None)
+    except Exception as e:
+        TG_HEALTH.update(ok=False, rtt_ms=None, error=str(e) or type(e).__name__)
+    TG_HEALTH['checked_at'] = time.monotonic()
+    return TG_HEALTH
+
+async def status_page(request):
+    return web.Response(text=STATUS_PAGE_HTML, content_type="text/html")
+
+async def healthz(request):
+    telegram = await check_telegram_health()
+    monitor_age = time.monotonic() - LOOP_LAG['ticked_at'] if LOOP_LAG['ticked_at'] else None
+    loop_ok = monitor_age is not None and monitor_age < 5 and LOOP_LAG['last'] < HEALTH_MAX_LOOP_LAG
+    body = {
+        'status': 'ok' if telegram['ok'] and loop_ok else 'unhealthy',
+        'telegram': {'connected': telegram['ok'], 'rtt_ms': telegram['rtt_ms'], 'error': telegram['error']},
+        'event_loop': {
+            'ok': loop_ok,
+            'lag_ms': round(LOOP_LAG['last'] * 1000, 1),
+            'max_lag_ms': round(LOOP_LAG['max'] * 1000, 1),
+        },
+    }
+    return web.json_response(body, status=200 if body['status'] == 'ok' else 503)
+
+# --- JOB INSPECTOR ---
+# A read-only snapshot of everything in flight, built from the existing registries:
+# progress reporters (downloads, remux, uploads, yt-dlp/URL), upload queues, pending
+# audio orders, cancel events and broadcasts. /jobs is only served when STATUS_TOKEN
+# is set and the request carries it; otherwise the route answers 404.
+STATUS_TOKEN = os.getenv("STATUS_TOKEN")
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+def collect_jobs() -> list:
+    now_mono = time.monotonic()
+    now = time.time()
+    jobs = []
+    for (chat_id, message_id), reporter in list(PROGRESS_REPORTERS.items()):
+        jobs.append({
+            'kind': 'transfer', 'chat_id': chat_id, 'message_id': message_id,
+            'stage': reporter.stage, 'bytes_done': reporter.done, 'bytes_total': reporter.total,
+            'speed_bps': round(reporter.speed), 'age_s': round(now_mono - reporter.started),
+            'idle_s': round(now_mono - reporter.updated_at),
+        })
+    for uid, pending in list(QUEUED_JOBS.items()):
+        for item in list(pending):
+            jobs.append({
+                'kind': 'queued', 'uid': uid, 'name': item['name'], 'stage': 'waiting in queue',
+                'age_s': round(now - item['enqueued_at']),
+            })
+    for prompt_id, order in PENDING_AUDIO_ORDERS.items():
+        jobs.append({
+            'kind': 'audio_order', 'uid': order.uid, 'name': order.original_name,
+            'stage': 'waiting for track order', 'age_s': round(now - order.created_at),
+        })
+    for job_id, entry in list(BROADCAST_TASKS.items()):
+        job = entry['job']
+        jobs.append({
+            'kind': 'broadcast', 'id': job_id, 'stage': job['state'],
+            'sent': job['sent'], 'failed': job['failed'], 'pruned': job['pruned'],
+            'age_s': round(now - entry['started']),
+        })
+    for uid, events in list(TASKS.items()):
+        active = sum(1 for ev in events if not ev.is_set())
+        if active:
+            jobs.append({'kind': 'operations', 'uid': uid, 'stage': 'active', 'count': active})
+    return jobs
+
+def throughput_summary() -> dict:
+    return {
+        '1h': {'bucket_minutes': 5, 'bytes': throughput_histogram(60, 5)},
+        '24h': {'bucket_minutes': 60, 'bytes': throughput_histogram(24 * 60, 60)},
+    }
+
+def sparkline(values: list) -> str:
+    peak = max(values) if values else 0
+    if not peak:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, int(v * len(SPARK_CHARS) / peak))] for v in values)
+
+def render_stats_text(jobs: list) -> str:
+    lines = [f"চলমান/অপেক্ষমাণ কাজ: {len(jobs)}"]
+    for job in jobs[:30]:
+        if job['kind'] == 'transfer':
+            size = f"{format_size(job['bytes_done'])}/{format_size(job['bytes_total'])}" if job['bytes_total'] else format_size(job['bytes_done'])
+            lines.append(f"• {job['stage']} {size} @ {format_size(job['speed_bps'])}/s, {format_eta(job['age_s'])} ধরে")
+        elif job['kind'] == 'broadcast':
+            lines.append(f"• broadcast #{job['id']}: {job['sent']} sent, {job['failed']} failed, {format_eta(job['age_s'])} ধরে")
+        elif job['kind'] == 'operations':
+            lines.append(f"• user {job['uid']}: {job['count']} active operation(s)")
+        else:
+            lines.append(f"• {job['stage']}: {job.get('name')} ({format_eta(job['age_s'])})")
+    if len(jobs) > 30:
+        lines.append(f"... আরও {len(jobs) - 30}টি")
+
+    summary = throughput_summary()
+    for label, data in summary.items():
+        total = sum(data['bytes'])
+        lines.append(f"\nThroughput {label} ({data['bucket_minutes']}m buckets): {format_size(total)}")
+        lines.append(sparkline(data['bytes']))
+
+    memory = state_memory_report()
+    lines.append(f"\nMemory (peak RSS {format_size(memory['max_rss_kb'] * 1024)}):")
+    for registry in memory['registries']:
+        lines.append(f"• {registry['name']}: {registry['items']}/{registry['max_items']} items, ~{format_size(registry['approx_bytes'])}, evicted {registry['evicted']}")
+    return "\n".join(lines)
+
+async def jobs_endpoint(request):
+    if not STATUS_TOKEN:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(request.query.get('token', ''), STATUS_TOKEN):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    return web.json_response({
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'jobs': collect_jobs(),
+        'throughput': throughput_summary(),
+        'memory': state_memory_report(),
+    })
+
+def create_status_app() -> web.Application:
+    status_app = web.Application()
+    status_app.router.add_get('/', status_page)
+    status_app.router.add_get('/healthz', healthz)
+    status_app.router.add_get('/jobs', jobs_endpoint)
+    return status_app
+
+async def start_status_server():
+    runner = web.AppRunner(create_status_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    logger.info(f"Status server listening on :{PORT}")
+    return runner
+
+async def keep_alive_pinger():
     if not RENDER_EXTERNAL_HOSTNAME:
-        print("Render URL is not set. Ping service is disabled.")
+        logger.info("Render URL is not set. Ping service is disabled.")
         return
-
     url = f"http://{RENDER_EXTERNAL_HOSTNAME}"
-    while True:
-        try:
-            response = requests.get(url, timeout=10)
-            print(f"Pinged {url} | Status Code: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error pinging {url}: {e}")
-        time.sleep(600)
-
-def run_flask_and_ping():
-    flask_thread = threading.Thread(target=lambda: flask_app.run(host="0.0.0.0", port=PORT, use_reloader=False))
-    flask_thread.start()
-    ping_thread = threading.Thread(target=ping_service)
-    ping_thread.start()
-    print("Flask and Ping services started.")
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    logger.info(f"Pinged {url} | Status Code: {response.status}")
+            except Exception as e:
+                logger.warning(f"Error pinging {url}: {e}")
+            await asyncio.sleep(PING_INTERVAL)
 
 async def periodic_cleanup():
     while True:
         try:
             now = datetime.now()
+            active_thumbs = set(USER_THUMBS.values())
             for p in TMP.iterdir():
                 try:
-                    if p.is_file():
+                    if p.is_file() and str(p) not in active_thumbs:
                         if now - datetime.fromtimestamp(p.stat().st_mtime) > timedelta(days=3):
                             p.unlink()
                 except Exception:
                     pass
         except Exception:
             pass
+        prune_progress_reporters()
         await asyncio.sleep(3600)
 
+def benchmark_metadata_probe(paths: list, rounds: int = 5):
+    for path in map(Path, paths):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            header = probe_media_header(path)
+        header_ms = (time.perf_counter() - start) * 1000 / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy = get_video_metadata_ffprobe(path)
+        legacy_ms = (time.perf_counter() - start) * 1000 / rounds
+
+        print(f"{path.name}: header={header_ms:.2f}ms ffprobe+hachoir={legacy_ms:.2f}ms "
+              f"speedup={legacy_ms / header_ms if header_ms else 0:.1f}x")
+        print(f"  header: {header}")
+        print(f"  ffprobe: {legacy}")
+
+LAZY_IMPORT_NAMES = ("yt_dlp", "PIL.Image", "hachoir.parser", "hachoir.metadata")
+
+def report_startup_profile():
+    startup_mark("handlers registered")
+    print(f"Startup: {(STARTUP_MARKS[-1][1] - STARTUP_T0) * 1000:.1f}ms until ready to run")
+    print("\nImports (inclusive ms, by top-level import):")
+    for name, secs in sorted(STARTUP_IMPORTS.items(), key=lambda kv: -kv[1]):
+        print(f"  {name:<32} {secs * 1000:9.1f}")
+    print("\nInitialization phases (ms):")
+    previous = STARTUP_T0
+    for label, mark in STARTUP_MARKS:
+        print(f"  {label:<32} {(mark - previous) * 1000:9.1f}")
+        previous = mark
+    print("\nDeferred until first use (ms):")
+    for name in LAZY_IMPORT_NAMES:
+        start = time.perf_counter()
+        try:
+            lazy_module(name)
+            print(f"  {name:<32} {(time.perf_counter() - start) * 1000:9.1f}")
+        except ImportError as e:
+            print(f"  {name:<32} not installed ({e})")
+
 if __name__ == "__main__":
-    print("Bot চালু হচ্ছে... Flask and Ping threads start করা হচ্ছে, তারপর Pyrogram চালু হবে।")
-    t = threading.Thread(target=run_flask_and_ping, daemon=True)
-    t.start()
+    if STARTUP_PROFILE:
+        report_startup_profile()
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "--bench-probe":
+        benchmark_metadata_probe(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "--bench-caption":
+        benchmark_caption_engine(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1000)
+        sys.exit(0)
+
+    print("Bot চালু হচ্ছে... Status server ও Ping চালু করা হচ্ছে, তারপর Pyrogram চালু হবে।")
     try:
         loop = asyncio.get_event_loop()
+        loop.run_until_complete(start_status_server())
+        loop.create_task(loop_lag_monitor())
+        loop.create_task(keep_alive_pinger())
         loop.create_task(periodic_cleanup())
+        loop.create_task(expiring_state_janitor())
+        loop.create_task(resume_pending_broadcasts())
+        loop.create_task(settings_flush_loop())
+        loop.create_task(channel_refresh_loop())
     except RuntimeError:
         pass
     app.run()
+    try:
+        asyncio.get_event_loop().run_until_complete(flush_user_settings())
+    except Exception as e:
+        logger.warning(f"Final settings flush failed: {e}")
+    try:
+        asyncio.get_event_loop().run_until_complete(stop_upload_sessions())
+    except Exception as e:
+        logger.warning(f"Upload session shutdown failed: {e}")
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# main.py builds its client, tmp/ directory and SQLite store at import time, so the
+# environment and working directory have to be in place before any test imports it.
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = tempfile.mkdtemp(prefix="bot-tests-")
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ["BOT_DB_FILE"] = os.path.join(WORKDIR, "bot_state.db")
+os.chdir(WORKDIR)
+sys.path.insert(0, str(ROOT))
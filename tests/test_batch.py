@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+UID = 818181
+
+
+def batch_item(file_id, video=True):
+    file_info = SimpleNamespace(file_id=file_id, file_name=f"{file_id}.mkv", thumbs=[SimpleNamespace(file_id=f"thumb-{file_id}")], duration=60 if video else 0, width=1280, height=720)
+    return main.BatchItem(SimpleNamespace(video=file_info if video else None), file_info)
+
+
+class FakeBatchClient:
+    def __init__(self, bad):
+        self.bad = set(bad)
+        self.sent = []
+
+    async def send_media_group(self, chat_id, media):
+        if any(item.media in self.bad for item in media):
+            raise Exception("MEDIA_INVALID")
+        self.sent += [(item.media, item.caption, item.thumb) for item in media]
+
+    async def send_video(self, chat_id, video, caption=None, thumb=None, **kwargs):
+        if video in self.bad:
+            raise Exception("MEDIA_INVALID")
+        self.sent.append((video, caption, thumb))
+
+    async def send_document(self, chat_id, document, caption=None, thumb=None, **kwargs):
+        await self.send_video(chat_id, document, caption, thumb)
+
+
+@pytest.fixture
+def batch_user(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_SEND_LIMITER", main.RateLimiter(rate=1000, burst=100))
+    main.USER_CAPTIONS[UID] = "Episode [01]"
+    main.USER_COUNTERS.pop(UID, None)
+    yield UID
+    main.USER_CAPTIONS.pop(UID, None)
+    main.USER_COUNTERS.pop(UID, None)
+
+
+def test_failed_album_is_resent_item_by_item(batch_user):
+    summary = []
+
+    async def reply_text(text):
+        return SimpleNamespace(edit=lambda text: asyncio.sleep(0, summary.append(text)))
+
+    items = [batch_item("a"), batch_item("b"), batch_item("c"), batch_item("d"), batch_item("e", video=False)]
+    client = FakeBatchClient(bad={"b", "e"})
+    message = SimpleNamespace(from_user=SimpleNamespace(id=batch_user), chat=SimpleNamespace(id=1), reply_text=reply_text)
+    asyncio.run(main.run_caption_batch(client, message, items))
+
+    assert client.sent == [
+        ("a", "**Episode 01**", "thumb-a"), ("c", "**Episode 03**", "thumb-c"), ("d", "**Episode 04**", "thumb-d"),
+    ]
+    assert summary == ["Batch processing complete. পাঠানো: 3, ব্যর্থ: 2\nব্যর্থ আইটেম: 2, 5"]
+    # Item 5 was the last one, so its number goes back; item 2 keeps its gap.
+    assert main.USER_COUNTERS[batch_user]['uploads'] == 4
+
+
+def test_album_goes_out_in_one_call(batch_user):
+    items = [batch_item(name) for name in "abc"]
+    client = FakeBatchClient(bad=())
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=batch_user), chat=SimpleNamespace(id=1),
+        reply_text=lambda text: asyncio.sleep(0, SimpleNamespace(edit=lambda text: asyncio.sleep(0))),
+    )
+    calls = []
+    send_media_group = client.send_media_group
+    client.send_media_group = lambda *args: calls.append(1) or send_media_group(*args)
+    asyncio.run(main.run_caption_batch(client, message, items))
+    assert len(calls) == 1
+    assert [caption for _, caption, _ in client.sent] == ["**Episode 01**", "**Episode 02**", "**Episode 03**"]
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from pyrogram.errors import UserIsBlocked
+
+import main
+
+ADMIN = 900000
+AUDIENCE = [900001, 900002, 900003, 900004, 900005]
+
+
+class FakeBroadcastClient:
+    def __init__(self, crash_on=None, blocked=()):
+        self.crash_on = crash_on
+        self.blocked = set(blocked)
+        self.sent = []
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids):
+        if chat_id == self.crash_on:
+            # Simulates the bot going down mid-page: the task dies without finishing the page.
+            asyncio.current_task().cancel()
+            await asyncio.sleep(0)
+        if chat_id in self.blocked:
+            raise UserIsBlocked()
+        self.sent.append(chat_id)
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def audience(monkeypatch):
+    monkeypatch.setattr(main, "BROADCAST_PAGE_SIZE", 2)
+    monkeypatch.setattr(main, "BROADCAST_RATE", 1000)
+    main.bot_db_execute("DELETE FROM subscribers")
+    main.bot_db_execute("DELETE FROM broadcasts")
+    main.bot_db_execute("INSERT INTO subscribers (chat_id, added_at) VALUES (?, 0)", [(cid,) for cid in [ADMIN] + AUDIENCE], many=True)
+    yield
+    main.bot_db_execute("DELETE FROM subscribers")
+    main.bot_db_execute("DELETE FROM broadcasts")
+    main.SUBSCRIBERS.difference_update([ADMIN] + AUDIENCE)
+    main.TASKS.pop(ADMIN, None)
+
+
+def run(client, job):
+    async def go():
+        try:
+            await main.run_broadcast(client, job, asyncio.Event())
+        except asyncio.CancelledError:
+            pass
+    asyncio.run(go())
+
+
+def test_broadcast_resumes_from_the_last_checkpoint(audience):
+    job = main.create_broadcast_job(ADMIN, 1, ADMIN, 2)
+    first = FakeBroadcastClient(crash_on=AUDIENCE[3])
+    run(first, job)
+    # Pages are [admin, 1], [2, 3], [4, 5]; the admin's own chat is skipped.
+    assert first.sent[:3] == AUDIENCE[:3]
+
+    [stored] = main.load_running_broadcasts()
+    assert (stored["cursor"], stored["sent"]) == (AUDIENCE[2], 3)
+    second = FakeBroadcastClient(blocked={AUDIENCE[3]})
+    run(second, stored)
+    assert second.sent == [AUDIENCE[4]]
+    assert (stored["state"], stored["sent"], stored["pruned"]) == ("done", 4, 1)
+    assert main.load_running_broadcasts() == []
+    assert main.next_broadcast_page(AUDIENCE[2]) == [AUDIENCE[4]]
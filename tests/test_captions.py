@@ -0,0 +1,97 @@
+import pytest
+
+import main
+
+TEMPLATES = [
+    "Episode [01] [re (480p, 720p, 1080p)]\n[Finale (03)]",
+    "[(001)] - [re (SD, HD)] [Special (2)]",
+    "Plain caption [05]",
+    "No placeholders at all",
+    "Quality only [re (360p, 480p)]",
+]
+
+
+def legacy_sequence(template: str, count: int) -> list:
+    state = {'uploads': 0, 'episode_numbers': {}, 'dynamic_counters': {}, 're_options_count': 0}
+    return [main.legacy_render_caption(state, template) for _ in range(count)]
+
+
+@pytest.mark.parametrize("template", TEMPLATES)
+def test_compiled_captions_match_legacy(template):
+    main.compile_caption_template.cache_clear()
+    assert not main.compile_caption_template(template).legacy_only
+    assert main.render_caption_range(template, 1, 12) == legacy_sequence(template, 12)
+    assert [main.render_caption(template, n) for n in (7, 3, 12)] == [legacy_sequence(template, 12)[n - 1] for n in (7, 3, 12)]
+
+
+def test_ambiguous_template_falls_back_to_legacy():
+    template = "Ep [01] [re ([a], b)]"
+    main.compile_caption_template.cache_clear()
+    assert main.compile_caption_template(template).legacy_only
+    assert main.render_caption_range(template, 1, 5) == legacy_sequence(template, 5)
+
+
+@pytest.fixture
+def captioned_user():
+    uid = 424242
+    main.USER_CAPTIONS[uid] = "Episode [01] [re (480p, 720p)]"
+    main.USER_COUNTERS.pop(uid, None)
+    yield uid
+    main.USER_CAPTIONS.pop(uid, None)
+    main.USER_COUNTERS.pop(uid, None)
+
+
+def test_slots_are_numbered_at_reservation(captioned_user):
+    first = main.reserve_caption_slots(captioned_user, 2)
+    second = main.reserve_caption_slot(captioned_user)
+    assert [s['number'] for s in first] == [1, 2]
+    assert second['number'] == 3
+    # The caption depends on the reserved number, not on upload order.
+    assert main.resolve_job_caption(captioned_user, "b.mkv", caption_slot=second) == "**Episode 02 480p**"
+    assert main.resolve_job_caption(captioned_user, "a.mkv", caption_slot=first[1]) == "**Episode 01 720p**"
+
+
+def test_release_only_rolls_back_the_newest_reservation(captioned_user):
+    first = main.reserve_caption_slots(captioned_user, 2)
+    second = main.reserve_caption_slots(captioned_user, 2)
+    main.release_caption_slots(captioned_user, first)
+    assert main.USER_COUNTERS[captioned_user]['uploads'] == 4
+    main.release_caption_slots(captioned_user, second[1:])
+    assert main.USER_COUNTERS[captioned_user]['uploads'] == 3
+    main.release_caption_slots(captioned_user, [first[0], second[0]])
+    assert main.USER_COUNTERS[captioned_user]['uploads'] == 3
+    main.release_caption_slots(captioned_user, [second[0]])
+    assert main.reserve_caption_slot(captioned_user)['number'] == 3
+
+
+def test_release_after_caption_change_is_ignored(captioned_user):
+    slots = main.reserve_caption_slots(captioned_user, 2)
+    main.USER_CAPTIONS[captioned_user] = "New [01]"
+    main.release_caption_slots(captioned_user, slots)
+    assert main.USER_COUNTERS[captioned_user]['uploads'] == 2
+
+
+def test_no_caption_reserves_empty_slots():
+    assert main.reserve_caption_slots(999999, 3) == [None, None, None]
+    main.release_caption_slots(999999, [None, None])
+    assert main.resolve_job_caption(999999, "file.mkv", caption_slot=None) == "**file.mkv**"
+
+
+def test_legacy_range_renders_incrementally(monkeypatch):
+    template = "Ep [01] [re ([a], b)]"
+    main.compile_caption_template.cache_clear()
+    compiled = main.compile_caption_template(template)
+    expected = legacy_sequence(template, 40)
+    calls = []
+    legacy = main.legacy_render_caption
+    monkeypatch.setattr(main, "legacy_render_caption", lambda *args: calls.append(1) or legacy(*args))
+    assert compiled.render_range(1, 40) == expected
+    assert len(calls) == 40
+
+
+def test_legacy_quality_override_replaces_the_slot():
+    template = "HD Ep [01] [re ([a], HD)]"
+    main.compile_caption_template.cache_clear()
+    assert main.compile_caption_template(template).legacy_only
+    assert main.render_caption(template, 2, "1080p") == "**HD Ep 01 1080p**"
+    assert main.render_caption(template, 3) == legacy_sequence(template, 3)[2]
@@ -0,0 +1,120 @@
+import struct
+
+import pytest
+
+import main
+
+
+def box(kind: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def mp4_trak(handler: bytes, codec: bytes, width: int = 0, height: int = 0, language: str = "und", tkhd_version: int = 0, sample_dims: bool = True) -> bytes:
+    # A v1 tkhd carries 64-bit times, which moves width/height from offset 76 to 88.
+    tkhd = bytes([tkhd_version]) + bytes(87 if tkhd_version else 75) + struct.pack(">II", width << 16, height << 16)
+    packed = 0
+    for ch in language:
+        packed = (packed << 5) | (ord(ch) - 0x60)
+    mdhd = bytes(20) + struct.pack(">H", packed) + bytes(2)
+    hdlr = bytes(8) + handler + bytes(12)
+    entry = struct.pack(">I", 86) + codec + bytes(24) + struct.pack(">HH", *((width, height) if sample_dims else (0, 0))) + bytes(50)
+    stsd = bytes(4) + struct.pack(">I", 1) + entry
+    minf = box(b"minf", box(b"stbl", box(b"stsd", stsd)))
+    return box(b"trak", box(b"tkhd", tkhd) + box(b"mdia", box(b"mdhd", mdhd) + box(b"hdlr", hdlr) + minf))
+
+
+def mp4_file(moov_at_end: bool = False, mdat_size: int = 4096) -> bytes:
+    mvhd = bytes(12) + struct.pack(">II", 1000, 90_500)
+    moov = box(b"moov", box(b"mvhd", mvhd) + mp4_trak(b"vide", b"avc1", 1280, 720) + mp4_trak(b"soun", b"mp4a", language="jpn"))
+    ftyp = box(b"ftyp", b"isom" + bytes(4))
+    mdat = box(b"mdat", bytes(mdat_size))
+    return ftyp + mdat + moov if moov_at_end else ftyp + moov + mdat
+
+
+def ebml(element_id: int, body: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    size = len(body)
+    size_bytes = bytes([0x80 | size]) if size < 0x7F else (0x4000 | size).to_bytes(2, "big")
+    return id_bytes + size_bytes + body
+
+
+def mkv_file() -> bytes:
+    info = ebml(main.MKV_INFO_ID, ebml(main.MKV_TIMECODE_SCALE_ID, (1_000_000).to_bytes(3, "big")) + ebml(main.MKV_DURATION_ID, struct.pack(">d", 61_250.0)))
+    video = ebml(main.MKV_TRACK_ENTRY_ID, (
+        ebml(main.MKV_TRACK_TYPE_ID, b"\x01") + ebml(main.MKV_CODEC_ID, b"V_MPEG4/ISO/AVC")
+        + ebml(main.MKV_VIDEO_ID, ebml(main.MKV_PIXEL_WIDTH_ID, (1920).to_bytes(2, "big")) + ebml(main.MKV_PIXEL_HEIGHT_ID, (1080).to_bytes(2, "big")))
+    ))
+    audio = ebml(main.MKV_TRACK_ENTRY_ID, (
+        ebml(main.MKV_TRACK_TYPE_ID, b"\x02") + ebml(main.MKV_CODEC_ID, b"A_OPUS")
+        + ebml(main.MKV_LANGUAGE_ID, b"jpn") + ebml(main.MKV_NAME_ID, b"Japanese")
+    ))
+    tracks = ebml(main.MKV_TRACKS_ID, video + audio)
+    cluster = ebml(main.MKV_CLUSTER_ID, bytes(64))
+    header = ebml(main.MKV_EBML_ID, ebml(0x4282, b"matroska"))
+    return header + ebml(main.MKV_SEGMENT_ID, info + tracks + cluster)
+
+
+def file_reader(data: bytes):
+    def read_at(offset, size):
+        return data[offset:offset + max(0, min(size, len(data) - offset))]
+    return read_at
+
+
+def test_mp4_header():
+    data = mp4_file()
+    info = main.parse_container_header(file_reader(data), len(data))
+    assert (info['duration_us'], info['width'], info['height']) == (90_500_000, 1280, 720)
+    assert info['codecs'] == ["avc1", "mp4a"]
+    assert info['audio_tracks'] == [{'stream_index': 1, 'title': 'N/A', 'language': 'jpn', 'codec': 'mp4a'}]
+
+
+@pytest.mark.parametrize("version", [0, 1])
+def test_mp4_tkhd_dimensions(version):
+    trak = mp4_trak(b"vide", b"hvc1", 3840, 2160, tkhd_version=version, sample_dims=False)
+    track = main._parse_mp4_trak(file_reader(trak), 8, len(trak))
+    assert (track['width'], track['height']) == (3840, 2160)
+
+
+def test_mkv_header():
+    data = mkv_file()
+    info = main.parse_container_header(file_reader(data), len(data))
+    assert (info['duration_us'], info['width'], info['height']) == (61_250_000, 1920, 1080)
+    assert info['codecs'] == ["V_MPEG4/ISO/AVC", "A_OPUS"]
+    assert info['audio_tracks'] == [{'stream_index': 1, 'title': 'Japanese', 'language': 'jpn', 'codec': 'A_OPUS'}]
+
+
+def test_probe_media_header_reads_file(tmp_path):
+    path = tmp_path / "clip.mkv"
+    path.write_bytes(mkv_file())
+    assert main.get_video_metadata(path) == {'duration': 61, 'width': 1920, 'height': 1080}
+
+
+def test_unknown_container():
+    data = b"RIFF" + bytes(64)
+    assert main.parse_container_header(file_reader(data), len(data)) is None
+
+
+def test_sparse_header_with_moov_at_end():
+    data = mp4_file(moov_at_end=True, mdat_size=1 << 20)
+    head = (0, data[:4096])
+    tail_start = len(data) - 2048
+    tail = (tail_start, data[tail_start:])
+    assert main.parse_sparse_header([head], len(data)) is None
+    info = main.parse_sparse_header([head, tail], len(data))
+    assert (info['width'], info['height']) == (1280, 720)
+
+
+def test_sparse_reader_stitches_and_clamps():
+    data = bytes(range(200))
+    read_at = main.sparse_reader([(0, data[:100]), (100, data[100:])], total_size=len(data))
+    assert read_at(90, 20) == data[90:110]
+    assert read_at(190, 50) == data[190:]
+
+
+def test_sparse_reader_rejects_short_reads():
+    data = bytes(range(200))
+    read_at = main.sparse_reader([(0, data[:100]), (150, data[150:])], total_size=len(data))
+    with pytest.raises(ValueError):
+        read_at(90, 20)
+    with pytest.raises(ValueError):
+        read_at(120, 4)
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def test_background_download_wait_stops_on_cancel(tmp_path):
+    async def run():
+        download = asyncio.create_task(asyncio.sleep(3600))
+        cancel_event = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, cancel_event.set)
+        with pytest.raises(Exception, match="Cancelled"):
+            await main.wait_background_download(download, tmp_path / "in.mkv", cancel_event)
+        await asyncio.sleep(0)
+        return download.cancelled()
+
+    assert asyncio.run(run())
+
+
+def test_background_download_wait_returns_the_file(tmp_path):
+    path = tmp_path / "in.mkv"
+
+    async def download():
+        path.write_bytes(b"data")
+
+    async def run():
+        await main.wait_background_download(asyncio.create_task(download()), path, asyncio.Event())
+
+    asyncio.run(run())
+    assert path.read_bytes() == b"data"
+
+
+def test_closing_a_reporter_renders_the_last_update():
+    edits = []
+
+    class FakeMessage:
+        chat = type("Chat", (), {"id": 1})
+        id = 99
+
+        async def edit(self, text, reply_markup=None):
+            edits.append(text)
+
+    async def run():
+        message = FakeMessage()
+        reporter = main.get_progress_reporter(message, "ডাউনলোড হচ্ছে...", 100)
+        await asyncio.sleep(0)
+        reporter.update(40)
+        reporter.update(100)
+        await asyncio.sleep(0)
+        await main.close_progress_reporter(message)
+
+    asyncio.run(run())
+    assert "100.0%" in edits[-1]
+    assert not any("100.0%" in text for text in edits[:-1])
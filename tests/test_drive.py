@@ -0,0 +1,207 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+import main
+
+EMBED_PAGE = """
+<div class="flip-entries">
+<div class="flip-entry" id="entry-fileE10" tabindex="0" role="link">
+  <div class="flip-entry-info">
+    <a href="https://drive.google.com/file/d/fileE10/view?usp=drive_web" target="_blank">
+      <div class="flip-entry-thumb"><img src="thumb.png"></div>
+      <div class="flip-entry-visual"><div class="flip-entry-title">Show E10.mkv</div></div>
+    </a>
+  </div>
+  <div class="flip-entry-last-modified"><div>Jan 1</div></div>
+</div>
+<div class="flip-entry" id="entry-sub1" tabindex="0" role="link">
+  <div class="flip-entry-info">
+    <a href="https://drive.google.com/drive/folders/sub1" target="_blank">
+      <div class="flip-entry-title">Extras</div>
+    </a>
+  </div>
+</div>
+<div class="flip-entry" id="entry-fileE2" tabindex="0" role="link">
+  <div class="flip-entry-info">
+    <a href="https://drive.google.com/file/d/fileE2/view?usp=drive_web" target="_blank">
+      <div class="flip-entry-title">Show E2 &amp; more.mkv</div>
+    </a>
+  </div>
+</div>
+</div>
+"""
+
+PAYLOAD = bytes(range(256)) * 8192  # 2 MiB
+
+
+def drive_stand_in(ranges_seen: list) -> web.Application:
+    async def folder_view(request):
+        return web.Response(text=EMBED_PAGE, content_type="text/html")
+
+    async def download(request):
+        headers = {"Content-Disposition": 'attachment; filename="Show E2.mkv"'}
+        range_header = request.headers.get("Range")
+        ranges_seen.append(range_header)
+        if range_header:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            headers["Content-Range"] = f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"
+            return web.Response(body=PAYLOAD[start:], status=206, headers=headers)
+        return web.Response(body=PAYLOAD, headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/embeddedfolderview", folder_view)
+    app.router.add_get("/uc", download)
+    return app
+
+
+async def serve(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_natural_sort_key_orders_episode_numbers():
+    names = ["Show E10.mkv", "show e2.mkv", "Show E1.mkv", "Show E11.mkv"]
+    assert sorted(names, key=main.natural_sort_key) == ["Show E1.mkv", "show e2.mkv", "Show E10.mkv", "Show E11.mkv"]
+
+
+def test_extract_drive_folder_id():
+    assert main.extract_drive_folder_id("https://drive.google.com/drive/folders/1AbC_d-9?usp=sharing") == "1AbC_d-9"
+    assert main.extract_drive_folder_id("https://drive.google.com/drive/u/0/folders/XyZ") == "XyZ"
+    assert main.extract_drive_folder_id("https://drive.google.com/embeddedfolderview?id=F00") == "F00"
+    assert main.extract_drive_folder_id("https://drive.google.com/file/d/abc/view") is None
+    assert main.extract_drive_folder_id("https://example.com/folders/abc") is None
+
+
+def test_embed_regex_tolerates_wrapper_markup():
+    entries = main.DRIVE_EMBED_ENTRY.findall(EMBED_PAGE)
+    assert [(file_id, name) for file_id, _, name in entries] == [
+        ("fileE10", "Show E10.mkv"), ("sub1", "Extras"), ("fileE2", "Show E2 &amp; more.mkv"),
+    ]
+
+
+def test_list_drive_folder_from_embed_page(monkeypatch):
+    async def run():
+        runner, base = await serve(drive_stand_in([]))
+        monkeypatch.setattr(main, "DRIVE_BASE_URL", base)
+        monkeypatch.setattr(main, "DRIVE_API_KEY", "")
+        try:
+            async with aiohttp.ClientSession() as sess:
+                return await main.list_drive_folder(sess, "root")
+        finally:
+            await runner.cleanup()
+
+    files = asyncio.run(run())
+    assert files == [("fileE10", "Show E10.mkv"), ("fileE2", "Show E2 & more.mkv")]
+    assert [name for _, name in sorted(files, key=lambda f: main.natural_sort_key(f[1]))] == ["Show E2 & more.mkv", "Show E10.mkv"]
+
+
+def test_download_drive_file_resumes_with_range(monkeypatch, tmp_path):
+    out = tmp_path / "partial.mkv"
+    out.write_bytes(PAYLOAD[:1536 * 1024])
+    ranges_seen = []
+
+    async def run():
+        runner, base = await serve(drive_stand_in(ranges_seen))
+        monkeypatch.setattr(main, "DRIVE_BASE_URL", base)
+        try:
+            meta = {}
+            result = await main.download_drive_file("fileE2", out, resume=True, meta=meta)
+            return result, meta
+        finally:
+            await runner.cleanup()
+
+    (ok, err), meta = asyncio.run(run())
+    assert ok, err
+    assert ranges_seen == [f"bytes={1536 * 1024}-"]
+    assert out.read_bytes() == PAYLOAD
+    assert meta["filename"] == "Show E2.mkv"
+
+
+def test_bulk_urls_expand_drive_folders(monkeypatch):
+    async def run():
+        runner, base = await serve(drive_stand_in([]))
+        monkeypatch.setattr(main, "DRIVE_BASE_URL", base)
+        monkeypatch.setattr(main, "DRIVE_API_KEY", "")
+        try:
+            async with aiohttp.ClientSession() as sess:
+                return await main.expand_bulk_urls(sess, [
+                    "https://example.com/a.mp4",
+                    "https://drive.google.com/drive/folders/root",
+                    "https://example.com/b.mp4",
+                ])
+        finally:
+            await runner.cleanup()
+
+    entries = asyncio.run(run())
+    assert [(e.index, e.kind, e.name) for e in entries] == [
+        (1, None, None), (2, "drive", "Show E2 & more.mkv"), (3, "drive", "Show E10.mkv"), (4, None, None),
+    ]
+    assert main.extract_drive_id(entries[1].url) == "fileE2"
+    assert main.url_download_name(entries[1].url, entries[1].name) == "Show E2 & more.mkv"
+
+
+def test_unlistable_drive_folder_becomes_failed_entry(monkeypatch):
+    async def run():
+        runner, base = await serve(web.Application())
+        monkeypatch.setattr(main, "DRIVE_BASE_URL", base)
+        monkeypatch.setattr(main, "DRIVE_API_KEY", "")
+        try:
+            async with aiohttp.ClientSession() as sess:
+                return await main.expand_bulk_urls(sess, ["https://drive.google.com/drive/folders/gone"])
+        finally:
+            await runner.cleanup()
+
+    (entry,) = asyncio.run(run())
+    assert entry.state == "failed"
+    assert "HTTP 404" in entry.error
+
+
+def test_bulk_drive_entry_resumes_after_a_dropped_transfer(monkeypatch):
+    ranges_seen = []
+    disposition = {"Content-Disposition": 'attachment; filename="Show E2.mkv"'}
+
+    async def folder_view(request):
+        return web.Response(text=EMBED_PAGE, content_type="text/html")
+
+    async def flaky_download(request):
+        range_header = request.headers.get("Range")
+        ranges_seen.append(range_header)
+        if range_header:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            headers = {**disposition, "Content-Range": f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"}
+            return web.Response(body=PAYLOAD[start:], status=206, headers=headers)
+        # The connection drops halfway through the first transfer.
+        resp = web.StreamResponse(headers={**disposition, "Content-Length": str(len(PAYLOAD))})
+        await resp.prepare(request)
+        await resp.write(PAYLOAD[:len(PAYLOAD) // 2])
+        request.transport.close()
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/embeddedfolderview", folder_view)
+    app.router.add_get("/uc", flaky_download)
+
+    async def run():
+        runner, base = await serve(app)
+        monkeypatch.setattr(main, "DRIVE_BASE_URL", base)
+        monkeypatch.setattr(main, "DRIVE_API_KEY", "")
+        try:
+            async with aiohttp.ClientSession() as sess:
+                (entry, _) = await main.expand_bulk_urls(sess, ["https://drive.google.com/drive/folders/root"])
+                await main.download_bulk_entry(sess, entry, 4242, None, asyncio.Event())
+                return entry
+        finally:
+            await runner.cleanup()
+
+    entry = asyncio.run(run())
+    assert entry.state == "downloaded", entry.error
+    assert entry.source_key == "drive:fileE2"
+    assert ranges_seen[0] is None and ranges_seen[1] == f"bytes={len(PAYLOAD) // 2}-"
+    assert entry.path.read_bytes() == PAYLOAD
+    entry.path.unlink()
@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+UID = 515151
+
+
+def fake_message(**media):
+    fields = {"text": None, "photo": None, "video": None, "document": None, "from_user": SimpleNamespace(id=UID), "id": 1}
+    fields.update(media)
+    return SimpleNamespace(**fields)
+
+
+@pytest.fixture(autouse=True)
+def clean_modes():
+    yield
+    for flag in (main.EDIT_CAPTION_MODE, main.SET_CAPTION_REQUEST, main.CREATE_POST_MODE, main.SET_THUMB_REQUEST, main.MKV_AUDIO_CHANGE_MODE):
+        flag.discard(UID)
+    main.USER_ROUTES.pop(UID, None)
+
+
+def test_idle_user_routes():
+    routes = main.build_user_routes(UID)
+    assert routes["text"] == (main.route_audio_order_reply, main.route_url_text)
+    assert routes["photo"] == ()
+    assert routes["file"] == (main.route_enqueue_file,)
+
+
+def test_mode_flags_add_handlers_in_priority_order():
+    main.EDIT_CAPTION_MODE.add(UID)
+    main.CREATE_POST_MODE.add(UID)
+    routes = main.build_user_routes(UID)
+    assert routes["text"] == (main.route_batch_keywords, main.route_audio_order_reply, main.route_post_creation_text, main.route_url_text)
+    assert routes["photo"] == (main.route_post_image,)
+    assert routes["file"] == (main.route_edit_caption_file, main.route_enqueue_file)
+
+
+def test_mode_flag_changes_drop_cached_routes():
+    main.USER_ROUTES[UID] = main.build_user_routes(UID)
+    main.SET_THUMB_REQUEST.add(UID)
+    assert UID not in main.USER_ROUTES
+    main.USER_ROUTES[UID] = main.build_user_routes(UID)
+    assert main.USER_ROUTES[UID]["photo"] == (main.route_thumb_photo,)
+    main.SET_THUMB_REQUEST.discard(UID)
+    assert UID not in main.USER_ROUTES
+
+
+def test_message_kind():
+    assert main.message_kind(fake_message(text="hi")) == "text"
+    assert main.message_kind(fake_message(photo=object())) == "photo"
+    assert main.message_kind(fake_message(document=object())) == "file"
+    assert main.message_kind(fake_message()) is None
+
+
+def test_dispatch_stops_at_first_consuming_handler(monkeypatch):
+    calls = []
+
+    def handler(name, consumes):
+        async def route(c, m, uid):
+            calls.append(name)
+            return consumes
+        return route
+
+    monkeypatch.setattr(main, "ROUTE_TABLE", {
+        "text": ((None, handler("first", False)), (main.EDIT_CAPTION_MODE, handler("edit", True)), (None, handler("last", True))),
+    })
+    asyncio.run(main.dispatch_user_message(None, fake_message(text="x")))
+    assert calls == ["first", "last"]
+
+    calls.clear()
+    main.EDIT_CAPTION_MODE.add(UID)
+    asyncio.run(main.dispatch_user_message(None, fake_message(text="x")))
+    assert calls == ["first", "edit"]
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+ADMIN = 777001
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_ID", ADMIN)
+    monkeypatch.setattr(main, "SETTINGS_STORE", main.SqliteSettingsBackend())
+    main.bot_db_execute("DELETE FROM user_settings")
+    yield ADMIN
+    for state in (main.USER_CAPTIONS, main.USER_COUNTERS, main.SETTINGS_LOADED, main.SETTINGS_LAST_SEEN):
+        state.pop(ADMIN, None)
+        state.pop(ADMIN + 1, None)
+    main.EDIT_CAPTION_MODE.discard(ADMIN)
+    main.TRANSCODE_MODE.discard(ADMIN)
+
+
+def stored_rows():
+    return main.bot_db_execute("SELECT uid FROM user_settings", fetch=True)
+
+
+def test_only_admins_are_loaded(admin):
+    message = SimpleNamespace(from_user=SimpleNamespace(id=admin + 1))
+    asyncio.run(main.load_settings_on_message(None, message))
+    assert admin + 1 not in main.SETTINGS_LOADED
+    message.from_user.id = admin
+    asyncio.run(main.load_settings_on_message(None, message))
+    assert admin in main.SETTINGS_LOADED
+
+
+def test_untouched_defaults_are_not_written(admin):
+    asyncio.run(main.ensure_user_settings(None, admin))
+    assert asyncio.run(main.flush_user_settings()) == 0
+    assert stored_rows() == []
+
+
+def test_changes_round_trip(admin):
+    asyncio.run(main.ensure_user_settings(None, admin))
+    main.USER_CAPTIONS[admin] = "Episode [01]"
+    main.EDIT_CAPTION_MODE.add(admin)
+    main.TRANSCODE_MODE.add(admin)
+    assert asyncio.run(main.flush_user_settings()) == 1
+    assert asyncio.run(main.flush_user_settings()) == 0
+
+    main.USER_CAPTIONS.pop(admin)
+    main.EDIT_CAPTION_MODE.discard(admin)
+    main.TRANSCODE_MODE.discard(admin)
+    main.SETTINGS_LOADED.pop(admin)
+    asyncio.run(main.ensure_user_settings(None, admin))
+    assert main.USER_CAPTIONS[admin] == "Episode [01]"
+    assert admin in main.EDIT_CAPTION_MODE
+    assert admin in main.TRANSCODE_MODE
+    assert asyncio.run(main.flush_user_settings()) == 0
+
+
+def test_idle_users_are_forgotten_after_flush(admin, monkeypatch):
+    asyncio.run(main.ensure_user_settings(None, admin))
+    main.USER_CAPTIONS[admin] = "Idle [01]"
+    monkeypatch.setattr(main, "SETTINGS_IDLE_TTL", -1)
+    assert asyncio.run(main.flush_user_settings()) == 1
+    assert admin not in main.SETTINGS_LOADED and admin not in main.SETTINGS_LAST_SEEN
+    assert stored_rows() == [(admin,)]
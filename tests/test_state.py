@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import main
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(main, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def make_state():
+    created = []
+
+    def make(**kwargs):
+        evictions = []
+        kwargs.setdefault("on_evict", lambda key, value, reason: evictions.append((key, value, reason)))
+        state = main.ExpiringState("test_state", **kwargs)
+        created.append(state)
+        return state, evictions
+
+    yield make
+    for state in created:
+        main.EXPIRING_REGISTRIES.remove(state)
+
+
+def test_entries_expire_after_ttl(clock, make_state):
+    state, evictions = make_state(ttl=10, max_items=10)
+    state["a"] = 1
+    clock.now += 9
+    assert state.get("a") == 1
+    clock.now += 2
+    assert "a" not in state
+    assert state.get("a", "gone") == "gone"
+    assert evictions == [("a", 1, "expired")]
+    assert state.evicted == 1
+
+
+def test_sliding_ttl_extends_on_access(clock, make_state):
+    state, evictions = make_state(ttl=10, max_items=10, sliding=True)
+    state["a"] = 1
+    for _ in range(3):
+        clock.now += 8
+        assert state["a"] == 1
+    clock.now += 11
+    with pytest.raises(KeyError):
+        state["a"]
+    assert evictions == [("a", 1, "expired")]
+
+
+def test_capacity_evicts_oldest(clock, make_state):
+    state, evictions = make_state(ttl=100, max_items=2)
+    state["a"] = 1
+    clock.now += 1
+    state["b"] = 2
+    clock.now += 1
+    state["c"] = 3
+    assert state.keys() == ["b", "c"]
+    assert evictions == [("a", 1, "capacity")]
+
+
+def test_pop_skips_the_eviction_hook(clock, make_state):
+    state, evictions = make_state(ttl=10, max_items=10)
+    state["a"] = 1
+    assert state.pop("a") == 1
+    assert state.pop("a", None) is None
+    with pytest.raises(KeyError):
+        state.pop("a")
+    assert evictions == []
+
+
+def test_memory_report_purges_expired(clock, make_state):
+    state, _ = make_state(ttl=5, max_items=10)
+    state["a"] = 1
+    state["b"] = 2
+    clock.now += 6
+    report = state.memory_report()
+    assert (report["name"], report["items"], report["evicted"]) == ("test_state", 0, 2)
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import main
+
+
+def test_parse_renditions():
+    assert main.parse_renditions("480p, 720P ,1080p") == [("480p", 480), ("720P", 720), ("1080p", 1080)]
+    assert main.parse_renditions("HD 720p, SD, 2160p HDR") == [("HD 720p", 720), ("2160p HDR", 2160)]
+    assert main.parse_renditions("") == []
+
+
+def test_select_renditions_never_upscales():
+    renditions = [("480p", 480), ("720p", 720), ("1080p", 1080)]
+    assert main.select_renditions(renditions, 720) == [("480p", 480), ("720p", 720)]
+    assert main.select_renditions(renditions, 2160) == renditions
+    assert main.select_renditions(renditions, 361) == [("480p", 360)]
+    assert main.select_renditions(renditions, 0) == renditions
+
+
+def test_rendition_caption_uses_its_own_label():
+    template = "Ep [01] [re (480p, 720p, 1080p)]"
+    assert main.render_caption(template, 2) == "**Ep 01 720p**"
+    assert main.render_caption(template, 2, "1080p") == "**Ep 01 1080p**"
+    slot = {"template": template, "number": 5, "quality": "480p"}
+    assert main.resolve_job_caption(1, "x.mkv", caption_slot=slot) == "**Ep 02 480p**"
+
+
+def test_run_transcode_kills_on_cancel():
+    async def run():
+        cancel_event = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.2, cancel_event.set)
+        start = time.monotonic()
+        returncode, _ = await main.run_transcode(["sleep", "30"], cancel_event, timeout=60)
+        return returncode, time.monotonic() - start
+
+    returncode, elapsed = asyncio.run(run())
+    assert returncode != 0
+    assert elapsed < 5
+
+
+def test_run_transcode_reports_stderr():
+    returncode, stderr = asyncio.run(main.run_transcode(["sh", "-c", "echo broken >&2; exit 3"], asyncio.Event(), timeout=60))
+    assert (returncode, stderr.strip()) == (3, "broken")
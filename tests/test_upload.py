@@ -0,0 +1,128 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.errors import BadRequest, FilePartMissing, FloodWait, InternalServerError
+
+import main
+
+
+class FakeSession:
+    def __init__(self, fail_parts=()):
+        self.fail_parts = set(fail_parts)
+        self.sent = []
+
+    async def invoke(self, query):
+        await asyncio.sleep(0)
+        if query.file_part in self.fail_parts:
+            self.fail_parts.discard(query.file_part)
+            raise OSError("connection reset")
+        self.sent.append(query.file_part)
+        return True
+
+    async def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def upload_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 16)
+    monkeypatch.setattr(main, "PARALLEL_UPLOAD_INFLIGHT", 1)
+    monkeypatch.setattr(main, "invoke_with_retry", lambda session, query: session.invoke(query))
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(16 * 8))
+    yield path
+    main.UPLOAD_RESUME_STATE.pop(str(path), None)
+
+
+def test_failed_part_is_the_only_one_resent(upload_file, monkeypatch):
+    client = SimpleNamespace(rnd_id=lambda: 77)
+    session = FakeSession(fail_parts={5})
+    monkeypatch.setattr(main, "get_upload_sessions", lambda c: asyncio.sleep(0, [session]))
+
+    with pytest.raises(OSError):
+        asyncio.run(main.parallel_save_file(client, upload_file))
+    first_pass = list(session.sent)
+    assert 5 not in first_pass
+    assert main.UPLOAD_RESUME_STATE[str(upload_file)]['acked'] == set(first_pass)
+
+    session.sent.clear()
+    result = asyncio.run(main.parallel_save_file(client, upload_file))
+    assert sorted(session.sent) == sorted(set(range(8)) - set(first_pass))
+    assert (result.id, result.parts) == (77, 8)
+
+
+def test_missing_part_reported_by_telegram_is_resent(upload_file, monkeypatch):
+    client = SimpleNamespace(rnd_id=lambda: 77)
+    session = FakeSession()
+    monkeypatch.setattr(main, "get_upload_sessions", lambda c: asyncio.sleep(0, [session]))
+    asyncio.run(main.parallel_save_file(client, upload_file))
+
+    main.mark_upload_part_missing(upload_file, 3)
+    session.sent.clear()
+    asyncio.run(main.parallel_save_file(client, upload_file))
+    assert session.sent == [3]
+
+
+def test_transient_upload_errors():
+    assert main.is_transient_upload_error(OSError("reset"))
+    assert main.is_transient_upload_error(TimeoutError())
+    assert main.is_transient_upload_error(FloodWait(value=3))
+    assert main.is_transient_upload_error(InternalServerError())
+    assert main.is_transient_upload_error(FilePartMissing(value=4))
+    assert not main.is_transient_upload_error(BadRequest())
+    assert not main.is_transient_upload_error(main.UploadSessionError("auth key unregistered"))
+
+
+def test_stop_upload_sessions_empties_the_pool(monkeypatch):
+    sessions = [FakeSession(), FakeSession()]
+    monkeypatch.setattr(main, "UPLOAD_SESSION_POOL", list(sessions))
+    asyncio.run(main.stop_upload_sessions())
+    assert main.UPLOAD_SESSION_POOL == []
+    assert all(session.stopped for session in sessions)
+
+
+@pytest.fixture
+def thumb_user():
+    uid = 636363
+    yield uid
+    for state in (main.USER_THUMBS, main.USER_THUMB_FILE_IDS, main.USER_THUMB_TIME):
+        state.pop(uid, None)
+
+
+def test_cache_key_follows_the_thumbnail(thumb_user):
+    frame = main.thumb_cache_identity(thumb_user)
+    main.USER_THUMB_TIME[thumb_user] = 30
+    assert main.thumb_cache_identity(thumb_user) != frame
+    main.USER_THUMBS[thumb_user] = "thumbs/a.jpg"
+    main.USER_THUMB_FILE_IDS[thumb_user] = "photo-a"
+    custom = main.thumb_cache_identity(thumb_user)
+    main.USER_THUMB_FILE_IDS[thumb_user] = "photo-b"
+    assert main.thumb_cache_identity(thumb_user) not in (custom, frame)
+
+
+def test_cached_upload_lookup_and_rejection(thumb_user):
+    sent = []
+
+    async def send_video(chat_id, file_id, caption=None, parse_mode=None):
+        sent.append((chat_id, file_id, caption))
+        if file_id == "stale":
+            raise BadRequest()
+
+    client = SimpleNamespace(send_video=send_video, send_audio=None, send_document=None)
+    message = SimpleNamespace(chat=SimpleNamespace(id=5))
+    key = main.file_id_cache_key("tg:abc", main.thumb_cache_identity(thumb_user))
+    main.store_file_id(key, "good", "video", "Show.mkv", prune=False)
+
+    async def run():
+        assert await main.reuse_cached_upload(client, message, thumb_user, "tg:abc")
+        # A new thumbnail misses the old copy.
+        main.USER_THUMB_TIME[thumb_user] = 9
+        assert await main.lookup_cached_upload(thumb_user, "tg:abc") is None
+        main.USER_THUMB_TIME.pop(thumb_user)
+        main.store_file_id(key, "stale", "video", "Show.mkv", prune=False)
+        assert not await main.reuse_cached_upload(client, message, thumb_user, "tg:abc")
+        return await main.lookup_cached_upload(thumb_user, "tg:abc")
+
+    assert asyncio.run(run()) is None
+    assert sent == [(5, "good", "**Show.mkv**"), (5, "stale", "**Show.mkv**")]
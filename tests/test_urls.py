@@ -0,0 +1,70 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+import main
+
+
+def test_extract_urls_dedupes_and_keeps_order():
+    text = """
+    https://example.com/a.mp4
+    see <https://example.com/b.mkv> and "https://example.com/a.mp4"
+    http://youtu.be/xyz, not-a-url example.com/c.mp4 (https://example.com/d.mp4).
+    """
+    assert main.extract_urls(text) == [
+        "https://example.com/a.mp4", "https://example.com/b.mkv", "http://youtu.be/xyz", "https://example.com/d.mp4",
+    ]
+    assert main.extract_urls(None) == []
+
+
+def test_extract_urls_caps_at_bulk_max(monkeypatch):
+    monkeypatch.setattr(main, "BULK_URL_MAX", 3)
+    text = "\n".join(f"https://example.com/{i}.mp4" for i in range(10))
+    assert len(main.extract_urls(text)) == 3
+
+
+def test_classify_url():
+    async def attachment(request):
+        return web.Response(headers={"Content-Type": "text/plain", "Content-Disposition": "attachment; filename=x.bin"})
+
+    async def video(request):
+        return web.Response(headers={"Content-Type": "video/mp4"})
+
+    async def page(request):
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/dl", attachment)
+    app.router.add_route("HEAD", "/stream", video)
+    app.router.add_route("HEAD", "/watch", page)
+
+    async def run():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        try:
+            async with aiohttp.ClientSession() as sess:
+                return [await main.classify_url(sess, url) for url in (
+                    "https://drive.google.com/file/d/abc/view",
+                    "https://cdn.example.com/show/E01.MKV?token=1",
+                    f"{base}/dl",
+                    f"{base}/stream",
+                    f"{base}/watch",
+                    f"{base}/missing",
+                )]
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == ["drive", "direct", "direct", "direct", "ytdl", "ytdl"]
+
+
+def test_url_download_name_keeps_real_extension():
+    assert main.url_download_name("https://a.com/music/song.mp3?x=1") == "song.mp3"
+    assert main.url_download_name("https://a.com/My%20Show%20E01.mkv") == "My Show E01.mkv"
+    assert main.url_download_name("https://a.com/get.php?id=3") == "get.php.mp4"
+    assert main.url_download_name("https://a.com/get.php?id=3", "Album.flac") == "Album.flac"
+    assert main.url_download_name("https://a.com/video.webm", "noext") == "video.webm"
+    assert main.url_download_name("https://a.com/stream", "title") == "title.mp4"